@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Memory benchmark of parsed linter findings, dicts against `Finding`."""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+import gc
+import os
+import sys
+import tracemalloc
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path.insert(0, REPO_ROOT)
+
+# Local imports
+from ciocheck.linters import Flake8Linter  # noqa: E402
+
+FINDINGS = 200000
+FILES = 2000
+LINE = '{path}:{line}:{column}: E225 missing whitespace around operator\n'
+
+
+def make_output():
+    """Return flake8 like output with `FINDINGS` findings."""
+    lines = []
+    for index in range(FINDINGS):
+        path = '/project/package/module_{0}.py'.format(index % FILES)
+        lines.append(LINE.format(path=path, line=index + 1, column=1))
+    return ''.join(lines)
+
+
+def parse_dicts(linter, output):
+    """Parse findings as plain dicts, the way they were stored before."""
+    return [match.groupdict() for match in linter.regex.finditer(output)]
+
+
+def measure(func, *args):
+    """Return the result of `func` and the memory it still holds."""
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    """Run the memory benchmark and print the results."""
+    output = make_output()
+    linter = Flake8Linter(REPO_ROOT)
+    findings, finding_size = measure(linter._parse, output)
+    dicts, dict_size = measure(parse_dicts, linter, output)
+    assert len(findings) == len(dicts) == FINDINGS
+
+    megabyte = 1024.0 * 1024.0
+    print('{0} findings on {1} files'.format(FINDINGS, FILES))
+    print('dicts:    {0:8.1f} MB'.format(dict_size / megabyte))
+    print('Finding:  {0:8.1f} MB'.format(finding_size / megabyte))
+
+
+if __name__ == '__main__':
+    main()
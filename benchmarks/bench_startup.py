@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Startup time benchmark for `ciocheck --help` and a pep8 only run."""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+HEAVY_MODULES = ('autopep8', 'isort', 'pylint', 'pytest', 'pytest_cov',
+                 'yapf')
+CIOCHECK_CONFIG = u"""[ciocheck]
+branch = origin/master
+diff_mode = commited
+file_mode = all
+check = pep8
+enforce =
+"""
+MODULE_CONTENTS = u'"""Benchmark module."""\n\nVALUE = 1\n'
+
+
+def time_command(args, cwd=None, repeat=5):
+    """Return the best wall time of `repeat` runs of command `args`."""
+    timings = []
+    env = os.environ.copy()
+    env['PYTHONPATH'] = REPO_ROOT
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.call(
+                args, cwd=cwd, env=env, stdout=devnull, stderr=devnull)
+            timings.append(time.time() - start)
+    return min(timings)
+
+
+def imported_heavy_modules():
+    """Return the heavy third party modules imported by `ciocheck.main`."""
+    code = ('import sys, ciocheck.main; '
+            'print(",".join(m for m in {0!r} if m in sys.modules))').format(
+                HEAVY_MODULES)
+    output = subprocess.check_output(
+        [sys.executable, '-c', code], cwd=REPO_ROOT)
+    return [m for m in output.decode().strip().split(',') if m]
+
+
+def make_project():
+    """Create a tiny project configured to run pep8 only."""
+    root = tempfile.mkdtemp(prefix='ciocheck-bench-')
+    package = os.path.join(root, 'package')
+    os.makedirs(package)
+    with open(os.path.join(root, '.ciocheck'), 'w') as file_obj:
+        file_obj.write(CIOCHECK_CONFIG)
+    for name in ('__init__.py', 'module.py'):
+        with open(os.path.join(package, name), 'w') as file_obj:
+            file_obj.write(MODULE_CONTENTS)
+    return root
+
+
+def main():
+    """Run the startup benchmarks and print the results."""
+    ciocheck = [sys.executable, '-m', 'ciocheck.main']
+    python_startup = time_command([sys.executable, '-c', 'pass'])
+    print('python startup:      {0:.3f}s'.format(python_startup))
+
+    help_time = time_command(ciocheck + ['--help'])
+    print('ciocheck --help:     {0:.3f}s'.format(help_time))
+
+    root = make_project()
+    try:
+        pep8_time = time_command(ciocheck + ['package'], cwd=root)
+        print('ciocheck check=pep8: {0:.3f}s'.format(pep8_time))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    heavy = imported_heavy_modules()
+    print('heavy modules imported at startup: {0}'.format(
+        ', '.join(heavy) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Python API to run ciocheck in process.
+
+`check` runs the configured checks and returns a `CheckResults` object,
+instead of printing a report and exiting like the command line does. Checks
+run through a `Checker` per project folder, which keeps the content hashes
+of files between calls, so build systems and bots checking the same project
+again only hash what changed.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import argparse
+import os
+import threading
+
+# Third party imports
+from six import StringIO, string_types
+
+# Local imports
+from ciocheck.config import DEFAULT_CIOCHECK_CONFIG
+from ciocheck.files import Fingerprints
+from ciocheck.findings import Finding
+from ciocheck.main import Runner, split_paths
+from ciocheck.shards import parse_shard
+
+# Options of a run that are not configuration values
+RUN_OPTIONS = {
+    'disable_formatters': False,
+    'disable_linters': False,
+    'disable_tests': False,
+    'force_run': False,
+    'shard': None,
+    'shard_file': None,
+}
+
+
+def make_args(config=None, **options):
+    """Return the equivalent of parsed command line arguments."""
+    values = dict((key, None) for key in DEFAULT_CIOCHECK_CONFIG)
+    values.update(RUN_OPTIONS)
+    unknown = sorted(set(options) - set(values))
+    if unknown:
+        raise TypeError('Unknown options: {0}'.format(', '.join(unknown)))
+
+    for key, value in options.items():
+        default_value = DEFAULT_CIOCHECK_CONFIG.get(key)
+        if value is None or key in RUN_OPTIONS:
+            pass
+        elif isinstance(default_value, list):
+            if isinstance(value, string_types):
+                value = value.split(',')
+            value = list(value)
+        elif not isinstance(default_value, bool):
+            value = str(value)
+        values[key] = value
+
+    if isinstance(values['shard'], string_types):
+        values['shard'] = parse_shard(values['shard'])
+    values['config_file'] = config
+    return argparse.Namespace(**values)
+
+
+class CheckResults(object):
+    """Structured results of a check."""
+
+    def __init__(self, runner, success, output):
+        """Structured results of a check."""
+        self.success = success
+        self.output = output  # The report the command line would print
+        self.cached_run = runner.cached_run
+        self.failed_checks = sorted(runner.failed_checks)
+        self.enforced_failures = runner.enforced_failures()
+        self.timings = OrderedDict(runner.timings)
+        self.slow_files = OrderedDict(runner.slow_files)
+
+        # Results on modified lines, {tool: {path: [result, ...]}}
+        self.results = OrderedDict()
+        for path, tools_report in runner.report.items():
+            for tool_name, reported in tools_report.items():
+                tool_results = self.results.setdefault(tool_name,
+                                                       OrderedDict())
+                tool_results[path] = [result for (result, _) in reported]
+
+        # Modified lines not covered by tests, {path: [line, ...]}
+        self.coverage_gaps = OrderedDict(
+            (path, lines) for path, (lines, _) in runner.coverage_gaps.items())
+
+        self.tests = None
+        if runner.test_results and 'pytest' in runner.test_results:
+            self.tests = runner.test_results['pytest']['report']
+
+    def __bool__(self):
+        """Return if no enforced check failed."""
+        return self.success
+
+    __nonzero__ = __bool__
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    @property
+    def cached(self):
+        """Return if the checks were skipped after a matching run."""
+        return self.cached_run is not None
+
+    @property
+    def findings(self):
+        """Return the linter findings, `{tool: {path: [Finding, ...]}}`."""
+        findings = OrderedDict()
+        for tool_name, tool_results in self.results.items():
+            for path, results in tool_results.items():
+                results = [r for r in results if isinstance(r, Finding)]
+                if results:
+                    findings.setdefault(tool_name, OrderedDict())[path] = (
+                        results)
+        return findings
+
+    @property
+    def diffs(self):
+        """Return the formatter diffs, `{tool: {path: diff}}`."""
+        diffs = OrderedDict()
+        for tool_name, tool_results in self.results.items():
+            for path, results in tool_results.items():
+                for result in results:
+                    diff = result.get('diff')
+                    if diff:
+                        if hasattr(diff, 'render'):
+                            diff = diff.render()
+                        diffs.setdefault(tool_name, OrderedDict())[path] = diff
+        return diffs
+
+
+class Checker(object):
+    """Run checks on a project folder, keeping caches warm between calls."""
+
+    def __init__(self, cmd_root=None):
+        """Run checks on a project folder, keeping caches warm."""
+        self.cmd_root = os.path.abspath(cmd_root or os.getcwd())
+        self.fingerprints = Fingerprints()
+
+    def check(self, paths, config=None, diff_mode=None, file_mode=None,
+              **options):
+        """
+        Run the checks on `paths` and return a `CheckResults` object.
+
+        Parameters
+        ----------
+        paths : list of str
+            Folders and files to check, relative to the project folder.
+        config : str
+            Config file to use, `.ciocheck` by default.
+        diff_mode : str
+            'commited', 'staged' or 'unstaged'.
+        file_mode : str
+            'lines', 'files' or 'all'.
+        options
+            Any other option of the config file (like `check`, `enforce` or
+            `branch`), or `disable_formatters`, `disable_linters`,
+            `disable_tests`, `force_run`, `shard` and `shard_file`.
+        """
+        if isinstance(paths, string_types):
+            paths = [paths]
+        folders, files = split_paths(paths, self.cmd_root)
+        if not folders and not files:
+            raise ValueError('Invalid folders or files: {0}'.format(paths))
+
+        cli_args = make_args(config=config, diff_mode=diff_mode,
+                             file_mode=file_mode, **options)
+        output = StringIO()
+        runner = Runner(self.cmd_root, cli_args, folders=folders, files=files,
+                        stream=output, fingerprints=self.fingerprints)
+        success = runner.execute()
+        if runner.cached_run is not None:
+            runner.print_cached_run(runner.cached_run)
+        else:
+            runner.print_results()
+        runner.print_verdict(success)
+        return CheckResults(runner, success, output.getvalue())
+
+
+_CHECKERS = {}
+_CHECKERS_LOCK = threading.Lock()
+
+
+def get_checker(cmd_root=None):
+    """Return the checker of a project folder, the current one by default."""
+    cmd_root = os.path.abspath(cmd_root or os.getcwd())
+    with _CHECKERS_LOCK:
+        if cmd_root not in _CHECKERS:
+            _CHECKERS[cmd_root] = Checker(cmd_root)
+        return _CHECKERS[cmd_root]
+
+
+def check(paths, config=None, diff_mode=None, file_mode=None, cmd_root=None,
+          **options):
+    """
+    Run the checks on `paths` and return a `CheckResults` object.
+
+    `cmd_root` is the project folder, the current one by default. See
+    `Checker.check` for the other parameters.
+    """
+    return get_checker(cmd_root).check(
+        paths, config=config, diff_mode=diff_mode, file_mode=file_mode,
+        **options)
+
+
+def test():
+    """Main local test."""
+    here = os.path.dirname(os.path.realpath(__file__))
+    results = check([here], cmd_root=os.path.dirname(here), file_mode='all',
+                    check=['pep8'])
+    print(results.success, results.timings, dict(results.findings))
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Content addressable store of per file tool results.
+
+The store is a plain directory that can be shared by several concurrent
+ciocheck runs (a mounted volume or a CI cache folder for example). Entries
+are written to a temporary file and renamed into place, so readers never
+see partial writes. Reading an entry touches its modification time, which
+is used to garbage collect the least recently used entries.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+
+# Local imports
+from ciocheck.config import CACHE_FOLDER
+
+CACHE_DIR_ENV = 'CIOCHECK_CACHE_DIR'
+DEFAULT_CACHE_DIR = os.path.join(CACHE_FOLDER, 'results')
+MEGABYTE = 1024 * 1024
+STALE_TEMP_SECONDS = 3600
+
+
+class ResultStore(object):
+    """Content addressable store of per file tool results."""
+
+    def __init__(self, path, max_size=512):
+        """Content addressable store of per file tool results.
+
+        Parameters
+        ----------
+        path : str
+            Directory of the store, created on first write.
+        max_size : int
+            Size cap in megabytes used by `gc`.
+        """
+        self.path = path
+        self.max_size = int(max_size) * MEGABYTE
+        self.objects_path = os.path.join(path, 'objects')
+        self.stats_path = os.path.join(path, 'stats')
+        self.counters = OrderedDict()
+
+    def _object_path(self, key):
+        """Return the path of the entry for `key`."""
+        return os.path.join(self.objects_path, key[:2], key[2:] + '.json')
+
+    def _count(self, tool_name, counter):
+        """Increase a hit/miss counter for `tool_name`."""
+        counts = self.counters.setdefault(tool_name, {'hits': 0, 'misses': 0})
+        counts[counter] += 1
+
+    def _atomic_write(self, path, data):
+        """Write `data` to `path` through a temporary file and a rename."""
+        folder = os.path.dirname(path)
+        try:
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+
+        handle, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=folder)
+        try:
+            with os.fdopen(handle, 'wb') as file_obj:
+                file_obj.write(data.encode('utf-8'))
+            if os.path.exists(path) and os.name == 'nt':
+                # Same key means same content, nothing to replace
+                return
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _iter_objects(self):
+        """Yield `(path, stat)` of every entry and temporary file."""
+        for root, _, files in os.walk(self.objects_path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    # Removed by a concurrent gc
+                    pass
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def make_key(*parts):
+        """Return a key from json serializable `parts`."""
+        data = json.dumps(parts, sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get(self, tool_name, key):
+        """Return the value stored for `key` or None, counting hits."""
+        path = self._object_path(key)
+        try:
+            with open(path, 'rb') as file_obj:
+                value = json.loads(file_obj.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            self._count(tool_name, 'misses')
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self._count(tool_name, 'hits')
+        return value
+
+    def put(self, tool_name, key, value):
+        """Store json serializable `value` for `key`."""
+        try:
+            self._atomic_write(self._object_path(key), json.dumps(value))
+        except (IOError, OSError):
+            pass
+
+    def save_stats(self):
+        """Save the hit/miss counters of this run."""
+        if self.counters:
+            path = os.path.join(self.stats_path,
+                                '{0}.json'.format(uuid.uuid4().hex))
+            try:
+                self._atomic_write(path, json.dumps(self.counters))
+            except (IOError, OSError):
+                pass
+            self.counters = OrderedDict()
+
+    def stats(self):
+        """Return the aggregated counters per tool and the store size."""
+        tools = {}
+        if os.path.isdir(self.stats_path):
+            for name in sorted(os.listdir(self.stats_path)):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.stats_path, name)) as f_obj:
+                        data = json.load(f_obj)
+                except (IOError, OSError, ValueError):
+                    continue
+                for tool_name, counts in data.items():
+                    totals = tools.setdefault(tool_name,
+                                              {'hits': 0,
+                                               'misses': 0})
+                    totals['hits'] += counts.get('hits', 0)
+                    totals['misses'] += counts.get('misses', 0)
+
+        entries, size = 0, 0
+        for _, stat in self._iter_objects():
+            entries += 1
+            size += stat.st_size
+
+        return {
+            'path': self.path,
+            'entries': entries,
+            'size': size,
+            'max_size': self.max_size,
+            'tools': tools,
+        }
+
+    def gc(self, max_size=None):
+        """
+        Remove least recently used entries until the store fits `max_size`.
+
+        Return `(removed entries, freed bytes)`.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        now = time.time()
+        entries, size = [], 0
+        removed, freed = 0, 0
+        for path, stat in self._iter_objects():
+            if os.path.basename(path).startswith('.tmp-'):
+                # Leftovers of crashed writers
+                if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+            size += stat.st_size
+
+        for _, path, entry_size in sorted(entries):
+            if size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            removed += 1
+            freed += entry_size
+
+        self._compact_stats()
+        return removed, freed
+
+    def _compact_stats(self):
+        """Merge the stats files of past runs into a single file."""
+        if not os.path.isdir(self.stats_path):
+            return
+        names = [n for n in os.listdir(self.stats_path) if n.endswith('.json')]
+        if len(names) < 2:
+            return
+
+        tools = self.stats()['tools']
+        self.counters = OrderedDict(sorted(tools.items()))
+        self.save_stats()
+        for name in names:
+            try:
+                os.remove(os.path.join(self.stats_path, name))
+            except OSError:
+                pass
+
+
+def get_store(cmd_root, config):
+    """Return the result store configured for `cmd_root` or None."""
+    if not config.get_value('cache'):
+        return None
+
+    path = (os.environ.get(CACHE_DIR_ENV) or config.get_value('cache_dir') or
+            DEFAULT_CACHE_DIR)
+    path = os.path.join(cmd_root, os.path.expanduser(path))
+    return ResultStore(path, max_size=config.get_value('cache_size'))
+
+
+def format_stats(stats):
+    """Return a printable report of the stats of a store."""
+    lines = [
+        'Cache: {0}'.format(stats['path']),
+        'Entries: {0}'.format(stats['entries']),
+        'Size: {0:.1f} MB of {1:.1f} MB'.format(
+            stats['size'] / float(MEGABYTE),
+            stats['max_size'] / float(MEGABYTE)),
+        '',
+        '{0:<16}{1:>10}{2:>10}{3:>10}'.format('tool', 'hits', 'misses',
+                                              'hit rate'),
+    ]
+    for tool_name, counts in sorted(stats['tools'].items()):
+        total = counts['hits'] + counts['misses']
+        rate = (100.0 * counts['hits'] / total) if total else 0.0
+        lines.append('{0:<16}{1:>10}{2:>10}{3:>9.1f}%'.format(
+            tool_name, counts['hits'], counts['misses'], rate))
+    return '\n'.join(lines)
+
+
+def test():
+    """Main local test."""
+    store = ResultStore(os.path.join(os.getcwd(), DEFAULT_CACHE_DIR))
+    print(format_stats(store.stats()))
+
+
+if __name__ == '__main__':
+    test()
@@ -8,6 +8,10 @@
 """Configuration module and parameters."""
 
 # Standard library imports
+from collections import OrderedDict
+import ast
+import hashlib
+import json
 import os
 
 # Third party imports
@@ -25,10 +29,15 @@ ALL_FILES = 'all'
 
 # Configuration constants
 DEFAULT_BRANCH = 'origin/master'
+DEFAULT_RENAME_SIMILARITY = 50  # Percentage, like git
 DEFAULT_IGNORE_EXTENSIONS = ('orig', 'pyc')
 DEFAULT_IGNORE_FOLDERS = ('build', '__pychache__')
 MAIN_CONFIG_SECTION = 'ciocheck'
 CONFIGURATION_FILE = '.ciocheck'
+CACHE_FOLDER = '.ciocheck_cache'
+TOOLS_CONFIG_FOLDER = os.path.join(CACHE_FOLDER, 'tools')
+INDEX_FOLDER = os.path.join(CACHE_FOLDER, 'index')
+DIFFS_FOLDER = os.path.join(CACHE_FOLDER, 'diffs')
 COVERAGE_CONFIGURATION_FILE = '.coveragerc'
 
 COPYRIGHT_HEADER_FILE = '.ciocopyright'
@@ -48,6 +57,14 @@ DEFAULT_CIOCHECK_CONFIG = {
     'branch': DEFAULT_BRANCH,
     'diff_mode': STAGED_MODE,
     'file_mode': MODIFIED_LINES,
+    'rename_similarity': str(DEFAULT_RENAME_SIMILARITY),
+    'staged_contents': False,
+    'check_only': False,
+    'max_diff_size': '65536',
+    'command_timeout': '0',
+    'format_timeout': '0',
+    'slowest_files': '0',
+    'jobs': '',
     # Python specific/ pyformat
     'header': DEFAULT_ENCODING_HEADER,
     'copyright_file': COPYRIGHT_HEADER_FILE,
@@ -57,6 +74,14 @@ DEFAULT_CIOCHECK_CONFIG = {
     # Linters/Formatters/Testers
     'check': ['pep8'],
     'enforce': [],
+    # Test selection
+    'select_tests': False,
+    'always_run': [],
+    # Result cache
+    'cache': True,
+    'cache_dir': '',
+    'cache_size': '512',
+    'run_cache': True,
 }
 
 
@@ -95,7 +120,7 @@ class CustomConfigParser(configparser.ConfigParser):
             val = 'true' if value else 'false'
             self.set(self.SECTION, option, val)
         elif isinstance(default_value, list):
-            if default_value:
+            if value:
                 val = ','.join(value)
             else:
                 val = ''
@@ -104,17 +129,171 @@ class CustomConfigParser(configparser.ConfigParser):
             self.set(self.SECTION, option, value)
 
 
-def load_file_config(folder, file_name=None):
+def convert_tool_option(value):
+    """Turn a tool config file value into a python object."""
+    if ',' in value:
+        value = [v for v in value.split(',') if v]
+    elif value.lower() == 'false':
+        value = False
+    elif value.lower() == 'true':
+        value = True
+    else:
+        try:
+            value = ast.literal_eval(value)  # Numbers
+        except Exception:
+            pass
+    return value
+
+
+class ConfigSnapshot(object):
+    """
+    Immutable and fully resolved view of the merged configuration.
+
+    Values of the main section are converted once to python objects and
+    tool sections are kept both as raw strings (to write tool config files)
+    and as python objects (to pass options to tools in process).
+    """
+
+    def __init__(self, sections, sources=()):
+        """Immutable and fully resolved view of the merged configuration."""
+        self._sections = OrderedDict()
+        for section, items in sections.items():
+            self._sections[section] = OrderedDict(items)
+        self._sources = tuple(tuple(source) for source in sources)
+        self._values = {}
+        self._options = {}
+
+        main_section = self._sections.get(MAIN_CONFIG_SECTION, {})
+        for option, val in main_section.items():
+            self._values[option] = self._convert_value(option, val)
+
+        for section, items in self._sections.items():
+            options = {}
+            for key, value in items.items():
+                options[key.replace('-', '_')] = convert_tool_option(value)
+            self._options[section] = options
+
+    def __setattr__(self, name, value):
+        """Only allow to set private attributes on creation."""
+        if name in self.__dict__ or not name.startswith('_'):
+            raise AttributeError('ConfigSnapshot is immutable')
+        super(ConfigSnapshot, self).__setattr__(name, value)
+
+    @staticmethod
+    def _convert_value(option, val):
+        """Turn a main section value into a python object."""
+        default_value = DEFAULT_CIOCHECK_CONFIG.get(option)
+        if isinstance(default_value, bool):
+            value = True if val.lower() == 'true' else False
+        elif isinstance(default_value, list):
+            value = [v.strip() for v in val.split(',')] if val else []
+        else:
+            value = val
+        return value
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    @property
+    def sources(self):
+        """Return `(path, mtime, size, hash)` of every config file read."""
+        return self._sources
+
+    @property
+    def digest(self):
+        """Return a hash identifying the content of the configuration."""
+        data = json.dumps(self._sections, sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def sections(self):
+        """Return the list of section names."""
+        return list(self._sections.keys())
+
+    def has_section(self, section):
+        """Return if `section` exists."""
+        return section in self._sections
+
+    def has_option(self, section, option):
+        """Return if `option` exists in `section`."""
+        return option in self._sections.get(section, {})
+
+    def items(self, section):
+        """Return list of `(option, raw value)` pairs for `section`."""
+        return list(self._sections[section].items())
+
+    def get_value(self, option, section=MAIN_CONFIG_SECTION):
+        """Get config value from the default main section."""
+        if section == MAIN_CONFIG_SECTION:
+            value = self._values[option]
+        else:
+            value = self._options[section][option.replace('-', '_')]
+        return list(value) if isinstance(value, list) else value
+
+    def get_options(self, section):
+        """Return the options of `section` converted to python objects."""
+        return dict(self._options.get(section, {}))
+
+    def to_json(self):
+        """Serialize the snapshot to a json string."""
+        data = {'sections': self._sections, 'sources': self._sources}
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, string):
+        """Create a snapshot from a json string created by `to_json`."""
+        data = json.loads(string, object_pairs_hook=OrderedDict)
+        return cls(data['sections'], data['sources'])
+
+
+def _file_source(path):
+    """Return the `(path, mtime, size, hash)` identity of a config file."""
+    if not os.path.isfile(path):
+        return (path, None, None, None)
+
+    stat = os.stat(path)
+    with open(path, 'rb') as file_obj:
+        digest = hashlib.sha1(file_obj.read()).hexdigest()
+    return (path, stat.st_mtime, stat.st_size, digest)
+
+
+def _is_valid_source(source):
+    """Check that a config file did not change since it was read."""
+    path, mtime, size, digest = source
+    if not os.path.isfile(path):
+        return mtime is None
+
+    if mtime is None:
+        return False
+
+    stat = os.stat(path)
+    if stat.st_mtime == mtime and stat.st_size == size:
+        return True
+    return _file_source(path)[-1] == digest
+
+
+def _snapshot_cache_path(folder, cli_args):
+    """Return the path of the cached snapshot for `folder` and `cli_args`."""
+    keys = sorted(list(DEFAULT_CIOCHECK_CONFIG.keys()) + ['config_file'])
+    args = [(key, getattr(cli_args, key, None)) for key in keys]
+    data = json.dumps([os.path.abspath(folder), args], sort_keys=True)
+    name = hashlib.sha1(data.encode('utf-8')).hexdigest() + '.json'
+    return os.path.join(folder, CACHE_FOLDER, 'config', name)
+
+
+def load_file_config(folder, file_name=None, sources=None):
     """
     Load configuration at `folder` or `file_name` and return the parser.
 
-    file_name is assumed to be located on folder.
+    file_name is assumed to be located on folder. If `sources` is a list,
+    the identity of every config file read is appended to it.
     """
     if file_name is None:
         config_path = os.path.join(folder, CONFIGURATION_FILE)
     else:
         config_path = os.path.join(folder, file_name)
 
+    if sources is not None:
+        sources.append(_file_source(config_path))
+
     config = CustomConfigParser()
     if os.path.isfile(config_path):
         with open(config_path, 'r') as file_obj:
@@ -128,7 +307,7 @@ def load_file_config(folder, file_name=None):
             # recursion
             if config_path != base_config_path:
                 base_config = load_file_config(
-                    folder=folder, file_name=base_config_file)
+                    folder=folder, file_name=base_config_file, sources=sources)
 
                 # Merge the config files
                 for section in config:
@@ -140,9 +319,10 @@ def load_file_config(folder, file_name=None):
     return config
 
 
-def load_config(folder, cli_args):
+def load_config_parser(folder, cli_args, sources=None):
     """Load the configuration, load defaults and return the parser."""
-    config = load_file_config(folder, file_name=cli_args.config_file)
+    config = load_file_config(
+        folder, file_name=cli_args.config_file, sources=sources)
 
     for key, value in DEFAULT_CIOCHECK_CONFIG.items():
         if not config.has_option(MAIN_CONFIG_SECTION, key):
@@ -154,3 +334,62 @@ def load_config(folder, cli_args):
                 config.set_value(key, cli_value)
 
     return config
+
+
+def make_cache_folder(folder):
+    """
+    Create the cache folder of `folder`, ignored by version control.
+
+    Like the caches of pytest and mypy, it contains a `.gitignore` file
+    ignoring everything, so it never shows up as untracked.
+    """
+    cache_folder = os.path.join(folder, CACHE_FOLDER)
+    gitignore = os.path.join(cache_folder, '.gitignore')
+    if os.path.isfile(gitignore):
+        return
+    try:
+        if not os.path.isdir(cache_folder):
+            os.makedirs(cache_folder)
+        with open(gitignore, 'w') as file_obj:
+            file_obj.write('# Created by ciocheck\n*\n')
+    except (IOError, OSError):
+        pass
+
+
+def load_config(folder, cli_args):
+    """
+    Load the configuration and return an immutable `ConfigSnapshot`.
+
+    The resolved snapshot is cached on disk and reused as long as none of
+    the files in the `inherit_config` chain and none of the cli arguments
+    changed.
+    """
+    make_cache_folder(folder)
+    cache_path = _snapshot_cache_path(folder, cli_args)
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'r') as file_obj:
+                snapshot = ConfigSnapshot.from_json(file_obj.read())
+            if all(_is_valid_source(s) for s in snapshot.sources):
+                return snapshot
+        except Exception:
+            pass
+
+    sources = []
+    parser = load_config_parser(folder, cli_args, sources=sources)
+    sections = OrderedDict()
+    for section in parser.sections():
+        sections[section] = OrderedDict(parser.items(section))
+    snapshot = ConfigSnapshot(sections, sources)
+
+    try:
+        from ciocheck.utils import atomic_replace
+
+        cache_folder = os.path.dirname(cache_path)
+        if not os.path.isdir(cache_folder):
+            os.makedirs(cache_folder)
+        atomic_replace(cache_path, snapshot.to_json(), 'utf-8')
+    except (IOError, OSError):
+        pass
+
+    return snapshot
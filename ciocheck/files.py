@@ -8,25 +8,34 @@
 """File manager."""
 
 # Standard library imports
+from collections import OrderedDict
 import os
+import shutil
+import tempfile
+import threading
 
 # Local imports
 from ciocheck.config import (ALL_FILES, COMMITED_MODE, DEFAULT_BRANCH,
                              MODIFIED_FILES, MODIFIED_LINES, STAGED_MODE,
                              UNSTAGED_MODE)
-from ciocheck.utils import filter_files, get_files
+from ciocheck.findings import Finding
+from ciocheck.utils import file_hash, filter_files, get_files, stat_key
 from ciocheck.vcs import DiffTool
 
 
 class FileManager(object):
     """File manager with git support."""
 
-    def __init__(self, folders=None, files=None):
+    def __init__(self, folders=None, files=None, rename_similarity=None,
+                 index_folder=None):
         """File manager with git support."""
         self.folders = folders or []
         self.files = files or []
         self.paths = self.files + self.folders
-        self.diff_tool = DiffTool(paths=folders)
+        self.diff_tool = DiffTool(
+            paths=folders,
+            rename_similarity=rename_similarity,
+            index_folder=index_folder)
         self.cache = {}
 
     def get_files(self,
@@ -92,6 +101,160 @@ class FileManager(object):
 
         return results
 
+    def commit_index(self):
+        """Record the files not under version control after a good run."""
+        self.diff_tool.commit_index()
+
+
+class Fingerprints(object):
+    """
+    Content hashes of files, shared by the caches of every tool in a run.
+
+    Hashes are fetched in bulk from version control, which already knows
+    the blob id of clean tracked files, and checked against the stat of the
+    file before every use, so files changed by formatters get a new hash.
+    """
+
+    def __init__(self):
+        """Content hashes of files, shared by the caches of every tool."""
+        self.hashes = {}  # {path: (stat key, hash)}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat(path):
+        """Return the stat key of `path`, None if it can not be read."""
+        try:
+            return stat_key(os.stat(path))
+        except OSError:
+            return None
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    def prefetch(self, paths, diff_tool):
+        """Fetch the hashes of `paths` from `diff_tool` in bulk."""
+        # Stat first, a file changed while fetching gets a stale stat key
+        stats = dict((os.path.normpath(path), self._stat(path))
+                     for path in paths)
+        hashes = diff_tool.file_fingerprints(sorted(stats))
+        with self._lock:
+            for path, content_hash in hashes.items():
+                if stats.get(path) is not None:
+                    self.hashes[path] = (stats[path], content_hash)
+
+    def get(self, path):
+        """Return the git blob id of the current content of `path`."""
+        path = os.path.normpath(path)
+        key = self._stat(path)
+        with self._lock:
+            cached = self.hashes.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        content_hash = file_hash(path)
+        if key is not None:
+            with self._lock:
+                self.hashes[path] = (key, content_hash)
+        return content_hash
+
+
+class StagedTree(object):
+    """
+    Private copy of the staged (index) content of files.
+
+    Tools run on the copy, so partially staged files are checked with the
+    content that is going to be commited, without stashing or touching the
+    working tree. Changes made by formatters are written back to the index.
+    """
+
+    def __init__(self, file_manager):
+        """Private copy of the staged (index) content of files."""
+        self.file_manager = file_manager
+        self.root = None
+        self.originals = {}  # {path: (mode, contents)}
+
+    def private_path(self, path):
+        """Return the private path of a project `path`."""
+        drive, path = os.path.splitdrive(os.path.normpath(path))
+        return os.path.join(self.root, drive.replace(':', ''),
+                            path.lstrip(os.sep))
+
+    def public_path(self, path):
+        """Return the project path of a private `path`."""
+        private = os.path.normpath(path)
+        if not private.startswith(self.root + os.sep):
+            return path
+
+        public = os.sep + private[len(self.root) + 1:]
+        if os.name == 'nt':
+            drive, public = public.lstrip(os.sep).split(os.sep, 1)
+            public = drive + ':' + os.sep + public
+        return public
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    def setup(self, paths):
+        """Copy the staged content of `paths` to the private folder."""
+        self.root = os.path.realpath(tempfile.mkdtemp(prefix='ciocheck-'))
+
+        # Existing packages must be visible to pyformat
+        paths = set(paths)
+        for path in list(paths):
+            paths.add(os.path.join(os.path.dirname(path), '__init__.py'))
+
+        diff_tool = self.file_manager.diff_tool
+        self.originals = diff_tool.staged_contents(sorted(paths))
+        for path, (_, contents) in self.originals.items():
+            private_path = self.private_path(path)
+            folder = os.path.dirname(private_path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(private_path, 'wb') as file_obj:
+                file_obj.write(contents)
+
+    def to_private(self, files):
+        """Map a list or dict of project paths to the private folder."""
+        if isinstance(files, dict):
+            return OrderedDict((self.private_path(path), value)
+                               for path, value in files.items()
+                               if os.path.normpath(path) in self.originals)
+        return [self.private_path(path) for path in files
+                if os.path.normpath(path) in self.originals]
+
+    def to_public(self, results):
+        """Map the `path` of results back to the project folder."""
+        public_results = []
+        for result in results:
+            path = self.public_path(result['path'])
+            if isinstance(result, Finding):
+                result = result.replace(path=path)
+            else:
+                result['path'] = path
+            public_results.append(result)
+        return public_results
+
+    def write_back(self):
+        """Write to the index the files changed or created by formatters."""
+        diff_tool = self.file_manager.diff_tool
+        written = []
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                private_path = os.path.join(folder, name)
+                path = self.public_path(private_path)
+                with open(private_path, 'rb') as file_obj:
+                    contents = file_obj.read()
+
+                mode, original = self.originals.get(path, ('100644', None))
+                if contents != original:
+                    if diff_tool.write_index(path, contents, mode=mode):
+                        written.append(path)
+        return sorted(written)
+
+    def cleanup(self):
+        """Remove the private folder."""
+        if self.root:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+
 
 def test():
     """Main local test."""
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Compact records of the findings reported by linters.
+
+Large projects can produce hundreds of thousands of findings, so they are
+stored as tuples without a per instance dictionary, with interned strings
+(paths and messages repeat a lot) and integer line numbers. Findings still
+support the `result['key']` and `result.get('key')` access used for the other
+tool results.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import namedtuple
+
+# Third party imports
+from six.moves import intern
+
+FINDING_FIELDS = ('path', 'line', 'column', 'type', 'message', 'symbol')
+
+
+def _intern(value):
+    """Intern native strings, other values are returned unchanged."""
+    if isinstance(value, str):
+        return intern(value)
+    return value
+
+
+def _to_int(value):
+    """Convert a line or column number, -1 if unknown."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+class Finding(namedtuple('Finding', FINDING_FIELDS)):
+    """A single linter finding."""
+
+    __slots__ = ()
+
+    def __new__(cls, path, line=-1, column=-1, type='', message='',
+                symbol=''):
+        """A single linter finding."""
+        return super(Finding, cls).__new__(
+            cls, _intern(path), _to_int(line), _to_int(column),
+            _intern(type), _intern(message), _intern(symbol or ''))
+
+    def __getitem__(self, key):
+        """Return a field by name, or by position like a tuple."""
+        if isinstance(key, (int, slice)):
+            return super(Finding, self).__getitem__(key)
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    def get(self, key, default=None):
+        """Return a field by name, or `default` if there is no such field."""
+        if key in self._fields:
+            return getattr(self, key)
+        return default
+
+    def replace(self, **kwargs):
+        """Return a copy with new field values, interned like the original."""
+        values = self._asdict()
+        values.update(kwargs)
+        return Finding(**values)
+
+    def to_dict(self, path=True):
+        """Return the finding as a json serializable dictionary."""
+        values = dict(self._asdict())
+        if not path:
+            values.pop('path')
+        return values
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        """Create a finding from a dictionary, ignoring unknown keys."""
+        values = dict((k, v) for (k, v) in data.items() if k in cls._fields)
+        values.update(kwargs)
+        return cls(**values)
+
+
+def test():
+    """Main local test."""
+    finding = Finding('module.py', '1', '4', 'E225', 'missing whitespace')
+    print(finding, finding['line'], finding.get('missing'))
+
+
+if __name__ == '__main__':
+    test()
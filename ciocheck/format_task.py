@@ -5,7 +5,12 @@
 # Licensed under the terms of the MIT License
 # (see LICENSE.txt for details)
 # -----------------------------------------------------------------------------
-"""Setup auxiliary process so we can run formatters in parallel."""
+"""Setup auxiliary process so we can run formatters in parallel.
+
+The results of every file are written to the standard output as soon as the
+file is formatted, one json record per line. Large diffs are written to
+files in the folder given by the parent and referenced by path.
+"""
 
 from __future__ import absolute_import, print_function
 
@@ -14,17 +19,37 @@ import ast
 import json
 import os
 import sys
+import tempfile
+import time
 
 # Local imports
-from ciocheck.formatters import MULTI_FORMATTERS
+from ciocheck.config import ConfigSnapshot
+from ciocheck.registry import MULTI_FORMATTER, get_tools
 from ciocheck.utils import filter_files
 
+SPILL_DIFF_SIZE = 16384  # Diffs larger than this are written to files
+
+
+def load_config():
+    """Load the config snapshot sent by the parent process, if any."""
+    config_json = os.environ.get('CIOCHECK_CONFIG')
+    if config_json:
+        config = ConfigSnapshot.from_json(config_json)
+    else:
+        config = None
+    return config
+
 
-def format_file(path):
-    """Format a file (path) using the available formatters."""
+def format_file(path, config=None, lines=None, timings=None):
+    """
+    Format a file (path) using the available formatters.
+
+    If `timings` is a list, `[formatter, path, seconds]` is appended to it
+    for every formatter run on the file.
+    """
     root_path = os.environ.get('CIOCHECK_PROJECT_ROOT')
     check = ast.literal_eval(os.environ.get('CIOCHECK_CHECK'))
-    check_multi_formatters = [f for f in MULTI_FORMATTERS if f.name in check]
+    check_multi_formatters = get_tools(MULTI_FORMATTER, check)
 
     results = {}
 
@@ -32,20 +57,46 @@ def format_file(path):
         paths = filter_files([path], formatter.extensions)
         if paths:
             formatter.cmd_root = root_path
-            result = formatter.format_task(path)
+            formatter.config = config
+            started = time.time()
+            result = formatter.format_task(path, lines=lines)
+            if timings is not None:
+                timings.append([formatter.name, path, time.time() - started])
             if result:
                 results[formatter.name] = result
     return results
 
 
+def spill_diffs(task_result, folder):
+    """Move the large diffs of `task_result` to files in `folder`."""
+    for result in task_result.values():
+        diff = result.get('diff') or ''
+        if folder and len(diff) > SPILL_DIFF_SIZE:
+            handle, path = tempfile.mkstemp(suffix='.diff', dir=folder)
+            with os.fdopen(handle, 'wb') as file_obj:
+                file_obj.write(diff.encode('utf-8'))
+            result['diff'] = ''
+            result['diff_file'] = path
+
+
 def main():
     """Main script."""
-    task_results = []
+    config = load_config()
+    lines = json.loads(os.environ.get('CIOCHECK_LINES') or '{}')
+    spill_folder = os.environ.get('CIOCHECK_SPILL_FOLDER')
     for filename in sys.argv[1:]:
-        task_result = format_file(filename)
-        if task_result:
-            task_results.append(task_result)
-    print(json.dumps(task_results))
+        timings = []
+        task_result = format_file(
+            filename, config=config, lines=lines.get(filename),
+            timings=timings)
+        spill_diffs(task_result, spill_folder)
+        record = {
+            'path': filename,
+            'results': task_result,
+            'timings': [[name, seconds] for (name, _, seconds) in timings],
+        }
+        print(json.dumps(record, separators=(',', ':')))
+        sys.stdout.flush()
     sys.exit(0)
 
 
@@ -8,69 +8,113 @@
 """Generic and custom code formatters."""
 
 # Standard library imports
+from collections import OrderedDict
 import codecs
 import json
 import os
 import platform
 import re
-import subprocess
+import shutil
 import sys
-
-# Third party imports
-from yapf.yapflib.yapf_api import FormatCode
-import autopep8
-import isort
+import tempfile
+import threading
+import time
 
 # Local imports
-from ciocheck.config import DEFAULT_COPYRIGHT_HEADER
-from ciocheck.tools import Tool
-from ciocheck.utils import atomic_replace, cpu_count, diff
+from ciocheck.config import (DEFAULT_CIOCHECK_CONFIG, DEFAULT_COPYRIGHT_HEADER,
+                             DIFFS_FOLDER)
+from ciocheck.process import JOBS, Command, CommandTimeout, as_completed
+from ciocheck.registry import MULTI_FORMATTER, get_tools
+from ciocheck.tools import Tool, get_command_timeout
+from ciocheck.utils import (LazyDiff, SpilledDiff, atomic_replace,
+                            atomic_replace_many, diff, file_hash, filter_files,
+                            lines_to_ranges, run_parallel)
 
 HERE = os.path.dirname(os.path.realpath(__file__))
+BATCH_SIZE = 3  # Maximum number of files formatted by a worker process
+BATCHES_PER_WORKER = 4  # Small enough batches to balance the workers
+DEFAULT_BYTES_PER_SECOND = 100000  # Formatting speed without history
+TIMINGS_FORMAT_VERSION = 1
+STALE_DIFFS_SECONDS = 3600  # Diff folders of older runs are removed
+
+
+def get_diff_options(config):
+    """Return `(check_only, max_diff_size)` of a config snapshot."""
+    if config is None:
+        check_only = DEFAULT_CIOCHECK_CONFIG['check_only']
+        max_diff_size = DEFAULT_CIOCHECK_CONFIG['max_diff_size']
+    else:
+        check_only = config.get_value('check_only')
+        max_diff_size = config.get_value('max_diff_size')
+    return check_only, int(max_diff_size or 0)
+
+
+def get_format_timeout(config):
+    """Return the time limit to format a file in seconds, None for none."""
+    if config is None:
+        return None
+    return float(config.get_value('format_timeout') or 0) or None
 
 
 class Formatter(Tool):
     """Generic formatter tool."""
 
     @classmethod
-    def format_task(cls, path):
-        """Forma trask executed by paralell script helper."""
+    def format_task(cls, path, lines=None):
+        """
+        Forma trask executed by paralell script helper.
+
+        `lines` is an optional list of `(start, end)` line ranges to restrict
+        formatting to, when supported by the formatter. In check only mode
+        the file is left untouched and only the diff is reported.
+        """
+        check_only, max_diff_size = get_diff_options(cls.config)
         changed = False
         old_contents, new_contents = '', ''
         error = None
         try:
-            old_contents, new_contents, encoding = cls.format_file(path)
+            old_contents, new_contents, encoding = cls.format_file(
+                path, lines=lines)
             changed = new_contents != old_contents
         except Exception as err:
             error = "{name} crashed on {path}: {error}".format(
                 name=cls.name, path=path, error=err)
 
-        if changed:
+        if changed or error:
+            # The diff is only computed for files that are reported
             result = {
                 'path': path,
                 'error': error,
-                #            'new-contents': new_contents,
-                #            'old-contents': old_contents,
-                'diff': diff(old_contents, new_contents),
+                'diff': diff(old_contents, new_contents,
+                             max_size=max_diff_size) if changed else '',
                 'created': False,  # pyformat might create new init files.
             }
-            atomic_replace(path, new_contents, encoding)
+            if changed and not check_only:
+                atomic_replace(path, new_contents, encoding)
         else:
             return {}
 
         return result
 
     @classmethod
-    def format_string(cls, old_contents):
+    def format_string(cls, old_contents, lines=None):
         """Format content of a file."""
         raise NotImplementedError
 
     @classmethod
-    def format_file(cls, path):
+    def format_file(cls, path, lines=None):
         """Format file for use with task queue."""
         with open(path, 'r') as file_obj:
             old_contents = file_obj.read()
-        return cls.format_string(old_contents)
+
+        # Ranges covering the whole file, like for new files, are dropped
+        if lines is not None:
+            line_count = len(old_contents.splitlines())
+            for (start, end) in lines:
+                if start <= 1 and end >= line_count:
+                    lines = None
+                    break
+        return cls.format_string(old_contents, lines=lines)
 
     def run(self, paths):
         """Format paths."""
@@ -83,6 +127,7 @@ class IsortFormatter(Formatter):
     language = 'python'
     name = 'isort'
     extensions = ('py', )
+    distribution = 'isort'
 
     # Config
     config_file = '.isort.cfg'
@@ -93,9 +138,14 @@ class IsortFormatter(Formatter):
         pass
 
     @classmethod
-    def format_string(cls, old_contents):
-        """Format content of a file."""
-        new_contents = isort.SortImports(file_contents=old_contents).output
+    def format_string(cls, old_contents, lines=None):
+        """Format content of a file, imports are always sorted as a whole."""
+        import isort
+
+        # cmd_root is assigned to formatter inside format_task... ugly!
+        settings_path = os.path.dirname(cls.get_config_path(cls.cmd_root))
+        new_contents = isort.SortImports(
+            file_contents=old_contents, settings_path=settings_path).output
         return old_contents, new_contents, 'utf-8'
 
 
@@ -105,6 +155,7 @@ class YapfFormatter(Formatter):
     language = 'python'
     name = 'yapf'
     extensions = ('py', )
+    distribution = 'yapf'
 
     # Config
     config_file = '.style.yapf'
@@ -115,15 +166,17 @@ class YapfFormatter(Formatter):
         pass
 
     @classmethod
-    def format_string(cls, old_contents):
+    def format_string(cls, old_contents, lines=None):
         """Format file for use with task queue."""
+        from yapf.yapflib.yapf_api import FormatCode
+
         # cmd_root is assigned to formatter inside format_task... ugly!
-        style_config = os.path.join(cls.cmd_root, cls.config_file)
+        style_config = cls.get_config_path(cls.cmd_root)
         # It might be tempting to use the "inplace" option to FormatFile, but
         # it doesn't do an atomic replace, which is dangerous, so don't use
         # it unless you submit a fix to yapf.
         (new_contents, changed) = FormatCode(
-            old_contents, style_config=style_config)
+            old_contents, style_config=style_config, lines=lines)
 
         if platform.system() == 'Windows':
             # yapf screws up line endings on windows
@@ -141,6 +194,7 @@ class Autopep8Formatter(Formatter):
     language = 'python'
     name = 'autopep8'
     extensions = ('py', )
+    distribution = 'autopep8'
 
     # Config
     config_file = '.autopep8'
@@ -151,11 +205,24 @@ class Autopep8Formatter(Formatter):
         pass
 
     @classmethod
-    def format_string(cls, old_contents):
+    def format_string(cls, old_contents, lines=None):
         """Format file for use with task queue."""
+        import autopep8
+
         config_options = cls.make_config_dictionary()
         config_options = {}
-        new_contents = autopep8.fix_code(old_contents, options=config_options)
+
+        if not lines:
+            new_contents = autopep8.fix_code(
+                old_contents, options=config_options)
+            return old_contents, new_contents, 'utf-8'
+
+        # autopep8 only supports a single range, fix one range at a time,
+        # from the bottom up so the line numbers of the others stay valid
+        new_contents = old_contents
+        for start, end in sorted(lines, reverse=True):
+            options = dict(config_options, line_range=[start, end])
+            new_contents = autopep8.fix_code(new_contents, options=options)
         return old_contents, new_contents, 'utf-8'
 
 
@@ -165,43 +232,287 @@ class MultiFormatter(object):
     language = 'generic'
     name = 'multiformatter'
 
-    def __init__(self, cmd_root, check):
+    def __init__(self, cmd_root, check, config=None):
         """Formatter handling multiple formatters in parallel."""
         self.cmd_root = cmd_root
         self.check = check
+        self.config = config
+        self.store = None  # ResultStore shared between runs
+        self.fingerprints = None  # Fingerprints shared between tools
+        self.lines = {}  # {path: [(start, end), ...]} in modified lines mode
+        self.timings = {}  # {formatter: {path: seconds}}
+        self.skipped = []  # Files that timed out or crashed a worker alone
+        self.stream = None  # Where worker output is written, standard output
+        self._results = {}  # {formatter: [result, ...]}
+        self._lock = threading.Lock()
+        self._diffs_folder = None
+
+    def _get_diffs_folder(self):
+        """Return the folder of the large diffs of this run."""
+        if self._diffs_folder is None:
+            parent = os.path.join(self.cmd_root, DIFFS_FOLDER)
+            if os.path.isdir(parent):
+                now = time.time()
+                for name in os.listdir(parent):
+                    path = os.path.join(parent, name)
+                    try:
+                        stale = (now - os.path.getmtime(path) >
+                                 STALE_DIFFS_SECONDS)
+                    except OSError:
+                        continue
+                    if stale:
+                        shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.makedirs(parent)
+            self._diffs_folder = tempfile.mkdtemp(dir=parent)
+        return self._diffs_folder
+
+    def _write(self, text):
+        """Write output of the workers on the stream of the runner."""
+        with self._lock:
+            (self.stream or sys.stdout).write(text)
+
+    def _worker_command(self):
+        """Return the command of a formatter worker process."""
+        return [sys.executable, os.path.join(HERE, 'format_task.py')]
 
     def _format_files(self, paths):
-        """Helper method to start a seaparate subprocess."""
-        cmd = [sys.executable, os.path.join(HERE, 'format_task.py')]
+        """
+        Return the command formatting `paths` in a separate subprocess.
+
+        With a per file time limit, the worker is killed when a file takes
+        longer than the limit, which restarts with every file it reports.
+        Results are read as the worker writes them.
+        """
+        cmd = self._worker_command()
         env = os.environ.copy()
         env['CIOCHECK_PROJECT_ROOT'] = self.cmd_root
+        env['CIOCHECK_SPILL_FOLDER'] = self._get_diffs_folder()
         env['CIOCHECK_CHECK'] = str(self.check)
-        proc = subprocess.Popen(
-            cmd + paths,
-            env=env,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-        return proc
-
-    def _format_results(self, results):
-        """Rearrange results for standard consumption."""
-        new_results = {}
-        for item in results:
-            for key, value in item.items():
-                if key not in new_results:
-                    new_results[key] = []
-                new_results[key].append(value)
+        if self.config is not None:
+            env['CIOCHECK_CONFIG'] = self.config.to_json()
+        lines = dict((p, self.lines[p]) for p in paths if p in self.lines)
+        env['CIOCHECK_LINES'] = json.dumps(lines)
+        timeout = get_format_timeout(self.config)
+        command = Command(cmd + paths, env=env,
+                          timeout=timeout or get_command_timeout(self.config),
+                          keep_output=False)
+        command.on_line = lambda line: self._read_record(command, line)
+        command.paths = paths
+        command.formatted = []
+        command.file_timeout = bool(timeout)
+        return command
+
+    def _add_results(self, task_result):
+        """Add the `{formatter: result}` results of a file."""
+        for name, result in task_result.items():
+            if result.get('diff_file'):
+                result['diff'] = SpilledDiff(result.pop('diff_file'))
+            self._results.setdefault(name, []).append(result)
+
+    def _read_record(self, command, line):
+        """Add the results of a file, from a line written by a worker."""
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict) or 'path' not in record:
+            # Output of a formatter, not a record
+            if line.strip():
+                self._write(line)
+            return
+
+        path = record['path']
+        with self._lock:
+            self._add_results(record['results'])
+            for name, seconds in record['timings']:
+                self.timings.setdefault(name, {})[path] = seconds
+        command.formatted.append(path)
+        if command.file_timeout:
+            # The time limit is per file, the next file gets all of it
+            command.restart_timeout()
+
+    def _failure_results(self, path, error):
+        """Return the error results of a file that could not be formatted."""
+        results = {}
+        for formatter in get_tools(MULTI_FORMATTER, self.check):
+            if filter_files([path], formatter.extensions):
+                results[formatter.name] = {
+                    'path': path,
+                    'error': '{0}: {1}'.format(formatter.name, error),
+                    'diff': '',
+                    'created': False,
+                }
+        return results
 
-        # Sort by path
-        for key, values in new_results.items():
-            new_results[key] = sorted(values, key=lambda dic: dic['path'])
-        return new_results
+    def _wait_command(self, command):
+        """
+        Wait for a formatting command.
+
+        Return the paths left unformatted if it timed out or crashed, and
+        an error message.
+        """
+        try:
+            _, error = command.wait()
+        except CommandTimeout as err:
+            error = None
+            message = ('skipped, formatting took more than {0} '
+                       'seconds'.format(err.timeout))
+        else:
+            lines = [line for line in error.splitlines() if line.strip()]
+            message = 'skipped, the formatter crashed: {0}'.format(
+                lines[-1] if lines else 'exit code {0}'.format(
+                    command.returncode))
+
+        remaining = [path for path in command.paths
+                     if path not in command.formatted]
+        if error and not remaining:
+            self._write(error.rstrip('\n') + '\n')
+        return remaining, message
+
+    def _timings_key(self):
+        """Return the key of the formatting times in the result store."""
+        names = [f.name for f in get_tools(MULTI_FORMATTER, self.check)]
+        return self.store.make_key('timings', TIMINGS_FORMAT_VERSION, names)
+
+    def _relative_path(self, path):
+        """Return `path` relative to the project, None if outside of it."""
+        path = os.path.relpath(path, self.cmd_root)
+        if path.startswith(os.pardir):
+            return None
+        return path.replace(os.sep, '/')
+
+    def load_timings(self):
+        """Return the formatting times of past runs, `{path: seconds}`."""
+        if self.store is None:
+            return {}
+        timings = self.store.get('timings', self._timings_key()) or {}
+        return dict((os.path.join(self.cmd_root, path), seconds)
+                    for path, seconds in timings.items())
+
+    def save_timings(self):
+        """Add the formatting times of this run to the result store."""
+        if self.store is None or not self.timings:
+            return
+        key = self._timings_key()
+        timings = self.store.get('timings', key) or {}
+        timings = dict((path, seconds) for path, seconds in timings.items()
+                       if os.path.isfile(os.path.join(self.cmd_root, path)))
+        totals = {}
+        for name, path_timings in self.timings.items():
+            for path, seconds in path_timings.items():
+                totals[path] = totals.get(path, 0) + seconds
+        for path, seconds in totals.items():
+            path = self._relative_path(path)
+            if path is not None:
+                timings[path] = round(seconds, 4)
+        self.store.put('timings', key, timings)
+
+    def estimate_costs(self, paths, timings=None):
+        """
+        Return the estimated formatting time of `paths`, `{path: seconds}`.
+
+        Files formatted before use their last time, others their size at the
+        average speed of the known files.
+        """
+        timings = self.load_timings() if timings is None else timings
+        sizes = {}
+        for path in paths:
+            try:
+                sizes[path] = os.path.getsize(path) + 1
+            except OSError:
+                sizes[path] = 1
+
+        known = [path for path in paths if path in timings]
+        known_time = sum(timings[path] for path in known)
+        known_size = sum(sizes[path] for path in known)
+        if known_time > 0 and known_size > 0:
+            bytes_per_second = known_size / float(known_time)
+        else:
+            bytes_per_second = DEFAULT_BYTES_PER_SECOND
+
+        return dict((path, timings[path] if path in timings else
+                     sizes[path] / float(bytes_per_second)) for path in paths)
+
+    def make_batches(self, paths, workers, timings=None):
+        """
+        Pack `paths` in batches, from the most to the least expensive.
+
+        Expensive files get a worker of their own, cheap files share one up
+        to `BATCH_SIZE` files. Workers take the next batch as soon as they
+        are free, so the longest files start first and the cheap ones fill
+        the gaps at the end (longest processing time first).
+        """
+        costs = self.estimate_costs(paths, timings=timings)
+        target = sum(costs.values()) / float(
+            max(1, workers) * BATCHES_PER_WORKER)
+        batches, batch, batch_cost = [], [], 0
+        for path in sorted(paths, key=lambda path: (-costs[path], path)):
+            if batch and (batch_cost + costs[path] > target or
+                          len(batch) == BATCH_SIZE):
+                batches.append(batch)
+                batch, batch_cost = [], 0
+            batch.append(path)
+            batch_cost += costs[path]
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def slowest_files(self, count):
+        """Return the `count` slowest files of every formatter."""
+        slowest = OrderedDict()
+        for name in sorted(self.timings):
+            timings = sorted(self.timings[name].items(),
+                             key=lambda item: (-item[1], item[0]))
+            slowest[name] = timings[:count]
+        return slowest
+
+    def _get_verdict_keys(self, paths):
+        """
+        Return the paths that are not known to be formatted and their keys.
+
+        A file is skipped if every formatter has an "already formatted"
+        verdict for its current content.
+        """
+        formatters = get_tools(MULTI_FORMATTER, self.check)
+        salts = [(f, f.get_cache_salt(self.config)) for f in formatters]
+        missing, verdict_keys = [], {}
+        for path in paths:
+            if self.fingerprints is not None:
+                content_hash = self.fingerprints.get(path)
+            else:
+                content_hash = file_hash(path)
+            keys = []
+            for formatter, salt in salts:
+                if filter_files([path], formatter.extensions):
+                    key = self.store.make_key('verdict', salt,
+                                              self._relative_path(path),
+                                              content_hash,
+                                              self.lines.get(path))
+                    keys.append((formatter.name, key))
+
+            verdicts = [self.store.get(name, key) for (name, key) in keys]
+            if not all(verdicts):
+                missing.append(path)
+                verdict_keys[path] = keys
+        return missing, verdict_keys
+
+    def _cache_verdicts(self, verdict_keys, results):
+        """Store "already formatted" verdicts of files left untouched."""
+        reported = set()
+        for values in results.values():
+            reported.update(value['path'] for value in values)
+
+        for path, keys in verdict_keys.items():
+            if path not in reported:
+                for (name, key) in keys:
+                    self.store.put(name, key, {'formatted': True})
 
     @property
     def extensions(self):
         """Return all extensions of the used multiformatters."""
         all_extensions = []
-        for formatter in MULTI_FORMATTERS:
+        for formatter in get_tools(MULTI_FORMATTER, self.check):
             all_extensions += list(formatter.extensions)
         return all_extensions
 
@@ -215,64 +526,64 @@ class MultiFormatter(object):
         Not using a multiprocessing because not sure how its "magic" (pickling,
         __main__ import) really works.
         """
-        processes = []
         if isinstance(paths, dict):
-            paths = list(sorted(paths.keys()))
-
-        def await_one_process():
-            """Wait for one process and parse output."""
-            if processes:
-                # We pop(0) because the first process is the oldest
-                proc = processes.pop(0)
-                output, error = proc.communicate()
-
-                if isinstance(output, bytes):
-                    output = output.decode()
-
-                if isinstance(error, bytes):
-                    error = error.decode()
-
-                output = json.loads(output)
-                if error:
-                    print(error)
-
-                return output, error
+            # Only format the lines added, files with only deleted lines have
+            # nothing to format
+            self.lines = {}
+            for path, (added_lines, _) in paths.items():
+                ranges = lines_to_ranges(added_lines)
+                if ranges:
+                    self.lines[path] = ranges
+            paths = list(sorted(self.lines.keys()))
+        else:
+            paths = list(paths)
+
+        verdict_keys = {}
+        if self.store is not None:
+            paths, verdict_keys = self._get_verdict_keys(paths)
+
+        # We send a few cheap files to each process to try to reduce
+        # per-process setup time. Commands are started as others finish,
+        # the most expensive first, and the number of running processes has
+        # a global limit. Workers report every file as soon as it is done,
+        # the files left by a batch that timed out or crashed are retried
+        # alone, so a single bad file is skipped without losing the others.
+        batches = self.make_batches(paths, JOBS.tokens)
+        self._results = {}
+        while batches:
+            commands = (self._format_files(batch) for batch in batches)
+            batches = []
+            for command in as_completed(commands,
+                                        max_running=JOBS.tokens * 2):
+                remaining, error = self._wait_command(command)
+                if not remaining:
+                    continue
+                if len(command.paths) > 1:
+                    batches += [[path] for path in remaining]
+                else:
+                    path = command.paths[0]
+                    self.skipped.append(path)
+                    failure_results = self._failure_results(path, error)
+                    self._add_results(failure_results)
+                    if command.timed_out:
+                        for name in failure_results:
+                            self.timings.setdefault(name, {})[path] = (
+                                command.timeout)
 
-        def await_all_processes():
-            """Wait for all processes."""
-            results = []
-            while processes:
-                output, error = await_one_process()
-                output = [o for o in output if o]
-                if output:
-                    results += output
-                if error:
-                    print(error)
-            return results
-
-        def take_n(items, amount):
-            """Take n items to pass to the processes."""
-            result = []
-            while amount > 0 and items:
-                result.append(items.pop(0))  # Keep order
-                amount = amount - 1
-            return list(sorted(result))
-
-        while paths:
-            # We send a few files to each process to try to reduce per-process
-            # setup time
-            some_files = take_n(paths, 3)
-            processes.append(self._format_files(some_files))
-
-            # Don't run too many at once, this is a goofy algorithm
-            if len(processes) > (cpu_count() * 3):
-                while len(processes) > cpu_count():
-                    await_one_process()
-
-        assert [] == paths
-        results = await_all_processes()
-        results = self._format_results(results)
-        assert [] == processes
+        # Sort by path
+        results = dict((name, sorted(values, key=lambda dic: dic['path']))
+                       for name, values in self._results.items())
+        self._results = {}
+        if self._diffs_folder is not None:
+            try:
+                # Removed unless a diff was written to it
+                os.rmdir(self._diffs_folder)
+            except OSError:
+                pass
+
+        if verdict_keys:
+            self._cache_verdicts(verdict_keys, results)
+        self.save_timings()
         return results
 
 
@@ -284,10 +595,12 @@ class PythonFormatter(Formatter):
     extensions = ('py', )
 
     COPYRIGHT_RE = re.compile('# *Copyright ')
+    HEAD_SIZE = 4096  # Bytes scanned for existing headers
 
     def __init__(self, cmd_root):
         """Handle __init__.py addition and headers (copyright and encoding)."""
         super(PythonFormatter, self).__init__(cmd_root)
+        self.root_folder = cmd_root  # Folder where no init is ever added
         self.config = None
         self.copyright_header = None
         self.encoding_header = None
@@ -304,16 +617,30 @@ class PythonFormatter(Formatter):
         else:
             self.copyright_header = DEFAULT_COPYRIGHT_HEADER
 
+    def _has_headers(self, contents):
+        """Return if `contents` has both the encoding and copyright headers."""
+        return (self.encoding_header in contents and
+                self.COPYRIGHT_RE.search(contents) is not None)
+
     def _add_headers(self, path, header, copy):
-        """Add headers as needed in file."""
-        with codecs.open(path, 'r', 'utf-8') as file_obj:
-            old_contents = file_obj.read()
+        """
+        Add headers as needed in file.
+
+        Return `(results, new_contents)`, `new_contents` is None if the file
+        does not need to be written.
+        """
+        # Headers live at the top, most files are done after a short read
+        with open(path, 'rb') as file_obj:
+            head = file_obj.read(self.HEAD_SIZE)
+            if self._has_headers(head.decode('utf-8', 'ignore')):
+                return {}, None
+            old_contents = (head + file_obj.read()).decode('utf-8')
 
         have_encoding = (self.encoding_header in old_contents)
         have_copyright = (self.COPYRIGHT_RE.search(old_contents) is not None)
 
         if have_encoding and have_copyright:
-            return {}
+            return {}, None
 
         # Note: do NOT automatically change the copyright owner or date. The
         # copyright owner/date is a statement of legal reality, not a way to
@@ -338,39 +665,44 @@ class PythonFormatter(Formatter):
             contents += self.copyright_header
         new_contents = contents + old_contents
         if new_contents != old_contents:
+            check_only, max_diff_size = get_diff_options(self.config)
             results = {
                 'path': path,
-                'diff': diff(old_contents, new_contents),
+                'diff': LazyDiff(old_contents, new_contents,
+                                 max_size=max_diff_size),
                 'created': False,
                 'error': None,
                 'added-copy': not have_encoding and header,
                 'added-header': not have_copyright and copy,
             }
-            atomic_replace(path, new_contents, 'utf-8')
+            if check_only:
+                new_contents = None
         else:
-            results = {}
-        return results
+            results, new_contents = {}, None
+        return results, new_contents
 
     def _add_missing_init_py(self, paths):
         """Add missing __init__.py files in the module subdirectories."""
         results = []
-        folders = [os.path.dirname(p) for p in paths]
+        folders = set(os.path.dirname(p) for p in paths)
 
         # Avoid adding an init on repo level if setup.py or other script on the
         # top level has changed
-        if self.cmd_root in folders:
-            folders.remove(self.cmd_root)
+        folders.discard(self.root_folder)
 
-        for folder in folders:
+        check_only, _ = get_diff_options(self.config)
+        for folder in sorted(folders):
             init_py = os.path.join(folder, "__init__.py")
             exists = os.path.exists(init_py)
             if not exists:
-                with codecs.open(init_py, 'w', 'utf-8') as handle:
-                    handle.flush()
+                if not check_only:
+                    with codecs.open(init_py, 'w', 'utf-8') as handle:
+                        handle.flush()
                 result = {
                     'path': init_py,
-                    'created': not exists,
-                    'diff': diff('', ''),
+                    'created': not check_only,
+                    'missing': check_only,
+                    'diff': '',
                     'error': None,
                 }
                 results.append(result)
@@ -390,28 +722,43 @@ class PythonFormatter(Formatter):
         results_init = []
         if add_init:
             results_init = self._add_missing_init_py(paths)
-            new_paths = [item['path'] for item in results_init]
+            new_paths = [
+                item['path'] for item in results_init if item['created']
+            ]
             paths += new_paths
             paths = list(sorted(paths))
 
         results_header_copyright = []
         if add_header or add_copyright:
             self._setup_headers()
-            for path in paths:
-                result = self._add_headers(
+
+            def add_headers(path):
+                """Check the headers of a single file."""
+                return self._add_headers(
                     path, header=add_header, copy=add_copyright)
+
+            # Results keep the sorted order of paths
+            new_contents = {}
+            for result, contents in run_parallel(add_headers, paths):
                 if result:
                     results_header_copyright.append(result)
+                if contents is not None:
+                    new_contents[result['path']] = contents
+            atomic_replace_many(new_contents)
 
         for result in results_header_copyright:
             path = result['path']
-            res = [item for item in results_init]
+            res = [item for item in results_init if item['path'] == path]
 
             if res:
                 result['created'] = res[0]['created']
 
         if add_copyright or add_header:
-            results = results_header_copyright
+            # Missing inits are not created in check only mode, report them
+            results = results_header_copyright + [
+                item for item in results_init if item['missing']
+            ]
+            results = sorted(results, key=lambda item: item['path'])
         elif add_init:
             results = results_init
         else:
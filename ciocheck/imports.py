@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Static import graph of a project.
+
+It is used to select the tests to run and to invalidate the cached pylint
+findings of a module when a module it imports changes.
+
+The `import` statements of every python file are read with `ast`, without
+importing anything, and cached in the result store by content hash. A test
+module is selected when it imports a modified module, directly or through
+other project modules (or through a `conftest.py` file of its folders).
+Dynamic imports (`importlib`, `__import__`) are not seen.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import deque
+import ast
+import fnmatch
+import os
+
+IMPORTS_FORMAT_VERSION = 1
+DEFAULT_TEST_FILES = ('test_*.py', '*_test.py')  # Like pytest
+CONFTEST_FILE = 'conftest.py'
+
+
+def module_name(path):
+    """Return the dotted module name of a python file, from its packages."""
+    folder, name = os.path.split(os.path.abspath(path))
+    parts = [] if name == '__init__.py' else [os.path.splitext(name)[0]]
+    while os.path.isfile(os.path.join(folder, '__init__.py')):
+        folder, package = os.path.split(folder)
+        parts.insert(0, package)
+    return '.'.join(parts)
+
+
+def package_root(path):
+    """Return the folder a python file is imported from, above its packages."""
+    folder = os.path.dirname(os.path.abspath(path))
+    while os.path.isfile(os.path.join(folder, '__init__.py')):
+        folder = os.path.dirname(folder)
+    return folder
+
+
+def parse_imports(source):
+    """
+    Return the imports of python `source` as `[level, module, names]` lists.
+
+    Return None if the source can not be parsed.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, TypeError, ValueError):
+        return None
+
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.append([0, alias.name, []])
+        elif isinstance(node, ast.ImportFrom):
+            names = [alias.name for alias in node.names if alias.name != '*']
+            imports.append([node.level or 0, node.module or '', names])
+    return imports
+
+
+def resolve_imports(imports, module, is_package=False):
+    """
+    Return the absolute names imported by `module`, with their packages.
+
+    `from pkg import name` could import a module or an attribute, both
+    `pkg` and `pkg.name` are returned.
+    """
+    names = set()
+    for level, imported, from_names in imports:
+        if level:
+            parts = module.split('.')
+            parts = parts[:len(parts) - level + (1 if is_package else 0)]
+            if not parts and not imported:
+                continue
+            imported = '.'.join(parts + ([imported] if imported else []))
+
+        full_names = [imported] + ['{0}.{1}'.format(imported, name)
+                                   for name in from_names]
+        for full_name in full_names:
+            parts = full_name.split('.')
+            for index in range(1, len(parts) + 1):
+                names.add('.'.join(parts[:index]))
+    names.discard('')
+    return names
+
+
+def is_test_file(path, patterns=DEFAULT_TEST_FILES):
+    """Return if `path` is a test module according to `patterns`."""
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+class ImportGraph(object):
+    """Import graph of python files, by module name."""
+
+    def __init__(self, paths, store=None, content_hash=None):
+        """
+        Import graph of python files, by module name.
+
+        Parameters
+        ----------
+        paths : list of str
+            Python files of the project.
+        store : ResultStore
+            Store caching the imports of files by content hash.
+        content_hash : callable
+            Return the content hash of a path, used when `store` is set.
+        """
+        self.paths = sorted(os.path.normpath(path) for path in paths)
+        self.modules = {}  # {path: module name}
+        self.imports = {}  # {path: set of names or None if unknown}
+        self.importers = {}  # {name: set of importing module names}
+        self.module_paths = {}  # {module name: set of paths}
+        self._store = store
+        self._content_hash = content_hash
+        self._build()
+
+    def _read_imports(self, path):
+        """Return the imports of `path`, cached by content hash."""
+        key = None
+        if self._store is not None and self._content_hash is not None:
+            key = self._store.make_key('imports', IMPORTS_FORMAT_VERSION,
+                                       self._content_hash(path))
+            cached = self._store.get('imports', key)
+            if cached is not None:
+                return cached.get('imports')
+
+        try:
+            with open(path, 'rb') as file_obj:
+                imports = parse_imports(file_obj.read())
+        except (IOError, OSError):
+            return None
+
+        if key is not None:
+            self._store.put('imports', key, {'imports': imports})
+        return imports
+
+    def _conftest_modules(self, path):
+        """Return the modules of the `conftest.py` files above `path`."""
+        modules = set()
+        folder = os.path.dirname(path)
+        while True:
+            conftest = os.path.join(folder, CONFTEST_FILE)
+            if conftest in self.modules and conftest != path:
+                modules.add(self.modules[conftest])
+            parent = os.path.dirname(folder)
+            if parent == folder:
+                break
+            folder = parent
+        return modules
+
+    def _build(self):
+        """Parse every file and build the reverse graph."""
+        for path in self.paths:
+            name = module_name(path)
+            self.modules[path] = name
+            self.module_paths.setdefault(name, set()).add(path)
+
+        for path in self.paths:
+            name = self.modules[path]
+            imports = self._read_imports(path)
+            if imports is None:
+                self.imports[path] = None
+                continue
+
+            is_package = os.path.basename(path) == '__init__.py'
+            names = resolve_imports(imports, name, is_package)
+            names.update(self._conftest_modules(path))
+            names.discard(name)
+            self.imports[path] = names
+            for imported in names:
+                self.importers.setdefault(imported, set()).add(name)
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    def dependents(self, paths):
+        """Return the files importing any of `paths`, including them."""
+        seen = set(module_name(path) for path in paths)
+        pending = deque(seen)
+        while pending:
+            name = pending.popleft()
+            for importer in self.importers.get(name, ()):
+                if importer not in seen:
+                    seen.add(importer)
+                    pending.append(importer)
+
+        dependents = set(os.path.normpath(path) for path in paths)
+        for name in seen:
+            dependents.update(self.module_paths.get(name, ()))
+        return dependents
+
+    def dependencies(self, path):
+        """Return the files imported by `path`, directly or not."""
+        path = os.path.normpath(path)
+        seen = set()
+        pending = deque([path])
+        while pending:
+            for name in self.imports.get(pending.popleft()) or ():
+                for dependency in self.module_paths.get(name, ()):
+                    if dependency not in seen:
+                        seen.add(dependency)
+                        pending.append(dependency)
+        seen.discard(path)
+        return seen
+
+    def select_tests(self, modified, patterns=DEFAULT_TEST_FILES,
+                     always_run=(), root=None):
+        """
+        Return the test files to run after `modified` files changed.
+
+        Test files that could not be parsed are always selected, as well as
+        test files matching `always_run`, glob patterns relative to `root`.
+        """
+        selected = set()
+        for path in self.dependents(modified):
+            if path in self.modules and is_test_file(path, patterns):
+                selected.add(path)
+
+        root = root or os.getcwd()
+        for path in self.paths:
+            if not is_test_file(path, patterns):
+                continue
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            if self.imports[path] is None or any(
+                    fnmatch.fnmatch(relative, pattern) or
+                    relative.startswith(pattern.rstrip('/') + '/')
+                    for pattern in always_run):
+                selected.add(path)
+        return sorted(selected)
+
+
+def test():
+    """Main local test."""
+    here = os.path.dirname(os.path.realpath(__file__))
+    paths = [os.path.join(root, name)
+             for root, _, names in os.walk(here) for name in names
+             if name.endswith('.py')]
+    graph = ImportGraph(paths)
+    print(graph.select_tests([os.path.join(here, 'shards.py')]))
+
+
+if __name__ == '__main__':
+    test()
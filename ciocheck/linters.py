@@ -13,8 +13,10 @@ import os
 import re
 
 # Local imports
-from ciocheck.tools import Tool
-from ciocheck.utils import run_command
+from ciocheck.findings import Finding
+from ciocheck.imports import package_root
+from ciocheck.process import JOBS, run_command
+from ciocheck.tools import Tool, get_command_timeout
 
 
 class Linter(Tool):
@@ -27,18 +29,31 @@ class Linter(Tool):
     json_keys = []  # ((old_key, new_key), ...)
     output_on_stderr = False
 
+    # Command line option used to point the linter to its config file
+    config_option = '--config'
+
+    # Findings of a file only depend on its content and can be cached
+    cacheable = True
+
+    # Command line option setting the number of worker processes, if any
+    jobs_option = None
+
+    # Findings also depend on the modules imported by the file
+    imports_in_key = False
+
     def __init__(self, cmd_root):
         """Generic linter with json and regex output support."""
         super(Linter, self).__init__(cmd_root)
         self.paths = None
         self.regex = None
+        self.import_graph = None  # ImportGraph of the checked files
 
     def _parse_regex(self, string):
         """Parse output with grouped regex."""
         results = []
         self.regex = re.compile(self.pattern, re.VERBOSE)
         for matches in self.regex.finditer(string):
-            results.append(matches.groupdict())
+            results.append(Finding.from_dict(matches.groupdict()))
         return results
 
     def _parse_json(self, string):
@@ -46,11 +61,10 @@ class Linter(Tool):
         data = json.loads(string)
         results = []
         for item in data:
-            new_item = {}
+            new_item = dict(item)
             for (old_key, new_key) in self.json_keys:
-                new_item[new_key] = item.pop(old_key)
-            new_item.update(item)
-            results.append(new_item)
+                new_item[new_key] = item[old_key]
+            results.append(Finding.from_dict(new_item))
         return results
 
     def _parse(self, string):
@@ -68,23 +82,94 @@ class Linter(Tool):
         """Override in case extra processing on results is needed."""
         return results
 
+    def get_command(self):
+        """Return the command running the linter, without the paths."""
+        return list(self.command)
+
+    def get_cache_key(self, salt, path):
+        """
+        Return the key of the findings of `path` in the result store.
+
+        Findings depend on the path too, tools exclude or ignore files by
+        name and report different errors for modules and packages.
+        """
+        return self.store.make_key(salt, self.relative_path(path),
+                                   self.content_hash(path))
+
+    def _get_cached_results(self, paths):
+        """Return cached results, paths missing in the cache and their keys."""
+        results, missing, keys = [], [], {}
+        salt = self.get_cache_salt(self.config)
+        for path in paths:
+            key = self.get_cache_key(salt, path)
+            cached = self.store.get(self.name, key)
+            if cached is None:
+                missing.append(path)
+                keys[os.path.abspath(path)] = key
+            else:
+                for item in cached:
+                    results.append(Finding.from_dict(item, path=path))
+        return results, missing, keys
+
+    def _cache_results(self, keys, results):
+        """Store the results of every linted path, including clean ones."""
+        path_results = dict((path, []) for path in keys)
+        for item in results:
+            path = os.path.abspath(item.path)
+            if path not in path_results:
+                # Do not guess, an unknown path could hide other findings
+                return
+            path_results[path].append(item.to_dict(path=False))
+
+        for path, items in path_results.items():
+            self.store.put(self.name, keys[path], items)
+
+    def lint(self, paths, args=None):
+        """Run the linter command on `paths`, return findings and errors."""
+        args = self.get_command() if args is None else list(args)
+        if self.config_option and self.config_file:
+            config_path = self.get_config_path(self.cmd_root)
+            if os.path.isfile(config_path):
+                args.append('{0}={1}'.format(self.config_option, config_path))
+
+        # Workers of the linter take their tokens from the job server.
+        # Linters run from the project, some report relative paths.
+        timeout = get_command_timeout(self.config)
+        if self.jobs_option:
+            with JOBS.reserve(len(paths)) as jobs:
+                args += [self.jobs_option, str(jobs)] + paths
+                out, err = run_command(args, cwd=self.cmd_root or None,
+                                       timeout=timeout, jobs=0)
+        else:
+            out, err = run_command(args + paths, cwd=self.cmd_root or None,
+                                   timeout=timeout)
+        if self.output_on_stderr:
+            # Some versions of the tool write to stdout instead
+            string = err + out
+        else:
+            string = out
+        results = self._parse(string)
+        return self.extra_processing(results), err
+
     def run(self, paths):
-        """Run linter and return a list of dicts."""
-        self.paths = list(paths.keys()) if isinstance(paths, dict) else paths
+        """Run linter and return a list of findings."""
+        paths = list(paths.keys()) if isinstance(paths, dict) else paths
+        self.paths = [os.path.abspath(path) for path in paths]
+        cached_results, keys = [], {}
+        if self.store is not None and self.cacheable and self.paths:
+            cached_results, self.paths, keys = self._get_cached_results(
+                self.paths)
+
         if self.paths:
-            args = list(self.command)
-            args += self.paths
-            out, err = run_command(args)
-            if self.output_on_stderr:
-                string = err
-            else:
-                string = out
-            results = self._parse(string)
-            results = self.extra_processing(results)
+            results, err = self.lint(self.paths)
+
+            # Do not cache the output of a crashed linter
+            if keys and 'Traceback' not in err:
+                self._cache_results(keys, results)
         else:
             results = []
 
-        return results
+        return cached_results + results
 
 
 class Flake8Linter(Linter):
@@ -93,9 +178,11 @@ class Flake8Linter(Linter):
     language = 'python'
     name = 'flake8'
     extensions = ('py', )
+    distribution = 'flake8'
     command = ('flake8', )
     config_file = '.flake8'
     config_sections = [('flake8', 'flake8')]
+    path_options = ('exclude', 'extend-exclude', 'filename')
 
     # Match lines of the form:
     # path/to/file.py:328: undefined name '_thing'
@@ -113,9 +200,11 @@ class Pep8Linter(Linter):
     language = 'python'
     name = 'pep8'
     extensions = ('py', )
+    distribution = 'pep8'
     command = ('pep8', )
     config_file = '.pep8'
     config_sections = [('pep8', 'pep8')]
+    path_options = ('exclude', 'filename')
 
     # Match lines of the form:
     pattern = r'''
@@ -132,10 +221,11 @@ class PydocstyleLinter(Linter):
     language = 'python'
     name = 'pydocstyle'
     extensions = ('py', )
+    distribution = 'pydocstyle'
     command = ('pydocstyle', )
     config_file = '.pydocstyle'
     config_sections = [('pydocstyle', 'pydocstyle')]
-    output_on_stderr = True
+    output_on_stderr = True  # Before pydocstyle 4
 
     # Match lines of the form:
     # ./bootstrap.py:1 at module level:
@@ -155,9 +245,16 @@ class PylintLinter(Linter):
     language = 'python'
     name = 'pylint'
     extensions = ('py', )
-    command = ('pylint', '--output-format', 'json', '-j', '0')
+    distribution = 'pylint'
+    command = ('pylint', '--output-format', 'json')
+    jobs_option = '-j'
     config_file = '.pydocstyle'
     config_sections = [('pydocstyle', 'pydocstyle')]
+    config_option = None
+
+    # Findings depend on the imported modules too
+    imports_in_key = True
+    CROSS_MODULE_CHECKS = ('duplicate-code', 'cyclic-import')
     json_keys = (
         ('message', 'message'),
         ('line', 'line'),
@@ -165,11 +262,92 @@ class PylintLinter(Linter):
         ('type', 'type'),
         ('path', 'path'), )
 
+    @property
+    def cacheable(self):
+        """Findings can only be cached knowing the imports of modules."""
+        return self.import_graph is not None
+
+    def _import_args(self):
+        """
+        Return the arguments giving pylint the import roots of the project.
+
+        pylint finds them from the files it gets, so a subset of the files
+        must resolve imports and module names like a full run does.
+        """
+        if self.import_graph is None:
+            return []
+        roots = [os.path.abspath(self.cmd_root)]
+        for root in sorted(set(package_root(path)
+                               for path in self.import_graph.paths)):
+            if root not in roots:
+                roots.append(root)
+        return ['--init-hook=import sys; sys.path[:0] = {0}'.format(
+            json.dumps(roots))]
+
+    def get_command(self):
+        """
+        Return the pylint command, without checks comparing modules if cached.
+
+        Only the files without cached findings are sent to pylint, so these
+        checks run in a pass of their own, see `run`.
+        """
+        args = list(self.command) + self._import_args()
+        if self.store is not None and self.cacheable:
+            args.append('--disable=' + ','.join(self.CROSS_MODULE_CHECKS))
+        return args
+
+    def _cross_module_results(self, paths):
+        """Return the findings of the checks comparing modules on `paths`."""
+        salt = self.get_cache_salt(self.config)
+        key = self.store.make_key(salt, self.CROSS_MODULE_CHECKS, sorted(
+            (self.relative_path(path), self.content_hash(path))
+            for path in paths))
+        cached = self.store.get(self.name, key)
+        if cached is not None:
+            return [Finding.from_dict(
+                item, path=os.path.join(self.cmd_root, item['path']))
+                for item in cached]
+
+        args = list(self.command) + self._import_args() + [
+            '--disable=all', '--enable=' + ','.join(self.CROSS_MODULE_CHECKS)]
+        results, err = self.lint(paths, args)
+        if 'Traceback' not in err:
+            self.store.put(self.name, key, [
+                dict(item.to_dict(),
+                     path=os.path.relpath(item.path, self.cmd_root))
+                for item in results])
+        return results
+
+    def run(self, paths):
+        """
+        Run pylint on `paths` and return a list of findings.
+
+        With the cache, the checks comparing modules run on all the files in
+        a pass cached by the content of every file.
+        """
+        paths = list(paths.keys()) if isinstance(paths, dict) else paths
+        paths = [os.path.abspath(path) for path in paths]
+        results = super(PylintLinter, self).run(paths)
+        if self.store is not None and self.cacheable and paths:
+            results += self._cross_module_results(paths)
+        return results
+
+    def get_cache_key(self, salt, path):
+        """Return a key covering `path` and its transitive imports."""
+        graph = self.import_graph
+        dependencies = [(graph.modules[dependency],
+                         self.content_hash(dependency))
+                        for dependency in sorted(graph.dependencies(path))]
+        return self.store.make_key(salt, self.relative_path(path),
+                                   graph.modules.get(os.path.normpath(path)),
+                                   self.content_hash(path), dependencies)
+
     def extra_processing(self, results):
         """Make path an absolute path."""
-        for item in results:
-            item['path'] = os.path.join(self.cmd_root, item['path'])
-        return results
+        return [
+            item.replace(path=os.path.join(self.cmd_root, item.path))
+            for item in results
+        ]
 
 
 LINTERS = [
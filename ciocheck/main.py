@@ -7,76 +7,391 @@
 # -----------------------------------------------------------------------------
 """CLI Parser for `ciocheck`."""
 
+from __future__ import absolute_import, print_function
+
 # Standard library imports
 from collections import OrderedDict
 import argparse
 import os
+import platform
 import shutil
 import sys
+import time
 
 # Local imports
-from ciocheck.config import ALL_FILES, load_config
-from ciocheck.files import FileManager
-from ciocheck.formatters import FORMATTERS, MULTI_FORMATTERS, MultiFormatter
-from ciocheck.linters import LINTERS
-from ciocheck.tools import TOOLS
+from ciocheck import __version__
+from ciocheck.cache import format_stats, get_store
+from ciocheck.config import (ALL_FILES, INDEX_FOLDER, STAGED_MODE,
+                             load_config)
+from ciocheck.files import FileManager, Fingerprints, StagedTree
+from ciocheck.process import CommandTimeout, set_max_processes
+from ciocheck.registry import (FORMATTER, LINTER, MULTI_FORMATTER, TESTER,
+                               get_tool, get_tools, tool_names)
+from ciocheck.shards import (SHARD_FILE, decode_results, encode_results,
+                             merge_test_results, parse_shard, read_shard_file,
+                             shard_paths, total_coverage, write_shard_file)
+from ciocheck.utils import get_files
 
 
 class Runner(object):
     """Main tool runner."""
 
-    def __init__(self, cmd_root, cli_args, folders=None, files=None):
-        """Main tool runner."""
+    def __init__(self, cmd_root, cli_args, folders=None, files=None,
+                 stream=None, fingerprints=None):
+        """
+        Main tool runner.
+
+        The report is printed on `stream`, standard output by default.
+        `fingerprints` can be shared by runners on the same folders.
+        """
         # Run options
         self.cmd_root = cmd_root  # Folder on which the command was executed
+        self.stream = stream
         self.config = load_config(cmd_root, cli_args)
-        self.file_manager = FileManager(folders=folders, files=files)
+        self.store = get_store(cmd_root, self.config)
+        self.file_manager = FileManager(
+            folders=folders,
+            files=files,
+            rename_similarity=self.config.get_value('rename_similarity'),
+            index_folder=os.path.join(cmd_root, INDEX_FOLDER))
+        self.fingerprints = fingerprints or Fingerprints()
         self.folders = folders
         self.files = files
         self.all_results = OrderedDict()
         self.all_tools = {}
         self.test_results = None
         self.failed_checks = set()
+        self.timings = OrderedDict()  # {tool name: seconds}
+        self.report = OrderedDict()
+        self.coverage_gaps = OrderedDict()
+        self.cached_run = None  # Summary of a matching successful run
+        self.slow_files = OrderedDict()  # {formatter: [(path, seconds)]}
+        self._import_graph = None
 
         self.check = self.config.get_value('check')
         self.enforce = self.config.get_value('enforce')
         self.diff_mode = self.config.get_value('diff_mode')
         self.file_mode = self.config.get_value('file_mode')
         self.branch = self.config.get_value('branch')
-        self.disable_formatters = cli_args.disable_formatters
-        self.disable_linters = cli_args.disable_linters
-        self.disable_tests = cli_args.disable_tests
+        if self.config.get_value('jobs'):
+            set_max_processes(self.config.get_value('jobs'))
+        self.disable_formatters = getattr(cli_args, 'disable_formatters',
+                                          False)
+        self.disable_linters = getattr(cli_args, 'disable_linters', False)
+        self.disable_tests = getattr(cli_args, 'disable_tests', False)
+        self.force_run = getattr(cli_args, 'force_run', False)
+        self.coverage_fail = False
+
+        # Only check a part of the files and tests, see `ciocheck.shards`
+        self.shard = getattr(cli_args, 'shard', None)
+        self.shard_file = getattr(cli_args, 'shard_file', None)
+        self._shard_paths = {}
+
+        # Check the staged (index) content instead of the working tree
+        self.staged_tree = None
+        if (self.config.get_value('staged_contents') and
+                self.diff_mode == STAGED_MODE):
+            self.staged_tree = StagedTree(self.file_manager)
+
+    def select_shard(self, files, file_mode):
+        """Return the part of `files` (list or dict) checked by this shard."""
+        if file_mode not in self._shard_paths:
+            all_files = self.file_manager.get_files(
+                branch=self.branch, diff_mode=self.diff_mode,
+                file_mode=file_mode)
+            self._shard_paths[file_mode] = shard_paths(all_files, self.shard)
+
+        paths = self._shard_paths[file_mode]
+        if isinstance(files, dict):
+            return OrderedDict((path, value) for path, value in files.items()
+                               if path in paths)
+        return [path for path in files if path in paths]
+
+    def get_files(self, extensions, file_mode=None):
+        """Return the files to check and the same files as seen by tools."""
+        file_mode = file_mode or self.file_mode
+        files = self.file_manager.get_files(
+            branch=self.branch,
+            diff_mode=self.diff_mode,
+            file_mode=file_mode,
+            extensions=extensions)
+        if self.shard is not None:
+            files = self.select_shard(files, file_mode)
+        if self.staged_tree is not None:
+            tool_files = self.staged_tree.to_private(files)
+        else:
+            tool_files = files
+        return files, tool_files
+
+    def public_results(self, results):
+        """Map the paths of tool results back to the project paths."""
+        if self.staged_tree is not None and results:
+            results = self.staged_tree.to_public(results)
+        return results
+
+    def relative_path(self, path):
+        """Return `path` relative to the folder the command runs on."""
+        return os.path.relpath(path, self.cmd_root).replace(os.sep, '/')
+
+    def get_import_graph(self):
+        """Return the import graph of the python files of the project."""
+        from ciocheck.imports import ImportGraph
+
+        if self._import_graph is None:
+            # Checked modules can import modules of other project folders
+            files = get_files(paths=[self.cmd_root], exts=('py', ))
+            if self.store is not None:
+                self.fingerprints.prefetch(files, self.file_manager.diff_tool)
+            self._import_graph = ImportGraph(
+                files, store=self.store, content_hash=self.fingerprints.get)
+        return self._import_graph
+
+    def select_tests(self, files):
+        """Return the test files of `files` importing the modified files."""
+        from ciocheck.imports import DEFAULT_TEST_FILES
+
+        graph = self.get_import_graph()
+        modified = self.file_manager.get_modified_files(
+            branch=self.branch, diff_mode=self.diff_mode, extensions=('py', ))
+
+        patterns = self.config.get_options('pytest').get('python_files')
+        if isinstance(patterns, str):
+            patterns = patterns.split()
+        tests = graph.select_tests(
+            modified, patterns=patterns or DEFAULT_TEST_FILES,
+            always_run=self.config.get_value('always_run'),
+            root=self.cmd_root)
+        checked = set(os.path.normpath(path) for path in files)
+        tests = [path for path in tests if path in checked]
+        self.echo('Selected {0} test files importing {1} modified '
+                  'files'.format(len(tests), len(modified)))
+        return tests
+
+    def get_run_key(self):
+        """
+        Return the fingerprint of this run, None if runs are not cached.
+
+        It covers the content of every file in the checked folders, the
+        modified files and lines, the commits diffs are based on, the
+        configuration and the versions and options of the tools.
+        """
+        if (self.store is None or self.staged_tree is not None or
+                self.shard is not None or self.force_run or
+                not self.config.get_value('run_cache')):
+            return None
+
+        all_files = self.file_manager.get_files(
+            branch=self.branch, diff_mode=self.diff_mode, file_mode=ALL_FILES)
+        self.fingerprints.prefetch(all_files, self.file_manager.diff_tool)
+        tree = [(self.relative_path(path), self.fingerprints.get(path))
+                for path in all_files]
+
+        files, _ = self.get_files(extensions=())
+        if isinstance(files, dict):
+            modified = [(self.relative_path(path), list(lines[0]))
+                        for path, lines in files.items()]
+        else:
+            modified = [self.relative_path(path) for path in files]
+
+        commits = self.file_manager.diff_tool.base_commits(self.branch)
+        commits = sorted((self.relative_path(top_level), commit)
+                         for top_level, commit in commits.items())
+
+        tools = OrderedDict()
+        for kind in (FORMATTER, MULTI_FORMATTER, LINTER, TESTER):
+            for tool in get_tools(kind, self.check):
+                tools[tool.name] = tool.get_cache_salt(self.config)
+
+        disabled = [self.disable_formatters, self.disable_linters,
+                    self.disable_tests]
+        return self.store.make_key(
+            'run', __version__, platform.python_version(), self.config.digest,
+            self.check, self.enforce, disabled, tools, commits, modified, tree)
+
+    def print_cached_run(self, summary):
+        """Print the summary of a successful run with the same fingerprint."""
+        when = time.strftime('%Y-%m-%d %H:%M:%S',
+                             time.localtime(summary['time']))
+        self.echo('Same files, configuration and tools as the successful run '
+                  'of {0}, skipping checks.'.format(when))
+        for tool_name, count in summary['results']:
+            self.echo('  {0}: {1} reported'.format(tool_name, count))
+        if summary['tests']:
+            counts = ', '.join('{0} {1}'.format(value, key)
+                               for key, value in summary['tests'])
+            self.echo('  pytest: {0}'.format(counts))
+
+    def save_run(self, run_key):
+        """Record the summary of a successful run under its fingerprint."""
+        formatters = [tool.name for kind in (FORMATTER, MULTI_FORMATTER)
+                      for tool in get_tools(kind, self.check)]
+        if (not self.config.get_value('check_only') and
+                any(self.all_results.get(name) for name in formatters)):
+            # Formatters changed files, the fingerprint no longer applies
+            return
+
+        tests = []
+        if self.test_results and 'pytest' in self.test_results:
+            summary = self.test_results['pytest']['report']['summary']
+            tests = [(key, value) for key, value in summary.items()
+                     if key not in ('num_tests', 'duration')]
+        summary = {
+            'time': time.time(),
+            'results': [(tool_name, len(data['results']))
+                        for tool_name, data in self.all_results.items()
+                        if data and data['results']],
+            'tests': tests,
+        }
+        self.store.put('run', run_key, summary)
+
+    def execute(self):
+        """
+        Run the checks and collect their results, without printing a report.
+
+        Return if no enforced check failed. Runs with the fingerprint of a
+        previous successful run are skipped, `cached_run` is then set.
+        """
+        self.clean()
+        run_key = self.get_run_key()
+        if run_key is not None:
+            self.cached_run = self.store.get('run', run_key)
+        if self.cached_run is not None:
+            self.store.save_stats()
+            self.file_manager.commit_index()
+            return True
+
+        if self.staged_tree is not None:
+            files, _ = self.get_files(extensions=())
+            self.staged_tree.setup(files)
+        elif self.store is not None and run_key is None:
+            # Content hashes of cache keys, mostly known to git already
+            files, _ = self.get_files(extensions=())
+            self.fingerprints.prefetch(files, self.file_manager.diff_tool)
+        try:
+            self.run_tools()
+        finally:
+            if self.staged_tree is not None:
+                self.staged_tree.cleanup()
+
+        if self.store is not None:
+            self.store.save_stats()
+        if self.shard is not None:
+            self.save_shard()
+
+        self.collect_results()
+        success = not self.enforced_failures()
+        if success:
+            if run_key is not None:
+                self.save_run(run_key)
+            self.file_manager.commit_index()
+        return success
 
     def run(self):
-        """Run tools."""
+        """Run tools, print the report and return if the run succeeded."""
         msg = 'Running ciocheck'
-        print('')
-        print('=' * len(msg))
-        print(msg)
-        print('=' * len(msg))
-        print('')
-        self.clean()
-
-        check_linters = [l for l in LINTERS if l.name in self.check]
-        check_formatters = [f for f in FORMATTERS if f.name in self.check]
-        check_testers = [t for t in TOOLS if t.name in self.check]
-        run_multi = any(f for f in MULTI_FORMATTERS if f.name in self.check)
+        self.echo('')
+        self.echo('=' * len(msg))
+        self.echo(msg)
+        self.echo('=' * len(msg))
+        self.echo('')
+
+        success = self.execute()
+        if self.cached_run is not None:
+            self.print_cached_run(self.cached_run)
+        else:
+            self.print_results()
+        self.print_verdict(success)
+        return success
+
+    def save_shard(self):
+        """Write the results of this shard for `ciocheck-merge`."""
+        path = self.shard_file or os.path.join(
+            self.cmd_root, SHARD_FILE.format(*self.shard))
+        results, tests = encode_results(self.all_results, self.test_results,
+                                        self.cmd_root)
+        write_shard_file(path, self.shard, {
+            'check': self.check,
+            'enforce': self.enforce,
+            'results': results,
+            'tests': tests,
+            'failed_checks': sorted(self.failed_checks),
+            'coverage_fail': self.coverage_fail,
+        })
+        self.echo('Shard results written to {0}'.format(path))
+
+    def merge_shard(self, data):
+        """Add the results of a shard written by `save_shard`."""
+        all_results, tests = decode_results(data['results'], data['tests'],
+                                            self.cmd_root)
+        for tool_name, tool_results in all_results.items():
+            if tool_name in self.all_results:
+                merged = self.all_results[tool_name]
+                files = tool_results['files']
+                if isinstance(files, dict):
+                    merged['files'].update(files)
+                else:
+                    merged['files'] = sorted(set(merged['files'] + files))
+                merged['results'] += tool_results['results']
+            else:
+                self.all_results[tool_name] = tool_results
+
+        self.test_results = merge_test_results(self.test_results, tests)
+        self.failed_checks.update(data['failed_checks'])
+
+    def check_merged_coverage(self):
+        """Check the coverage `fail_under` on the coverage of every shard."""
+        options = self.config.get_options('coverage:report')
+        fail_under = float(options.get('fail_under') or 0)
+        covered_lines = (self.test_results or {}).get('coverage')
+        if not fail_under or not covered_lines:
+            return
+
+        tool = get_tool('coverage')(self.cmd_root)
+        tool.create_config(self.config)
+        percent = total_coverage(covered_lines,
+                                 tool.get_config_path(self.cmd_root))
+        self.coverage_fail = percent < fail_under
+        self.echo('Total coverage of every shard: {0:.2f}%'.format(percent))
+
+    def echo(self, message=''):
+        """Print a line of the report on the output stream of the runner."""
+        print(message, file=self.stream or sys.stdout)
+
+    def print_verdict(self, success):
+        """Print the final banner of a run."""
+        if success:
+            msg = 'Ciocheck successful run'
+        else:
+            msg = "Ciocheck failures in: {0}".format(repr(self.failed_checks))
+        self.echo('\n\n' + '=' * len(msg))
+        self.echo(msg)
+        self.echo('=' * len(msg))
+        self.echo('')
+
+    def run_tools(self):
+        """Run formatters, linters and testers."""
+        check_linters = get_tools(LINTER, self.check)
+        check_formatters = get_tools(FORMATTER, self.check)
+        check_testers = get_tools(TESTER, self.check)
+        run_multi = bool(get_tools(MULTI_FORMATTER, self.check))
 
         # Format before lint, linters may complain about bad formatting
 
         # Formatters
         if not self.disable_formatters:
             for formatter in check_formatters:
-                print('Running "{}" ...'.format(formatter.name))
+                self.echo('Running "{}" ...'.format(formatter.name))
+                started = time.time()
                 tool = formatter(self.cmd_root)
-                files = self.file_manager.get_files(
-                    branch=self.branch,
-                    diff_mode=self.diff_mode,
-                    file_mode=self.file_mode,
-                    extensions=tool.extensions)
+                files, tool_files = self.get_files(tool.extensions)
                 tool.create_config(self.config)
+                tool.store = self.store
+                tool.fingerprints = self.fingerprints
                 self.all_tools[tool.name] = tool
-                results = tool.run(files)
+                if tool.name == 'pyformat' and self.staged_tree is not None:
+                    tool.root_folder = self.staged_tree.private_path(
+                        self.cmd_root)
+                results = self.public_results(tool.run(tool_files))
                 # Pyformat might include files in results that are not in files
                 # like when an init is created
                 if results:
@@ -84,82 +399,161 @@ class Runner(object):
                         'files': files,
                         'results': results,
                     }
+                self.timings[tool.name] = time.time() - started
 
             # The result of the the multi formatter is special!
             if run_multi:
-                print('Running "Multi formatter"')
-                tool = MultiFormatter(self.cmd_root, self.check)
-                files = self.file_manager.get_files(
-                    branch=self.branch,
-                    diff_mode=self.diff_mode,
-                    file_mode=self.file_mode,
-                    extensions=tool.extensions)
-                multi_results = tool.run(files)
+                from ciocheck.formatters import MultiFormatter
+
+                self.echo('Running "Multi formatter"')
+                started = time.time()
+                tool = MultiFormatter(self.cmd_root, self.check, self.config)
+                tool.stream = self.stream
+                tool.store = self.store
+                tool.fingerprints = self.fingerprints
+                files, tool_files = self.get_files(tool.extensions)
+                multi_results = tool.run(tool_files)
                 for key, values in multi_results.items():
                     self.all_results[key] = {
                         'files': files,
-                        'results': values,
+                        'results': self.public_results(values),
                     }
-
-        # Linters
-        if not self.disable_linters:
-            for linter in check_linters:
-                print('Running "{}" ...'.format(linter.name))
-                tool = linter(self.cmd_root)
-                files = self.file_manager.get_files(
-                    branch=self.branch,
-                    diff_mode=self.diff_mode,
-                    file_mode=self.file_mode,
-                    extensions=tool.extensions)
-                self.all_tools[tool.name] = tool
-                tool.create_config(self.config)
-                self.all_results[tool.name] = {
-                    'files': files,
-                    'results': tool.run(files),
-                }
-
-        # Tests
+                self.timings[tool.name] = time.time() - started
+                slowest = int(self.config.get_value('slowest_files') or 0)
+                if slowest:
+                    for name, timings in tool.slowest_files(slowest).items():
+                        self.slow_files[name] = [
+                            (self.public_results([{'path': path}])[0]['path'],
+                             seconds) for path, seconds in timings]
+                    self.print_slow_files()
+
+        # Tests (always on the working tree) start once formatting is done
+        # and run in the background while linting
+        testers = []
         if not self.disable_tests:
             for tester in check_testers:
-                print('Running "{}" ...'.format(tester.name))
+                self.echo('Starting "{}" ...'.format(tester.name))
+                started = time.time()
                 tool = tester(self.cmd_root)
+                tool.stream = self.stream
                 tool.create_config(self.config)
                 self.all_tools[tool.name] = tool
 
                 if tool.name == 'pytest':
                     tool.setup_pytest_coverage_args(self.folders)
+                    tool.shard = self.shard
 
                 files = self.file_manager.get_files(
                     branch=self.branch,
                     diff_mode=self.diff_mode,
                     file_mode=ALL_FILES,
                     extensions=tool.extensions)
-                results = tool.run(files)
-                if results:
-                    results['files'] = files
-                    self.test_results = results
+                tool_files = files
+                if (tool.name == 'pytest' and
+                        self.config.get_value('select_tests')):
+                    tool_files = self.select_tests(files)
+                    if not tool_files:
+                        self.echo('No tests import the modified files, '
+                                  'skipping "{}"'.format(tool.name))
+                        continue
+                tool.start(tool_files)
+                testers.append((tool, files, started))
 
-        for tool in LINTERS + FORMATTERS + TOOLS:
+        # Linters
+        if not self.disable_linters:
+            for linter in check_linters:
+                self.echo('Running "{}" ...'.format(linter.name))
+                started = time.time()
+                tool = linter(self.cmd_root)
+                files, tool_files = self.get_files(tool.extensions)
+                self.all_tools[tool.name] = tool
+                tool.create_config(self.config)
+                tool.store = self.store
+                tool.fingerprints = self.fingerprints
+                if self.staged_tree is not None:
+                    tool.files_root = self.staged_tree.private_path(
+                        self.cmd_root)
+                if (tool.imports_in_key and self.store is not None and
+                        self.staged_tree is None):
+                    tool.import_graph = self.get_import_graph()
+                try:
+                    results = tool.run(tool_files)
+                except CommandTimeout as err:
+                    self.echo(str(err))
+                    self.failed_checks.add(tool.name)
+                    results = []
+                self.all_results[tool.name] = {
+                    'files': files,
+                    'results': self.public_results(results),
+                }
+                self.timings[tool.name] = time.time() - started
+
+        if self.staged_tree is not None:
+            for path in self.staged_tree.write_back():
+                self.echo('Staged changes updated: {0}'.format(path))
+
+        for tool, files, started in testers:
+            results = tool.wait()
+            self.timings[tool.name] = time.time() - started
+            if tool.name == 'pytest':
+                self.coverage_fail = tool.coverage_fail
+            if results:
+                results['files'] = files
+                self.test_results = results
+
+        for tool in check_linters + check_formatters + check_testers:
             tool.remove_config(self.cmd_root)
         self.clean()
 
-        self.process_results(self.all_results)
-        if self.enforce_checks():
-            msg = 'Ciocheck successful run'
-            print('\n\n' + '=' * len(msg))
-            print(msg)
-            print('=' * len(msg))
-            print('')
-
-    def process_results(self, all_results):
-        """Group all results by file path."""
-        all_changed_paths = []
-        for tool_name, data in all_results.items():
-            if data:
-                files, results = data['files'], data['results']
-                all_changed_paths += [result['path'] for result in results]
+    def print_slow_files(self):
+        """Print the slowest files of every multi formatter."""
+        self.echo('')
+        self.echo('Slowest files per formatter')
+        for tool_name, timings in self.slow_files.items():
+            self.echo('  ' + tool_name)
+            for path, seconds in timings:
+                self.echo('    {0:>8.2f}s  {1}'.format(
+                    seconds, self.relative_path(path)))
+        self.echo('')
+
+    def _result_messages(self, result, added_lines, verb):
+        """Return the report lines of a tool result."""
+        messages = []
 
-        all_changed_paths = list(sorted(set(all_changed_paths)))
+        # Linters
+        line = int(result.get('line', -1))
+        if line and line in added_lines:
+            spaces = (8 - len(str(line))) * ' '
+            messages.append('    {0}:{1}{2}: {3}'.format(
+                line, spaces, result['type'], result['message']))
+
+        # Formatters
+        if result.get('created'):
+            messages.append('    __init__ file created.')
+        if result.get('missing'):
+            messages.append('    __init__ file missing.')
+        if result.get('added-copy'):
+            messages.append('    {0} copyright.'.format(verb))
+        if result.get('added-header'):
+            messages.append('    {0} header.'.format(verb))
+        if result.get('diff'):
+            messages.append(self.format_diff(result['diff']))
+        if result.get('error'):
+            messages.append('    ' + result['error'])
+        return messages
+
+    def collect_results(self):
+        """
+        Group the reported results by path and find the coverage gaps.
+
+        Findings are only reported on modified lines. Tools with reported
+        results, failed tests and coverage failures become failed checks.
+        """
+        paths = set()
+        for data in self.all_results.values():
+            if data:
+                paths.update(result['path'] for result in data['results'])
+        verb = 'missing' if self.config.get_value('check_only') else 'added'
 
         if self.test_results:
             test_files = self.test_results.get('files')
@@ -168,93 +562,48 @@ class Runner(object):
             test_files = []
             test_coverage = []
 
-        for path in all_changed_paths:
-            short_path = path.replace(self.cmd_root, '...')
-            print('')
-            print(short_path)
-            print('-' * len(short_path))
-            for tool_name, data in all_results.items():
-                if data:
-                    files, results = data['files'], data['results']
-                    lines = [[-1], range(100000)]
-
-                    if isinstance(files, dict):
-                        added_lines = files.get(path, lines)[-1]
-                    else:
-                        added_lines = lines[-1]
-
-                    messages = []
-                    for result in results:
-                        res_path = result['path']
-                        if path == res_path:
-                            # LINTERS
-                            line = int(result.get('line', -1))
-                            created = result.get('created')
-                            added_copy = result.get('added-copy')
-                            added_header = result.get('added-header')
-                            diff = result.get('diff')
-                            if line and line in list(added_lines):
-                                spaces = (8 - len(str(line))) * ' '
-                                args = result.copy()
-                                args['spaces'] = spaces
-                                msg = ('    {line}:{spaces}'
-                                       '{type}: {message}').format(**args)
-                                messages.append(msg)
-
-                            # Formatters
-                            if created:
-                                msg = '    __init__ file created.'
-                                messages.append(msg)
-                            if added_copy:
-                                msg = '    added copyright.'
-                                messages.append(msg)
-                            if added_header:
-                                msg = '    added header.'
-                                messages.append(msg)
-                            if diff:
-                                msg = self.format_diff(diff)
-                                messages.append(msg)
-
-                            # TESTERS / COVERAGE
-
-                    test = [r['path'] for r in results if path == r['path']]
-                    if test and messages:
-                        print('\n  ' + tool_name)
-                        print('  ' + '-' * len(tool_name))
-                        self.failed_checks.add(tool_name)
-                        for message in messages:
-                            print(message)
-
-            if isinstance(test_files, dict) and test_files:
+        self.report = OrderedDict()  # {path: {tool: [(result, messages)]}}
+        self.coverage_gaps = OrderedDict()  # {path: (lines, percentage)}
+        for path in sorted(paths):
+            tools_report = self.report[path] = OrderedDict()
+            for tool_name, data in self.all_results.items():
+                if not data:
+                    continue
+
+                # Files are {path: (added_lines, deleted_lines)}
+                files = data['files']
+                if isinstance(files, dict):
+                    added_lines = files.get(path, [range(100000), []])[0]
+                else:
+                    added_lines = range(100000)
+                added_lines = set(added_lines)
+
+                reported = []
+                for result in data['results']:
+                    if result['path'] == path:
+                        messages = self._result_messages(result, added_lines,
+                                                         verb)
+                        if messages:
+                            reported.append((result, messages))
+                if reported:
+                    tools_report[tool_name] = reported
+                    self.failed_checks.add(tool_name)
+
+            if isinstance(test_files, dict) and test_files and test_coverage:
                 # Asked for lines changed
-                if test_coverage:
-                    lines_changed_not_covered = []
-                    lines = test_files.get(path)
-                    lines_added = lines[-1] if lines else []
-                    lines_covered = test_coverage.get(path)
-                    for line in lines_added:
-                        if line not in lines_covered:
-                            lines_changed_not_covered.append(str(line))
-
-                    if lines_changed_not_covered:
-                        uncov_perc = ((1.0 * len(lines_changed_not_covered)) /
-                                      (1.0 * len(lines_added)))
-                        cov_perc = (1 - uncov_perc) * 100
-                        tool_name = 'coverage'
-                        print('\n  ' + tool_name)
-                        print('  ' + '-' * len(tool_name))
-                        print('    The following lines changed and are not '
-                              'covered by tests ({0}%):'.format(cov_perc))
-                        print('    ' + ', '.join(lines_changed_not_covered))
-
-        print('')
-        pytest_tool = self.all_tools.get('pytest')
-        if pytest_tool:
-            if pytest_tool.coverage_fail:
-                self.failed_checks.add('coverage')
-
-    def enforce_checks(self):
-        """Check that enforced checks did not generate reports."""
+                lines = test_files.get(path)
+                lines_added = lines[0] if lines else []
+                lines_covered = test_coverage.get(path) or []
+                not_covered = [line for line in lines_added
+                               if line not in lines_covered]
+                if not_covered:
+                    uncov_perc = ((1.0 * len(not_covered)) /
+                                  (1.0 * len(lines_added)))
+                    cov_perc = (1 - uncov_perc) * 100
+                    self.coverage_gaps[path] = (not_covered, cov_perc)
+
+        if self.coverage_fail:
+            self.failed_checks.add('coverage')
         if self.test_results:
             if 'pytest' in self.test_results:
                 test_summary = self.test_results['pytest']['report']['summary']
@@ -263,21 +612,38 @@ class Runner(object):
             else:
                 self.failed_checks.add('pytest')
 
-        for enforce_tool in self.enforce:
-            if enforce_tool in self.failed_checks:
-                msg = "Ciocheck failures in: {0}".format(
-                    repr(self.failed_checks))
-                print('\n\n' + '=' * len(msg))
-                print(msg)
-                print('=' * len(msg))
-                print('')
-                sys.exit(1)
-                break
-
-        return True
+    def print_results(self):
+        """Print the results collected by `collect_results`, by path."""
+        for path, tools_report in self.report.items():
+            short_path = path.replace(self.cmd_root, '...')
+            self.echo('')
+            self.echo(short_path)
+            self.echo('-' * len(short_path))
+            for tool_name, reported in tools_report.items():
+                self.echo('\n  ' + tool_name)
+                self.echo('  ' + '-' * len(tool_name))
+                for _, messages in reported:
+                    for message in messages:
+                        self.echo(message)
+
+            if path in self.coverage_gaps:
+                lines, cov_perc = self.coverage_gaps[path]
+                tool_name = 'coverage'
+                self.echo('\n  ' + tool_name)
+                self.echo('  ' + '-' * len(tool_name))
+                self.echo('    The following lines changed and are not '
+                          'covered by tests ({0}%):'.format(cov_perc))
+                self.echo('    ' + ', '.join(str(line) for line in lines))
+        self.echo('')
+
+    def enforced_failures(self):
+        """Return the enforced checks that failed."""
+        return [tool for tool in self.enforce if tool in self.failed_checks]
 
     def format_diff(self, diff, indent='    '):
         """Format diff to include an indentation for console printing."""
+        if hasattr(diff, 'render'):
+            diff = diff.render()
         lines = diff.split('\n')
         new_lines = []
         for line in lines:
@@ -295,6 +661,110 @@ class Runner(object):
                 pass
 
 
+def cache_main(args=None):
+    """CLI `Parser for ciocheck-cache` commands."""
+    parser = argparse.ArgumentParser(
+        prog='ciocheck-cache', description='Manage the ciocheck result cache.')
+    parser.add_argument(
+        'command', choices=['gc', 'stats'], help='Cache command to run.')
+    parser.add_argument(
+        '--cache-dir',
+        '-cd',
+        dest='cache_dir',
+        default=None,
+        help='Cache folder to use. Default is the configured one.')
+    parser.add_argument(
+        '--max-size',
+        '-ms',
+        dest='max_size',
+        type=int,
+        default=None,
+        help='Size cap in megabytes for gc. Default is the configured one.')
+    parser.add_argument(
+        '--config',
+        '-cf',
+        dest='config_file',
+        default=None,
+        help=('Select a config file to use. Default is none.'))
+
+    cli_args = parser.parse_args(args)
+    root = os.getcwd()
+    config = load_config(root, cli_args)
+    store = get_store(root, config)
+    if store is None:
+        print('The result cache is disabled.')
+        return
+
+    if cli_args.command == 'gc':
+        max_size = cli_args.max_size
+        if max_size is not None:
+            max_size = max_size * 1024 * 1024
+        removed, freed = store.gc(max_size=max_size)
+        print('Removed {0} entries ({1:.1f} MB)'.format(
+            removed, freed / (1024.0 * 1024.0)))
+    print(format_stats(store.stats()))
+
+
+def split_paths(paths, root):
+    """Return the folders and the files in `paths`, relative to `root`."""
+    folders = []
+    files = []
+    for folder_or_file in paths:
+        folder_or_file = os.path.abspath(os.path.join(root, folder_or_file))
+        if os.path.isfile(folder_or_file):
+            files.append(folder_or_file)
+        elif os.path.isdir(folder_or_file):
+            folders.append(folder_or_file)
+    return folders, files
+
+
+def shard_argument(value):
+    """Parse a `K/N` shard argument."""
+    try:
+        return parse_shard(value)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
+def merge_main(args=None):
+    """CLI `Parser for ciocheck-merge` command."""
+    parser = argparse.ArgumentParser(
+        prog='ciocheck-merge',
+        description='Report the results of every shard of a run.')
+    parser.add_argument(
+        'shard_files', nargs='+', help='Files written by ciocheck --shard.')
+    parser.add_argument(
+        '--config',
+        '-cf',
+        dest='config_file',
+        default=None,
+        help=('Select a config file to use. Default is none.'))
+
+    cli_args = parser.parse_args(args)
+    shards = [read_shard_file(path) for path in cli_args.shard_files]
+    shards = sorted(shards, key=lambda data: data['shard'])
+    count = shards[0]['shard'][1]
+    expected = [[index, count] for index in range(1, count + 1)]
+    if [data['shard'] for data in shards] != expected:
+        found = ', '.join('{0}/{1}'.format(*data['shard']) for data in shards)
+        print('Expected the results of {0} shards, found: {1}'.format(
+            count, found))
+        sys.exit(1)
+
+    runner = Runner(os.getcwd(), cli_args, folders=[])
+    runner.check = shards[0]['check']
+    runner.enforce = shards[0]['enforce']
+    for data in shards:
+        runner.merge_shard(data)
+    runner.check_merged_coverage()
+    runner.collect_results()
+    runner.print_results()
+    success = not runner.enforced_failures()
+    runner.print_verdict(success)
+    if not success:
+        sys.exit(1)
+
+
 def main():
     """CLI `Parser for ciocheck`."""
     description = 'Run Continuum IO test suite.'
@@ -335,6 +805,22 @@ def main():
         choices=['commited', 'staged', 'unstaged'],
         default=None,
         help='Define diff mode. Default mode is commited.')
+    parser.add_argument(
+        '--staged-contents',
+        '-sc',
+        dest='staged_contents',
+        action='store_true',
+        default=False,
+        help=('With the staged diff mode, check the staged content of files '
+              'instead of the working tree. Formatters update the index.'))
+    parser.add_argument(
+        '--check-only',
+        '-co',
+        dest='check_only',
+        action='store_true',
+        default=False,
+        help=('Report the changes formatters would make without writing '
+              'them. Enforced formatters fail if a change is reported.'))
     parser.add_argument(
         '--branch',
         '-b',
@@ -347,20 +833,14 @@ def main():
         '-c',
         dest='check',
         nargs='+',
-        choices=[
-            'pep8', 'pydocstyle', 'flake8', 'pylint', 'pyformat', 'isort',
-            'yapf', 'autopep8', 'coverage', 'pytest'
-        ],
+        choices=tool_names(),
         default=None,
         help='Select tools to run. Default is "pep8"')
     parser.add_argument(
         '--enforce',
         '-e',
         dest='enforce',
-        choices=[
-            'pep8', 'pydocstyle', 'flake8', 'pylint', 'pyformat', 'isort',
-            'yapf', 'autopep8', 'coverage', 'pytest'
-        ],
+        choices=tool_names(),
         default=None,
         nargs='+',
         help=('Select tools to enforce. Enforced tools will '
@@ -372,21 +852,52 @@ def main():
         dest='config_file',
         default=None,
         help=('Select a config file to use. Default is none.'))
+    parser.add_argument(
+        '--cache-dir',
+        '-cd',
+        dest='cache_dir',
+        default=None,
+        help=('Folder of the result cache, it can be shared by several '
+              'runs. Default is ".ciocheck_cache/results".'))
+    parser.add_argument(
+        '--force-run',
+        '-fr',
+        dest='force_run',
+        action='store_true',
+        default=False,
+        help=('Run every check even if the files, configuration and tools '
+              'are the same as in a previous successful run.'))
+    parser.add_argument(
+        '--shard',
+        '-s',
+        dest='shard',
+        type=shard_argument,
+        default=None,
+        help=('Only check the K-th of N parts of the files and tests, given '
+              'as K/N. Merge the results with "ciocheck-merge".'))
+    parser.add_argument(
+        '--shard-file',
+        '-sf',
+        dest='shard_file',
+        default=None,
+        help=('File where the results of the shard are written. Default is '
+              '"shard-K-of-N.json".'))
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        dest='jobs',
+        default=None,
+        help=('Maximum number of processes running at the same time, '
+              'shared by all tools. Default is the number of cpus available '
+              '(cpu affinity and container quotas are honored).'))
 
     cli_args = parser.parse_args()
     root = os.getcwd()
-    folders = []
-    files = []
-    for folder_or_file in cli_args.folders:
-        folder_or_file = os.path.abspath(folder_or_file)
-        if os.path.isfile(folder_or_file):
-            files.append(folder_or_file)
-        elif os.path.isdir(folder_or_file):
-            folders.append(folder_or_file)
-
+    folders, files = split_paths(cli_args.folders, root)
     if folders or files:
         test = Runner(root, cli_args, folders=folders, files=files)
-        test.run()
+        if not test.run():
+            sys.exit(1)
     elif not folders and not files:
         print('Invalid folders or files!')
 
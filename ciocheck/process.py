@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Subprocess layer shared by git calls, linters and formatter workers.
+
+Every command runs in its own thread and takes a token from a global job
+server, so callers on different threads can overlap their work without
+starting more processes than the cpu budget allows. Commands can have a
+timeout, and their standard output can be consumed line by line while they
+run.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from contextlib import contextmanager
+import os
+import signal
+import subprocess
+import threading
+
+# Third party imports
+from six.moves import queue
+import six
+
+
+class CommandTimeout(Exception):
+    """A command did not finish on time and was killed."""
+
+    def __init__(self, args, timeout):
+        """A command did not finish on time and was killed."""
+        message = '"{0}" timed out after {1} seconds'.format(
+            ' '.join(args), timeout)
+        super(CommandTimeout, self).__init__(message)
+        self.args_list = list(args)
+        self.timeout = timeout
+
+
+class JobServer(object):
+    """
+    Pool of job tokens shared by every parallel stage of a run.
+
+    Each running command holds a token, and tools with their own workers
+    (pylint jobs, pytest-xdist workers) reserve one token per worker, so the
+    whole run never uses more processes than the cpu budget.
+    """
+
+    def __init__(self, tokens=None):
+        """Pool of job tokens shared by every parallel stage of a run."""
+        self._tokens = tokens
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    def _get_tokens(self):
+        """Return the total number of tokens, the cpu count by default."""
+        if self._tokens is None:
+            from ciocheck.utils import cpu_count
+            self._tokens = cpu_count()
+        return self._tokens
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    @property
+    def tokens(self):
+        """Return the total number of tokens."""
+        with self._condition:
+            return self._get_tokens()
+
+    def set_tokens(self, tokens):
+        """Change the total number of tokens."""
+        with self._condition:
+            self._tokens = max(1, int(tokens))
+            self._condition.notify_all()
+
+    def acquire(self, count=1, minimum=None):
+        """
+        Take up to `count` tokens, blocking until `minimum` are available.
+
+        `count` None means as many as available. Return the number of tokens
+        taken, which has to be given back with `release`.
+        """
+        minimum = count if minimum is None else minimum
+        with self._condition:
+            while True:
+                total = self._get_tokens()
+                # A request larger than the pool can only wait for all of it
+                needed = min(minimum or 1, total)
+                available = total - self._in_use
+                if available >= needed:
+                    break
+                self._condition.wait()
+            taken = available if count is None else min(count, available)
+            taken = max(taken, needed)
+            self._in_use += taken
+            return taken
+
+    def release(self, count=1):
+        """Give back `count` tokens."""
+        with self._condition:
+            self._in_use = max(0, self._in_use - count)
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, count=None):
+        """Context manager taking at least one and up to `count` tokens."""
+        taken = self.acquire(count, minimum=1)
+        try:
+            yield taken
+        finally:
+            self.release(taken)
+
+
+JOBS = JobServer()
+
+
+def set_max_processes(count):
+    """Set the maximum number of processes running at the same time."""
+    JOBS.set_tokens(count)
+
+
+class Command(object):
+    """A command that can run in the foreground or in a background thread."""
+
+    def __init__(self, args, cwd=None, env=None, input_data=None,
+                 timeout=None, decode=True, on_line=None, jobs=1,
+                 keep_output=True):
+        """
+        A command that can run in the foreground or in a background thread.
+
+        Parameters
+        ----------
+        args : list of str
+            Command and arguments.
+        input_data : bytes
+            Data sent to the standard input of the command.
+        timeout : float
+            Seconds after which the command is killed, None for no limit.
+        decode : bool
+            Decode the standard output, the standard error is always decoded.
+        on_line : callable
+            Called with every line of the standard output as it arrives.
+        jobs : int
+            Job tokens taken while running, 0 if the caller already holds
+            the tokens of the command.
+        keep_output : bool
+            Keep the standard output, False if `on_line` consumes it all.
+        """
+        self.args = list(args)
+        self.cwd = cwd
+        self.env = env
+        self.input_data = input_data
+        self.timeout = timeout or None
+        self.decode = decode
+        self.on_line = on_line
+        self.jobs = jobs
+        self.keep_output = keep_output
+
+        self.output = None
+        self.error = None
+        self.returncode = None
+        self.timed_out = False
+        self.exception = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._process = None
+        self._timer = None
+
+    def _communicate(self, process):
+        """Read the outputs of `process` until it exits."""
+        errors = []
+
+        def read_error():
+            """Read the standard error in the background."""
+            errors.append(process.stderr.read())
+
+        def write_input():
+            """Write the standard input in the background."""
+            try:
+                process.stdin.write(self.input_data)
+                process.stdin.close()
+            except (IOError, OSError):
+                # The command exited without reading all of it
+                pass
+
+        threads = [threading.Thread(target=read_error)]
+        if self.input_data is not None:
+            threads.append(threading.Thread(target=write_input))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        lines = []
+        for line in iter(process.stdout.readline, b''):
+            if self.keep_output:
+                lines.append(line)
+            if self.on_line is not None:
+                self.on_line(line.decode() if self.decode else line)
+        process.stdout.close()
+
+        for thread in threads:
+            thread.join()
+        process.stderr.close()
+        process.wait()
+        return b''.join(lines), errors[0] if errors else b''
+
+    def _kill(self, process):
+        """Kill `process` and the processes it started after a timeout."""
+        self.timed_out = True
+        try:
+            if os.name == 'nt':
+                process.kill()
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            # Already finished
+            pass
+
+    def _start_timer(self):
+        """Start the timer killing the process after `timeout` seconds."""
+        self._timer = threading.Timer(self.timeout, self._kill,
+                                      [self._process])
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        """Run the command, holding job tokens of the global pool."""
+        taken = JOBS.acquire(self.jobs) if self.jobs else 0
+        kwargs = {}
+        if os.name != 'nt':
+            # Own process group, so a timeout also kills its children
+            if six.PY2:
+                kwargs['preexec_fn'] = os.setsid
+            else:
+                kwargs['start_new_session'] = True
+        try:
+            process = subprocess.Popen(
+                self.args,
+                stdin=subprocess.PIPE if self.input_data is not None else None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.cwd,
+                env=self.env,
+                **kwargs)
+            with self._lock:
+                self._process = process
+                if self.timeout:
+                    self._start_timer()
+            try:
+                output, error = self._communicate(process)
+            finally:
+                with self._lock:
+                    if self._timer is not None:
+                        self._timer.cancel()
+                        self._timer = None
+        except Exception as err:
+            self.exception = err
+        else:
+            self.output = output.decode() if self.decode else output
+            self.error = error.decode()
+            self.returncode = process.returncode
+        finally:
+            if taken:
+                JOBS.release(taken)
+            self._finish()
+
+    def _finish(self):
+        """Mark the command as done and call the done callbacks."""
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    def restart_timeout(self):
+        """Give the running command its whole `timeout` again, from now."""
+        with self._lock:
+            if self._timer is not None and not self.timed_out:
+                self._timer.cancel()
+                self._start_timer()
+
+    def start(self):
+        """Start the command in a background thread and return it."""
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def run(self):
+        """Run the command in this thread, return `(output, error)`."""
+        self._run()
+        return self.wait()
+
+    @property
+    def done(self):
+        """Return if the command finished."""
+        return self._done.is_set()
+
+    def add_done_callback(self, callback):
+        """Call `callback(command)` when done, right away if already done."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self):
+        """Wait for the command and return `(output, error)`."""
+        self._done.wait()
+        if self.exception is not None:
+            raise self.exception
+        if self.timed_out:
+            raise CommandTimeout(self.args, self.timeout)
+        return self.output, self.error
+
+
+def run_command(args, cwd=None, input_data=None, decode=True, env=None,
+                timeout=None, on_line=None, jobs=1):
+    """Run command, optionally sending `input_data` bytes to its stdin."""
+    command = Command(args, cwd=cwd, env=env, input_data=input_data,
+                      timeout=timeout, decode=decode, on_line=on_line,
+                      jobs=jobs)
+    return command.run()
+
+
+def as_completed(commands, max_running=None):
+    """
+    Start `commands` and yield them in the order they finish.
+
+    With `max_running`, at most that many commands are started (and hold a
+    thread) at a time; the job tokens still limit the running processes.
+    """
+    commands = iter(commands)
+    finished = queue.Queue()
+    running = 0
+    exhausted = False
+
+    while True:
+        while not exhausted and (max_running is None or
+                                 running < max_running):
+            try:
+                command = next(commands)
+            except StopIteration:
+                exhausted = True
+                break
+            command.add_done_callback(finished.put)
+            if not command.done and command._thread is None:
+                command.start()
+            running += 1
+
+        if not running:
+            return
+        command = finished.get()
+        running -= 1
+        yield command
+
+
+def test():
+    """Main local test."""
+    commands = [Command(['sleep', str(i)]) for i in (0.3, 0.1, 0.2)]
+    for command in as_completed(commands):
+        print(command.args, command.wait())
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Pytest plugin reporting test outcomes to the ciocheck process.
+
+Loaded with `-p ciocheck.pytest_plugin --ciocheck-report=PATH`, it writes a
+json summary of the session to PATH once the session finishes. With
+pytest-xdist, only the controller process writes the report.
+
+With `--ciocheck-shard=K/N` only the K-th of N parts of the collected test
+node ids run, the same parts on every machine and every xdist worker.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import json
+import os
+import time
+
+# Local imports
+from ciocheck.shards import parse_shard, shard_items
+
+# Outcomes of the tests listed by name in the report
+REPORTED_OUTCOMES = ('failed', 'error')
+
+
+class CiocheckReporter(object):
+    """Collect test outcomes and write them as a json report."""
+
+    def __init__(self, path):
+        """Collect test outcomes and write them as a json report."""
+        self.path = path
+        self.summary = OrderedDict()
+        self.tests = []
+        self.start = time.time()
+
+    def _add(self, nodeid, outcome, duration):
+        """Count a test outcome."""
+        self.summary[outcome] = self.summary.get(outcome, 0) + 1
+        if outcome in REPORTED_OUTCOMES:
+            self.tests.append({
+                'name': nodeid,
+                'outcome': outcome,
+                'duration': duration,
+            })
+
+    # --- Pytest hooks
+    # -------------------------------------------------------------------------
+    def pytest_runtest_logreport(self, report):
+        """Count the outcome of each test once."""
+        if report.when == 'call':
+            outcome = report.outcome
+        elif report.failed:
+            outcome = 'error'
+        elif report.skipped and report.when == 'setup':
+            outcome = 'skipped'
+        else:
+            return
+        self._add(report.nodeid, outcome, getattr(report, 'duration', 0))
+
+    def pytest_collectreport(self, report):
+        """Count collection errors."""
+        if report.failed:
+            self._add(report.nodeid, 'error', 0)
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        """Write the report atomically."""
+        summary = OrderedDict(self.summary)
+        summary['num_tests'] = sum(self.summary.values())
+        summary['duration'] = time.time() - self.start
+        data = {
+            'report': {
+                'summary': summary,
+                'tests': self.tests,
+                'exitstatus': int(exitstatus),
+            }
+        }
+
+        tmp_path = '{0}.tmp-{1}'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as file_obj:
+            json.dump(data, file_obj)
+        if os.path.exists(self.path) and os.name == 'nt':
+            os.remove(self.path)
+        os.rename(tmp_path, self.path)
+
+
+def pytest_addoption(parser):
+    """Add the report path option."""
+    parser.addoption(
+        '--ciocheck-report',
+        dest='ciocheck_report',
+        default=None,
+        help='Path of the json report read by ciocheck.')
+    parser.addoption(
+        '--ciocheck-shard',
+        dest='ciocheck_shard',
+        default=None,
+        type=parse_shard,
+        help='Only run the K-th of N parts of the tests, given as K/N.')
+
+
+def pytest_configure(config):
+    """Register the reporter, on the xdist controller only."""
+    path = config.getoption('ciocheck_report')
+    is_worker = (hasattr(config, 'workerinput') or
+                 hasattr(config, 'slaveinput'))
+    if path and not is_worker:
+        config.pluginmanager.register(
+            CiocheckReporter(path), 'ciocheck-reporter')
+
+
+def pytest_collection_modifyitems(session, config, items):
+    """Deselect the tests of other shards."""
+    shard = config.getoption('ciocheck_shard')
+    if shard is None:
+        return
+
+    selected = set(shard_items([item.nodeid for item in items], shard))
+    deselected = [item for item in items if item.nodeid not in selected]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = [item for item in items if item.nodeid in selected]
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Lightweight registry of linters, formatters and testers.
+
+Tools are registered by name with a dotted `module:ClassName` reference, so
+the tool modules (and the third party packages they depend on) are only
+imported when a tool is actually requested. Third party tools can be added
+with setuptools entry points on the `ciocheck.linters`,
+`ciocheck.formatters` and `ciocheck.testers` groups.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import importlib
+import sys
+
+# Third party imports
+from six import string_types
+
+# Tool kinds
+LINTER = 'linter'
+FORMATTER = 'formatter'
+MULTI_FORMATTER = 'multiformatter'
+TESTER = 'tester'
+
+ENTRY_POINT_GROUPS = OrderedDict([
+    (LINTER, 'ciocheck.linters'),
+    (FORMATTER, 'ciocheck.formatters'),
+    (TESTER, 'ciocheck.testers'),
+])
+
+# (name, kinds, target), the order defines the order in which tools run
+BUILTIN_TOOLS = (
+    ('pep8', (LINTER, ), 'ciocheck.linters:Pep8Linter'),
+    ('pydocstyle', (LINTER, ), 'ciocheck.linters:PydocstyleLinter'),
+    ('flake8', (LINTER, ), 'ciocheck.linters:Flake8Linter'),
+    ('pylint', (LINTER, ), 'ciocheck.linters:PylintLinter'),
+    ('pyformat', (FORMATTER, ), 'ciocheck.formatters:PythonFormatter'),
+    ('isort', (FORMATTER, MULTI_FORMATTER),
+     'ciocheck.formatters:IsortFormatter'),
+    ('yapf', (FORMATTER, MULTI_FORMATTER),
+     'ciocheck.formatters:YapfFormatter'),
+    ('autopep8', (FORMATTER, MULTI_FORMATTER),
+     'ciocheck.formatters:Autopep8Formatter'),
+    ('coverage', (TESTER, ), 'ciocheck.tools:CoverageTool'),
+    ('pytest', (TESTER, ), 'ciocheck.tools:PytestTool'),
+)
+
+
+class ToolRegistry(object):
+    """Map tool names to lazily imported tool classes."""
+
+    def __init__(self):
+        """Map tool names to lazily imported tool classes."""
+        self._targets = OrderedDict()
+        self._kinds = OrderedDict()
+        self._classes = {}
+        self._entry_points_loaded = False
+
+    def _load_target(self, target):
+        """Import and return the class referenced by `module:ClassName`."""
+        if not isinstance(target, string_types):
+            return target
+        module_name, class_name = target.split(':')
+        value = importlib.import_module(module_name.strip())
+        for attribute in class_name.strip().split('.'):
+            value = getattr(value, attribute)
+        return value
+
+    def _iter_entry_points(self, group):
+        """Yield `(name, module:ClassName)` for entry points of a group."""
+        try:
+            from importlib import metadata
+        except ImportError:
+            metadata = None
+
+        if metadata is not None:
+            entry_points = metadata.entry_points()
+            if hasattr(entry_points, 'select'):
+                entry_points = entry_points.select(group=group)
+            else:
+                entry_points = entry_points.get(group, [])
+        else:
+            try:
+                import pkg_resources
+            except ImportError:
+                return
+            entry_points = pkg_resources.iter_entry_points(group)
+
+        for entry_point in entry_points:
+            if hasattr(entry_point, 'value'):
+                target = entry_point.value
+            else:
+                target = '{0}:{1}'.format(entry_point.module_name,
+                                          '.'.join(entry_point.attrs))
+            # Extras like `module:Class [extra]` are not needed to import it
+            yield entry_point.name, target.split('[')[0].strip()
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    def register(self, name, target, kinds):
+        """Register a tool `target` (class or `module:ClassName`) by name."""
+        self._targets[name] = target
+        self._kinds[name] = tuple(kinds)
+        self._classes.pop(name, None)
+
+    def load_entry_points(self):
+        """
+        Discover third party tools registered through entry points.
+
+        Only the names are registered, tool modules are imported when used.
+        """
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+
+        for kind, group in ENTRY_POINT_GROUPS.items():
+            try:
+                entry_points = list(self._iter_entry_points(group))
+            except Exception as err:
+                print('Could not load the "{0}" tools: {1}'.format(group, err),
+                      file=sys.stderr)
+                continue
+            for name, target in entry_points:
+                if name not in self._targets:
+                    self.register(name, target, (kind, ))
+
+    def names(self, kind=None):
+        """Return the tool names, including third party ones."""
+        self.load_entry_points()
+        return [
+            name for name, kinds in self._kinds.items()
+            if kind is None or kind in kinds
+        ]
+
+    def get(self, name):
+        """Return the tool class registered with `name`."""
+        if name not in self._targets:
+            self.load_entry_points()
+        if name not in self._classes:
+            self._classes[name] = self._load_target(self._targets[name])
+        return self._classes[name]
+
+    def get_tools(self, kind, names=None):
+        """Return tool classes of `kind`, optionally only those in `names`."""
+        if names is not None and any(n not in self._targets for n in names):
+            self.load_entry_points()
+        return [
+            self.get(name) for name in self.names(kind)
+            if names is None or name in names
+        ]
+
+
+REGISTRY = ToolRegistry()
+for (_name, _kinds, _target) in BUILTIN_TOOLS:
+    REGISTRY.register(_name, _target, _kinds)
+
+register_tool = REGISTRY.register
+get_tool = REGISTRY.get
+get_tools = REGISTRY.get_tools
+tool_names = REGISTRY.names
+
+
+def test():
+    """Main local test."""
+    for kind in ENTRY_POINT_GROUPS:
+        print(kind, [tool.__name__ for tool in get_tools(kind)])
+
+
+if __name__ == '__main__':
+    test()
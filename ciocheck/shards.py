@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Split a run across several machines and merge their results.
+
+`--shard K/N` checks the K-th of N deterministic, size balanced parts of the
+files and runs the K-th part of the test node ids. Every shard writes its
+results to a json file, with paths relative to the project folder, and
+`ciocheck-merge` reports them as a single run.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import json
+import os
+
+# Local imports
+from ciocheck.findings import Finding
+
+SHARD_FILE = 'shard-{0}-of-{1}.json'
+SHARD_FORMAT_VERSION = 1
+
+
+def parse_shard(value):
+    """Turn a `K/N` string into a `(K, N)` tuple, K starting at 1."""
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError('Invalid shard "{0}", use K/N'.format(value))
+    if not 1 <= index <= count:
+        raise ValueError('Invalid shard "{0}", K must be between 1 and '
+                         'N'.format(value))
+    return index, count
+
+
+def partition(items, count, weight):
+    """
+    Split `items` in `count` parts of similar total `weight`.
+
+    Items are assigned from the heaviest to the lightest to the lightest
+    part (longest processing time first), ties are broken by the item and
+    by the part number so every machine computes the same parts.
+    """
+    parts = [[] for _ in range(count)]
+    loads = [0] * count
+    for item in sorted(items, key=lambda item: (-weight(item), item)):
+        index = loads.index(min(loads))
+        parts[index].append(item)
+        loads[index] += weight(item)
+    return [sorted(part) for part in parts]
+
+
+def _file_size(path):
+    """Return the size of a file, plus one so empty files count."""
+    try:
+        return os.path.getsize(path) + 1
+    except OSError:
+        return 1
+
+
+def shard_paths(paths, shard):
+    """Return the set of `paths` that belong to `shard`."""
+    index, count = shard
+    return set(partition(list(paths), count, _file_size)[index - 1])
+
+
+def shard_items(items, shard):
+    """Return the items of `shard`, round robin over the sorted items."""
+    index, count = shard
+    return sorted(items)[index - 1::count]
+
+
+# --- Partial results
+# -----------------------------------------------------------------------------
+def _relative(path, root):
+    """Return `path` relative to `root` with forward slashes."""
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def _absolute(path, root):
+    """Return the absolute version of a path relative to `root`."""
+    return os.path.normpath(os.path.join(root, path))
+
+
+def _encode_files(files, root):
+    """Encode a list of paths or a `{path: (added, deleted)}` dict."""
+    if isinstance(files, dict):
+        return OrderedDict((_relative(path, root),
+                            [list(lines) for lines in value])
+                           for path, value in files.items())
+    return [_relative(path, root) for path in files]
+
+
+def _decode_files(files, root):
+    """Decode files encoded by `_encode_files`."""
+    if isinstance(files, dict):
+        return OrderedDict((_absolute(path, root), tuple(value))
+                           for path, value in files.items())
+    return [_absolute(path, root) for path in files]
+
+
+def _encode_result(result, root):
+    """Encode a finding or a formatter result as a json object."""
+    if isinstance(result, Finding):
+        data = result.to_dict()
+        data['finding'] = True
+    else:
+        data = dict(result)
+        if hasattr(data.get('diff'), 'render'):
+            data['diff'] = data['diff'].render()
+    data['path'] = _relative(data['path'], root)
+    return data
+
+
+def _decode_result(data, root):
+    """Decode a result encoded by `_encode_result`."""
+    data = dict(data)
+    data['path'] = _absolute(data['path'], root)
+    if data.pop('finding', False):
+        return Finding.from_dict(data)
+    return data
+
+
+def encode_results(all_results, test_results, root):
+    """Return json serializable tool and test results."""
+    results = OrderedDict()
+    for tool_name, data in all_results.items():
+        if data:
+            results[tool_name] = {
+                'files': _encode_files(data['files'], root),
+                'results': [_encode_result(r, root) for r in data['results']],
+            }
+
+    tests = None
+    if test_results:
+        tests = dict(test_results)
+        tests['files'] = _encode_files(test_results.get('files') or [], root)
+        tests['coverage'] = OrderedDict(
+            (_relative(path, root), lines)
+            for path, lines in (test_results.get('coverage') or {}).items())
+    return results, tests
+
+
+def decode_results(results, tests, root):
+    """Decode results encoded by `encode_results`."""
+    all_results = OrderedDict()
+    for tool_name, data in results.items():
+        all_results[tool_name] = {
+            'files': _decode_files(data['files'], root),
+            'results': [_decode_result(r, root) for r in data['results']],
+        }
+
+    if tests:
+        tests = dict(tests)
+        tests['files'] = _decode_files(tests['files'], root)
+        tests['coverage'] = OrderedDict(
+            (_absolute(path, root), lines)
+            for path, lines in tests['coverage'].items())
+    return all_results, tests
+
+
+def _merge_reports(report, other):
+    """Merge the pytest report of another shard into `report`."""
+    summary = report['summary']
+    for key, value in other['summary'].items():
+        summary[key] = summary.get(key, 0) + value
+    report['tests'] = report['tests'] + other['tests']
+    report['exitstatus'] = max(report['exitstatus'], other['exitstatus'])
+
+
+def merge_test_results(test_results, other):
+    """Merge the test results of another shard into `test_results`."""
+    if not test_results:
+        return other
+    if not other:
+        return test_results
+
+    coverage = test_results['coverage']
+    for path, lines in other['coverage'].items():
+        coverage[path] = sorted(set(coverage.get(path, [])) | set(lines))
+
+    if 'pytest' not in other:
+        test_results.pop('pytest', None)
+    elif 'pytest' in test_results:
+        _merge_reports(test_results['pytest']['report'],
+                       other['pytest']['report'])
+    return test_results
+
+
+def total_coverage(covered_lines, config_file=None):
+    """
+    Return the percentage of statements covered by the merged shards.
+
+    `covered_lines` is the `{path: lines}` coverage of every shard combined.
+    Statements are found by coverage from the current source of the files.
+    """
+    from coverage import Coverage
+
+    cov = Coverage(data_file=None, config_file=config_file or False)
+    statements = covered = 0
+    for path, lines in covered_lines.items():
+        try:
+            file_statements = cov.analysis2(path)[1]
+        except Exception:
+            # Not a python file or not available on this machine
+            continue
+        statements += len(file_statements)
+        covered += len(set(file_statements).intersection(lines))
+    return 100.0 * covered / statements if statements else 100.0
+
+
+def write_shard_file(path, shard, data):
+    """Write the results of `shard` to `path`."""
+    from ciocheck.utils import atomic_replace
+
+    data = dict(data, version=SHARD_FORMAT_VERSION, shard=list(shard))
+    atomic_replace(path, json.dumps(data), 'utf-8')
+
+
+def read_shard_file(path):
+    """Read a file written by `write_shard_file`."""
+    with open(path, 'r') as file_obj:
+        data = json.load(file_obj, object_pairs_hook=OrderedDict)
+    if data.get('version') != SHARD_FORMAT_VERSION:
+        raise ValueError('{0} is not a ciocheck shard file'.format(path))
+    return data
+
+
+def test():
+    """Main local test."""
+    sizes = {'a': 10, 'b': 7, 'c': 5, 'd': 4, 'e': 1}
+    print(partition(list(sizes), 2, sizes.get))
+
+
+if __name__ == '__main__':
+    test()
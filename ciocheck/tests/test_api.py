@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the python API."""
+
+# Standard library imports
+import os
+import subprocess
+
+# Local imports
+from ciocheck.api import check, make_args
+
+
+def test_make_args():
+    """Options are converted like command line arguments."""
+    args = make_args(check='flake8,pep8', jobs=2, check_only=True)
+    assert args.check == ['flake8', 'pep8']
+    assert args.jobs == '2'
+    assert args.check_only is True
+    assert args.disable_tests is False
+
+
+def test_check_returns_results(tmpdir, capsys):
+    """Results are returned without printing or exiting."""
+    folder = tmpdir.join('pkg')
+    folder.ensure(dir=True)
+    folder.join('m.py').write('a=1\n')
+    path = os.path.join(str(folder), 'm.py')
+    options = dict(cmd_root=str(tmpdir), file_mode='all', check=['flake8'])
+
+    results = check(['pkg'], enforce=['flake8'], **options)
+    assert not results
+    assert results.enforced_failures == ['flake8']
+    finding = results.findings['flake8'][path][0]
+    assert (finding.line, finding.type) == (1, 'E225')
+    assert 'flake8' in results.timings
+    assert 'Ciocheck failures' in results.output
+
+    results = check(['pkg'], **options)
+    assert results.success and not results.cached
+    results = check(['pkg'], **options)
+    assert results.success and results.cached
+    assert capsys.readouterr().out == ''
+
+
+def test_check_in_git_repo_prints_nothing(tmpdir, capsys):
+    """Git commands do not write to the standard output."""
+    def git(*args):
+        subprocess.check_call(('git', '-c', 'user.name=t', '-c',
+                               'user.email=t@t') + args, cwd=str(tmpdir),
+                              stdout=subprocess.PIPE)
+
+    tmpdir.join('pkg', 'm.py').write('a = 1\n', ensure=True)
+    git('init', '-q')
+    git('add', '.')
+    git('commit', '-q', '-m', 'init')
+    tmpdir.join('pkg', 'm.py').write('a = 1\nb=2\n')
+
+    for file_mode in ('files', 'lines'):
+        results = check(['pkg'], cmd_root=str(tmpdir), file_mode=file_mode,
+                        diff_mode='unstaged', check=['flake8'],
+                        force_run=True)
+        assert results.findings['flake8']
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the shared result store."""
+
+# Standard library imports
+import os
+
+# Local imports
+from ciocheck.cache import ResultStore
+
+
+def test_store_roundtrip_and_stats(tmpdir):
+    """Values are shared between store instances and hits are counted."""
+    path = str(tmpdir.join('store'))
+    key = ResultStore.make_key('flake8', 'abc')
+
+    writer = ResultStore(path)
+    assert writer.get('flake8', key) is None
+    writer.put('flake8', key, [{'line': 1}])
+    writer.save_stats()
+
+    reader = ResultStore(path)
+    assert reader.get('flake8', key) == [{'line': 1}]
+    reader.save_stats()
+
+    stats = reader.stats()
+    assert stats['entries'] == 1
+    assert stats['tools']['flake8'] == {'hits': 1, 'misses': 1}
+
+
+def test_store_gc_removes_least_recently_used(tmpdir):
+    """Garbage collection removes the oldest entries first."""
+    store = ResultStore(str(tmpdir))
+    keys = [store.make_key(i) for i in range(3)]
+    for i, key in enumerate(keys):
+        store.put('yapf', key, 'x' * 100)
+        os.utime(store._object_path(key), (i, i))
+
+    store.gc(max_size=250)
+    assert store.get('yapf', keys[0]) is None
+    assert store.get('yapf', keys[1]) is not None
+    assert store.get('yapf', keys[2]) is not None
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test configuration loading and snapshot caching."""
+
+# Standard library imports
+import argparse
+import os
+import subprocess
+
+# Third party imports
+import pytest
+
+# Local imports
+from ciocheck.config import CACHE_FOLDER, load_config
+
+BASE_CONFIG = """[ciocheck]
+check = pep8,flake8
+add_init = false
+
+[flake8]
+max-line-length = {0}
+"""
+
+CHILD_CONFIG = """[ciocheck]
+inherit_config = base.ini
+diff_mode = unstaged
+"""
+
+
+def cli_args(**kwargs):
+    """Return a namespace mimicking the parsed cli arguments."""
+    args = argparse.Namespace(config_file='child.ini', check=None,
+                              diff_mode=None, file_mode=None, branch=None,
+                              enforce=None)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+def write(path, contents):
+    """Write `contents` to `path`."""
+    with open(path, 'w') as file_obj:
+        file_obj.write(contents)
+
+
+def test_snapshot_resolves_inherit_chain(tmpdir):
+    """Values are merged from the inherit chain and converted once."""
+    root = str(tmpdir)
+    write(os.path.join(root, 'base.ini'), BASE_CONFIG.format(79))
+    write(os.path.join(root, 'child.ini'), CHILD_CONFIG)
+
+    config = load_config(root, cli_args())
+    assert config.get_value('check') == ['pep8', 'flake8']
+    assert config.get_value('add_init') is False
+    assert config.get_value('diff_mode') == 'unstaged'
+    assert config.get_options('flake8') == {'max_line_length': 79}
+    assert os.path.isdir(os.path.join(root, CACHE_FOLDER, 'config'))
+
+    with pytest.raises(AttributeError):
+        config._sections = {}
+
+
+def test_snapshot_cache_invalidation(tmpdir):
+    """The cached snapshot is dropped when any file in the chain changes."""
+    root = str(tmpdir)
+    base_path = os.path.join(root, 'base.ini')
+    write(base_path, BASE_CONFIG.format(79))
+    write(os.path.join(root, 'child.ini'), CHILD_CONFIG)
+
+    first = load_config(root, cli_args())
+    assert load_config(root, cli_args()).digest == first.digest
+
+    write(base_path, BASE_CONFIG.format(100))
+    os.utime(base_path, (0, 0))
+    second = load_config(root, cli_args())
+    assert second.get_options('flake8') == {'max_line_length': 100}
+
+    third = load_config(root, cli_args(check=['pylint']))
+    assert third.get_value('check') == ['pylint']
+
+
+def test_cache_folder_is_ignored_by_git(tmpdir):
+    """The cache folder never shows up as untracked in the project."""
+    root = str(tmpdir)
+    subprocess.check_call(['git', 'init', '-q', root])
+    write(os.path.join(root, 'child.ini'), CHILD_CONFIG)
+    write(os.path.join(root, 'base.ini'), BASE_CONFIG.format(79))
+    load_config(root, cli_args())
+    output = subprocess.check_output(
+        ['git', 'status', '--porcelain', '--untracked-files=all'], cwd=root)
+    assert CACHE_FOLDER not in output.decode()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test linter findings."""
+
+# Local imports
+from ciocheck.findings import Finding
+from ciocheck.linters import Flake8Linter
+
+
+def test_finding_fields():
+    """Lines are integers and fields are reachable as keys too."""
+    finding = Finding('module.py', '12', '', 'E225', 'missing whitespace')
+    assert finding.line == 12
+    assert finding.column == -1
+    assert finding['type'] == 'E225'
+    assert finding.get('created') is None
+    assert finding.get('line', 0) == 12
+    assert not hasattr(finding, '__dict__')
+
+    moved = finding.replace(path='/project/module.py')
+    assert moved.path == '/project/module.py'
+    assert moved.line == 12
+
+    data = finding.to_dict(path=False)
+    assert 'path' not in data
+    data['message-id'] = 'C0326'
+    assert Finding.from_dict(data, path='module.py') == finding
+
+
+def test_findings_share_paths():
+    """Paths of findings parsed from linter output are interned."""
+    output = ''.join(
+        '{0}:{1}:1: E225 missing whitespace around operator\n'.format(
+            'package/module.py', line) for line in range(1, 4))
+    findings = Flake8Linter('')._parse(output)
+    assert [f.line for f in findings] == [1, 2, 3]
+    assert findings[0].path is findings[2].path
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test formatters."""
+
+# Standard library imports
+import os
+import sys
+
+# Third party imports
+from six.moves import cStringIO as StringIO
+
+# Local imports
+from ciocheck.cache import ResultStore
+from ciocheck.config import ConfigSnapshot
+from ciocheck.format_task import spill_diffs
+from ciocheck.formatters import (Autopep8Formatter, MultiFormatter,
+                                 PythonFormatter, YapfFormatter)
+from ciocheck.utils import LazyDiff, diff, lines_to_ranges
+
+
+def write_yapf_style(root):
+    """Write a private yapf style file for `root`."""
+    style_path = YapfFormatter.get_config_path(root)
+    if not os.path.isdir(os.path.dirname(style_path)):
+        os.makedirs(os.path.dirname(style_path))
+    with open(style_path, 'w') as file_obj:
+        file_obj.write('[style]\nbased_on_style = pep8\n')
+
+
+def test_lines_to_ranges():
+    """Line numbers are grouped in sorted inclusive ranges."""
+    assert lines_to_ranges([7, 1, 2, 3, 9, 8, 0]) == [(1, 3), (7, 9)]
+    assert lines_to_ranges([]) == []
+
+
+def test_yapf_formats_only_modified_lines(tmpdir):
+    """Only the given line ranges are reformatted."""
+    path = str(tmpdir.join('module.py'))
+    with open(path, 'w') as file_obj:
+        file_obj.write('a=1\nb=2\nc=3\n')
+
+    YapfFormatter.cmd_root = str(tmpdir)
+    write_yapf_style(str(tmpdir))
+
+    _, new_contents, _ = YapfFormatter.format_file(path, lines=[(2, 2)])
+    assert new_contents == 'a=1\nb = 2\nc=3\n'
+
+    _, new_contents, _ = YapfFormatter.format_file(path, lines=[(1, 3)])
+    assert new_contents == 'a = 1\nb = 2\nc = 3\n'
+
+
+def test_autopep8_formats_each_range():
+    """Lines between distant modified ranges are left untouched."""
+    contents = ''.join('x={0}\n'.format(i) for i in range(1, 21))
+    _, new_contents, _ = Autopep8Formatter.format_string(
+        contents, lines=[(2, 2), (15, 16)])
+    formatted = set(i for i, line in enumerate(new_contents.splitlines(), 1)
+                    if ' = ' in line)
+    assert formatted == set([2, 15, 16])
+
+
+def test_diff_truncation():
+    """Diffs are capped to the maximum size and lazily rendered."""
+    old = ''.join('line {0}\n'.format(i) for i in range(1000))
+    new = old.replace('line', 'LINE')
+    full = diff(old, new)
+    short = diff(old, new, max_size=200)
+    assert len(full) > 1000
+    assert len(short) < 300
+    assert short.endswith('(diff truncated at 200 characters)\n')
+
+    assert not LazyDiff(old, old)
+    lazy = LazyDiff(old, new)
+    assert lazy
+    assert lazy.render() == full
+
+
+def test_check_only_leaves_files_untouched(tmpdir):
+    """In check only mode the diff is reported but not written."""
+    path = str(tmpdir.join('module.py'))
+    with open(path, 'w') as file_obj:
+        file_obj.write('a=1\n')
+
+    YapfFormatter.cmd_root = str(tmpdir)
+    YapfFormatter.config = ConfigSnapshot(
+        {'ciocheck': {'check_only': 'true', 'max_diff_size': '0'}})
+    write_yapf_style(str(tmpdir))
+    try:
+        result = YapfFormatter.format_task(path)
+    finally:
+        YapfFormatter.config = None
+
+    assert '+a = 1' in result['diff']
+    with open(path) as file_obj:
+        assert file_obj.read() == 'a=1\n'
+
+
+def test_pyformat_headers_and_inits(tmpdir):
+    """Inits are created once per folder and headers added where missing."""
+    header = '# -*- coding: utf-8 -*-\n'
+    copyright_header = '# Copyright (c) Someone\n'
+    package = tmpdir.mkdir('package')
+    package.join('a.py').write('a = 1\n')
+    package.join('b.py').write(header + copyright_header + 'b = 1\n' * 2000)
+    package.join('c.py').write('c = 1\n')
+    tmpdir.join('.ciocopyright').write(copyright_header)
+
+    formatter = PythonFormatter(str(tmpdir))
+    formatter.config = ConfigSnapshot({
+        'ciocheck': {
+            'header': header,
+            'copyright_file': '.ciocopyright',
+            'add_copyright': 'true',
+            'add_header': 'true',
+            'add_init': 'true',
+            'check_only': 'false',
+            'max_diff_size': '0',
+        }
+    })
+    paths = [str(package.join(name)) for name in ('c.py', 'b.py', 'a.py')]
+    results = formatter.run(paths)
+
+    assert [os.path.basename(r['path']) for r in results] == [
+        '__init__.py', 'a.py', 'c.py'
+    ]
+    assert results[0]['created']
+    assert not results[1]['created']
+    assert package.join('a.py').read() == header + copyright_header + (
+        'a = 1\n')
+    assert package.join('__init__.py').read() == header + copyright_header
+
+
+def test_multi_formatter_skips_slow_files(tmpdir, monkeypatch):
+    """A file timing out alone is skipped, the rest of its batch is kept."""
+    script = ('import json, sys, time\n'
+              'for path in sys.argv[1:]:\n'
+              '    if path == "slow.py": time.sleep(10)\n'
+              '    result = {"path": path, "diff": "x" * 20000}\n'
+              '    record = {"path": path, "results": {"yapf": result},\n'
+              '              "timings": [["yapf", 0.1 * len(path)]]}\n'
+              '    print(json.dumps(record))\n'
+              '    sys.stdout.flush()\n')
+    monkeypatch.setattr(MultiFormatter, '_worker_command',
+                        lambda self: [sys.executable, '-c', script])
+    config = ConfigSnapshot({'ciocheck': {'format_timeout': '1'}})
+    formatter = MultiFormatter(str(tmpdir), ['yapf'], config=config)
+
+    results = formatter.run(['a.py', 'bb.py', 'slow.py', 'c.py'])
+    assert formatter.skipped == ['slow.py']
+    assert [r['path'] for r in results['yapf']] == ['a.py', 'bb.py', 'c.py',
+                                                    'slow.py']
+    assert 'skipped' in results['yapf'][-1]['error']
+    assert formatter.slowest_files(2) == {
+        'yapf': [('slow.py', 1), ('bb.py', 0.5)]}
+
+
+def test_multi_formatter_time_limit_is_per_file(tmpdir, monkeypatch):
+    """A slow file can not use the time of the other files of its batch."""
+    script = ('import json, sys, time\n'
+              'for path in sys.argv[1:]:\n'
+              '    time.sleep(2.5 if path == "slow.py" else 0.6)\n'
+              '    record = {"path": path, "results": {}, "timings": []}\n'
+              '    print(json.dumps(record))\n'
+              '    sys.stdout.flush()\n')
+    monkeypatch.setattr(MultiFormatter, '_worker_command',
+                        lambda self: [sys.executable, '-c', script])
+    monkeypatch.setattr(MultiFormatter, 'make_batches',
+                        lambda self, paths, workers: [paths])
+    config = ConfigSnapshot({'ciocheck': {'format_timeout': '1'}})
+
+    formatter = MultiFormatter(str(tmpdir), ['yapf'], config=config)
+    formatter.run(['a.py', 'b.py', 'c.py'])
+    assert formatter.skipped == []
+
+    formatter = MultiFormatter(str(tmpdir), ['yapf'], config=config)
+    formatter.run(['slow.py', 'a.py', 'b.py'])
+    assert formatter.skipped == ['slow.py']
+
+
+def test_multi_formatter_writes_to_stream(tmpdir, monkeypatch, capsys):
+    """Output of the workers goes to the stream of the runner."""
+    script = ('import json, sys\n'
+              'print("formatter noise")\n'
+              'for path in sys.argv[1:]:\n'
+              '    record = {"path": path, "results": {}, "timings": []}\n'
+              '    print(json.dumps(record))\n'
+              'sys.stderr.write("warning\\n")\n')
+    monkeypatch.setattr(MultiFormatter, '_worker_command',
+                        lambda self: [sys.executable, '-c', script])
+    formatter = MultiFormatter(str(tmpdir), ['yapf'])
+    formatter.stream = StringIO()
+
+    formatter.run(['a.py'])
+    assert formatter.stream.getvalue() == 'formatter noise\nwarning\n'
+    assert capsys.readouterr().out == ''
+
+
+def test_format_task_spills_large_diffs(tmpdir):
+    """Large diffs are written to files and read back when displayed."""
+    task_result = {'yapf': {'path': 'a.py', 'diff': 'x' * 20000},
+                   'isort': {'path': 'a.py', 'diff': 'small'}}
+    spill_diffs(task_result, str(tmpdir))
+    assert task_result['isort']['diff'] == 'small'
+    assert task_result['yapf']['diff'] == ''
+
+    formatter = MultiFormatter(str(tmpdir), ['yapf'])
+    formatter._add_results(task_result)
+    diff = formatter._results['yapf'][0]['diff']
+    assert diff and diff.render() == 'x' * 20000
+
+
+def test_multi_formatter_batches_by_cost(tmpdir):
+    """Expensive files are formatted first and alone, cheap ones together."""
+    for name, size in (('big.py', 1000), ('mid.py', 100), ('a.py', 10),
+                       ('b.py', 10), ('c.py', 10), ('d.py', 10)):
+        tmpdir.join(name).write('#' * size)
+    formatter = MultiFormatter(str(tmpdir), ['yapf'])
+    formatter.store = ResultStore(str(tmpdir.join('store')))
+
+    def path(name):
+        return str(tmpdir.join(name))
+
+    paths = [path(name) for name in ('a.py', 'b.py', 'c.py', 'd.py',
+                                     'mid.py', 'big.py')]
+    assert formatter.make_batches(paths, 1) == [
+        [path('big.py')], [path('mid.py'), path('a.py'), path('b.py')],
+        [path('c.py'), path('d.py')]]
+
+    # Times of past runs win over sizes
+    formatter.timings = {'yapf': {path('a.py'): 9.0, path('big.py'): 1.0}}
+    formatter.save_timings()
+    batches = formatter.make_batches(paths, 1)
+    assert batches[0] == [path('a.py')]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the static import graph and the selection of tests."""
+
+# Standard library imports
+import os
+
+# Local imports
+from ciocheck.cache import ResultStore
+from ciocheck.imports import ImportGraph, parse_imports, resolve_imports
+from ciocheck.utils import file_hash
+
+
+def test_resolve_relative_imports():
+    """Relative imports are resolved from the module and its packages."""
+    imports = parse_imports(b'from . import a\nfrom ..b import c\nimport d.e')
+    names = resolve_imports(imports, 'pkg.sub.mod')
+    assert names == set(['pkg', 'pkg.sub', 'pkg.sub.a', 'pkg.b', 'pkg.b.c',
+                         'd', 'd.e'])
+    assert resolve_imports(parse_imports(b'from . import a'), 'pkg',
+                           is_package=True) == set(['pkg', 'pkg.a'])
+    assert parse_imports(b'def (') is None
+
+
+def test_select_tests(tmpdir):
+    """Tests importing a modified module, even indirectly, are selected."""
+    files = {
+        'pkg/__init__.py': '',
+        'pkg/core.py': '',
+        'pkg/api.py': 'from .core import run\n',
+        'pkg/other.py': '',
+        'tests/conftest.py': '',
+        'tests/test_api.py': 'from pkg import api\n',
+        'tests/test_other.py': 'import pkg.other\n',
+        'tests/test_smoke.py': '',
+    }
+    for name, contents in files.items():
+        tmpdir.join(name).write(contents, ensure=True)
+    paths = [str(tmpdir.join(name)) for name in files]
+    root = str(tmpdir)
+
+    def path(name):
+        return os.path.join(root, name)
+
+    store = ResultStore(str(tmpdir.join('store')))
+    graph = ImportGraph(paths, store=store, content_hash=file_hash)
+    assert graph.select_tests([path('pkg/core.py')]) == [
+        path('tests/test_api.py')]
+    assert graph.select_tests([path('tests/conftest.py')]) == sorted(
+        path(name) for name in files if '/test_' in name)
+    assert graph.select_tests(
+        [path('pkg/other.py')], always_run=['tests/test_smoke.py'],
+        root=root) == [path('tests/test_other.py'),
+                       path('tests/test_smoke.py')]
+
+    # Imports are cached by content, files are not parsed again
+    misses = store.counters['imports']['misses']
+    ImportGraph(paths, store=store, content_hash=file_hash)
+    assert store.counters['imports']['misses'] == misses
@@ -7,8 +7,16 @@
 # -----------------------------------------------------------------------------
 """Test pytest runners."""
 
+# Standard library imports
+import os
+
 # Local imports
-from ciocheck.linters import Flake8Linter, Pep8Linter
+from ciocheck.api import make_args
+from ciocheck.cache import ResultStore
+from ciocheck.config import load_config
+from ciocheck.imports import ImportGraph
+from ciocheck.linters import (Flake8Linter, Pep8Linter, PydocstyleLinter,
+                              PylintLinter)
 
 
 def test_true():
@@ -21,3 +29,118 @@ def test_false():
     """Mock test for checking ciocheck is working."""
     linter = Pep8Linter('')
     assert linter.name == 'pep8'
+
+
+def test_pylint_keys_cover_imports(tmpdir):
+    """Pylint findings are invalidated by changes of imported modules."""
+    tmpdir.join('a.py').write('import b\n')
+    tmpdir.join('b.py').write('import c\n')
+    tmpdir.join('c.py').write('')
+    tmpdir.join('d.py').write('')
+    paths = [str(tmpdir.join(name)) for name in ('a.py', 'b.py', 'c.py',
+                                                 'd.py')]
+
+    def get_key():
+        linter = PylintLinter(str(tmpdir))
+        assert not linter.cacheable
+        linter.store = ResultStore(str(tmpdir.join('store')))
+        linter.import_graph = ImportGraph(paths)
+        assert linter.cacheable
+        return linter.get_cache_key('salt', paths[0])
+
+    key = get_key()
+    tmpdir.join('d.py').write('x = 1\n')
+    assert get_key() == key
+    tmpdir.join('c.py').write('x = 1\n')
+    assert get_key() != key
+
+
+def test_pylint_cache_keeps_cross_module_checks(tmpdir):
+    """Checks comparing modules run on every file, also with the cache."""
+    tmpdir.join('a.py').write('import b\n', ensure=True)
+    tmpdir.join('b.py').write('import a\n')
+    paths = [str(tmpdir.join('a.py')), str(tmpdir.join('b.py'))]
+    store = ResultStore(str(tmpdir.join('store')))
+
+    def cyclic_imports(checked):
+        linter = PylintLinter(str(tmpdir))
+        linter.store = store
+        linter.import_graph = ImportGraph(paths)
+        return [r for r in linter.run(checked) if 'Cyclic import' in r.message]
+
+    assert len(cyclic_imports(paths)) == 1
+    tmpdir.join('b.py').write('import a\nVALUE = 1\n')
+    assert len(cyclic_imports(paths)) == 1
+    hits = store.counters['pylint']['hits']
+    assert len(cyclic_imports(paths)) == 1
+    assert store.counters['pylint']['hits'] == hits + 3
+
+
+def test_flake8_excludes_relative_paths(tmpdir):
+    """Exclude patterns are relative to the project, not the config file."""
+    tmpdir.join('.ciocheck').write('[ciocheck]\ncheck = flake8\n\n'
+                                   '[flake8]\nexclude = */tests/*\n')
+    tmpdir.join('pkg', 'tests', 't.py').write('a=1\n', ensure=True)
+    tmpdir.join('pkg', 'mod.py').write('a=1\n')
+    root = str(tmpdir)
+    paths = [str(tmpdir.join('pkg', 'mod.py')),
+             str(tmpdir.join('pkg', 'tests', 't.py'))]
+
+    linter = Flake8Linter(root)
+    linter.create_config(load_config(root, make_args()))
+    results = linter.run(paths)
+    assert set(result.path for result in results) == set(paths[:1])
+
+
+def test_cache_keys_depend_on_paths(tmpdir):
+    """Files with the same content are not mixed up in the cache."""
+    tmpdir.join('pkg', '_priv.py').write('x = 1\n', ensure=True)
+    tmpdir.join('pkg', 'mod.py').write('x = 1\n')
+    store = ResultStore(str(tmpdir.join('store')))
+    paths = [str(tmpdir.join('pkg', name)) for name in ('_priv.py', 'mod.py')]
+
+    results = []
+    for path in paths:
+        linter = PydocstyleLinter(str(tmpdir))
+        linter.store = store
+        results.append([result.type for result in linter.run([path])])
+    assert results == [[], ['D100']]
+
+
+def test_pylint_paths_from_other_cwd(tmpdir, monkeypatch):
+    """Findings point to the checked files whatever the working folder."""
+    tmpdir.join('project', 'mod.py').write('import os\n', ensure=True)
+    root = str(tmpdir.join('project'))
+    path = os.path.join(root, 'mod.py')
+    monkeypatch.chdir(str(tmpdir))
+
+    results = PylintLinter(root).run([path])
+    assert results
+    assert set(result.path for result in results) == set([path])
+
+
+def test_pylint_cached_run_matches_full_run(tmpdir):
+    """Linting only the edited module finds what a full run finds."""
+    tmpdir.join('pkg', '__init__.py').write('"""Pkg."""\n', ensure=True)
+    tmpdir.join('pkg', 'mod.py').write('"""Mod."""\n\nVALUE = 1\n')
+    tmpdir.join('tests', 'test_mod.py').write(
+        '"""Test."""\nfrom pkg.mod import VALUE\n', ensure=True)
+    root = str(tmpdir)
+    paths = [str(tmpdir.join(*name.split('/'))) for name in (
+        'pkg/__init__.py', 'pkg/mod.py', 'tests/test_mod.py')]
+    store = ResultStore(str(tmpdir.join('store')))
+
+    def run(cached):
+        linter = PylintLinter(root)
+        if cached:
+            linter.store = store
+            linter.import_graph = ImportGraph(paths)
+        return sorted((r.path, r.line, r.message) for r in
+                      linter.run(paths))
+
+    run(True)
+    tmpdir.join('tests', 'test_mod.py').write(
+        '"""Test."""\nfrom pkg.mod import VALUE\nimport os\n')
+    cached = run(True)
+    assert cached == run(False)
+    assert 'Unused import os' in [finding[2] for finding in cached]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the subprocess layer."""
+
+# Standard library imports
+import sys
+import time
+
+# Third party imports
+import pytest
+
+# Local imports
+from ciocheck.process import (JOBS, Command, CommandTimeout, JobServer,
+                              as_completed, run_command)
+
+
+def python(code):
+    """Return the command running python `code`."""
+    return [sys.executable, '-c', code]
+
+
+def test_run_command_streams_lines():
+    """Lines are passed to the callback while the output is collected."""
+    lines = []
+    output, error = run_command(
+        python('import sys; print(1); print(2); sys.stderr.write("e")'),
+        on_line=lines.append)
+    assert output.split() == ['1', '2']
+    assert [line.strip() for line in lines] == ['1', '2']
+    assert error == 'e'
+
+    output, _ = run_command(
+        python('import sys; sys.stdout.write(sys.stdin.read())'),
+        input_data=b'data', decode=False)
+    assert output == b'data'
+
+
+def test_run_command_timeout():
+    """Commands running for too long are killed."""
+    with pytest.raises(CommandTimeout):
+        run_command(python('import time; time.sleep(10)'), timeout=0.2)
+
+
+def test_restart_timeout():
+    """Restarting the timeout gives the command its whole limit again."""
+    code = ('import sys, time\n'
+            'for _ in range(3):\n'
+            '    time.sleep(0.4); print(1); sys.stdout.flush()\n')
+    command = Command(python(code), timeout=0.7)
+    command.on_line = lambda line: command.restart_timeout()
+    output, _ = command.run()
+    assert output.split() == ['1', '1', '1']
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='Process groups')
+def test_run_command_timeout_kills_children():
+    """Processes started by a command are killed with it."""
+    code = ('import subprocess, sys, time; '
+            'subprocess.Popen([sys.executable, "-c", "import time; '
+            'time.sleep(10)"]); time.sleep(10)')
+    start = time.time()
+    with pytest.raises(CommandTimeout):
+        run_command(python(code), timeout=0.5)
+    assert time.time() - start < 5
+
+
+def test_as_completed_order():
+    """Commands are yielded in the order they finish."""
+    commands = [
+        Command(python('import time; time.sleep({0})'.format(delay)))
+        for delay in (0.6, 0.0, 0.3)
+    ]
+    tokens = JOBS.tokens
+    JOBS.set_tokens(3)
+    try:
+        finished = list(as_completed(commands))
+    finally:
+        JOBS.set_tokens(tokens)
+    assert finished == [commands[1], commands[2], commands[0]]
+
+    finished = list(as_completed(iter(commands), max_running=1))
+    assert len(finished) == 3
+
+
+def test_job_server_reserve():
+    """Reservations take what is available, never more than the budget."""
+    jobs = JobServer(4)
+    assert jobs.acquire(3) == 3
+    with jobs.reserve() as taken:
+        assert taken == 1
+    with jobs.reserve(8) as taken:
+        assert taken == 1
+    jobs.release(3)
+    with jobs.reserve(8) as taken:
+        assert taken == 4
+    with jobs.reserve(2) as taken:
+        assert taken == 2
+        assert jobs.acquire(None) == 2
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the pytest plugin reporting to ciocheck."""
+
+# Standard library imports
+import json
+import os
+import subprocess
+import sys
+
+# Local imports
+from ciocheck.tools import get_pytest_env
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(HERE))
+
+TEST_MODULE = '''
+import pytest
+
+
+def test_pass():
+    pass
+
+
+def test_fail():
+    assert False
+
+
+@pytest.mark.skip
+def test_skip():
+    pass
+'''
+
+
+def run_plugin(tmpdir, *args):
+    """Run pytest with the plugin on `tmpdir` and return its report."""
+    tmpdir.join('test_module.py').write(TEST_MODULE)
+    report_path = str(tmpdir.join('report.json'))
+    env = os.environ.copy()
+    env['PYTHONPATH'] = PACKAGE_ROOT
+    with open(os.devnull, 'w') as devnull:
+        subprocess.call(
+            [sys.executable, '-m', 'pytest', '-p', 'ciocheck.pytest_plugin',
+             '--ciocheck-report={0}'.format(report_path),
+             '-p', 'no:cacheprovider', 'test_module.py'] + list(args),
+            cwd=str(tmpdir), env=env, stdout=devnull, stderr=devnull)
+
+    with open(report_path) as file_obj:
+        return json.load(file_obj)['report']
+
+
+def test_plugin_report(tmpdir):
+    """The plugin writes a summary and the failed tests."""
+    report = run_plugin(tmpdir)
+    summary = report['summary']
+    assert summary['passed'] == 1
+    assert summary['failed'] == 1
+    assert summary['skipped'] == 1
+    assert [t['name'] for t in report['tests']] == [
+        'test_module.py::test_fail'
+    ]
+    assert report['exitstatus'] == 1
+
+
+def test_plugin_shards(tmpdir):
+    """Every test runs in exactly one shard."""
+    summaries = [run_plugin(tmpdir, '--ciocheck-shard={0}/2'.format(i))[
+        'summary'] for i in (1, 2)]
+    assert [s['num_tests'] for s in summaries] == [2, 1]
+    assert sum(s.get('failed', 0) for s in summaries) == 1
+
+
+def test_pytest_env_adds_package_root_when_needed(tmpdir, monkeypatch):
+    """PACKAGE_ROOT is only put in front when ciocheck is not importable."""
+    monkeypatch.delenv('PYTHONPATH', raising=False)
+    env = get_pytest_env(str(tmpdir))
+    assert env['PYTHONPATH'].split(os.pathsep)[0] == PACKAGE_ROOT
+
+    env = get_pytest_env(PACKAGE_ROOT)
+    assert 'PYTHONPATH' not in env
+
+    monkeypatch.setenv('PYTHONPATH', PACKAGE_ROOT)
+    assert get_pytest_env(str(tmpdir))['PYTHONPATH'] == PACKAGE_ROOT
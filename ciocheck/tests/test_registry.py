@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the tool registry."""
+
+# Standard library imports
+import os
+import subprocess
+import sys
+
+# Local imports
+from ciocheck.registry import LINTER, MULTI_FORMATTER, get_tools, tool_names
+from ciocheck.tools import PACKAGE_ROOT
+
+
+def test_get_tools_filters_by_name():
+    """Only the requested tools of a given kind are returned in order."""
+    tools = get_tools(LINTER, ['flake8', 'pep8', 'yapf'])
+    assert [tool.name for tool in tools] == ['pep8', 'flake8']
+    multi = get_tools(MULTI_FORMATTER)
+    assert [tool.name for tool in multi] == ['isort', 'yapf', 'autopep8']
+    assert 'pytest' in tool_names()
+
+
+def test_main_import_is_lightweight():
+    """Importing the CLI does not import third party tool packages."""
+    code = ('import sys, ciocheck.main; '
+            'print([m for m in ("yapf", "isort", "autopep8", "pytest", '
+            '"pytest_cov") if m in sys.modules])')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.decode().strip() == '[]'
+
+
+def test_entry_point_tool_from_cli(tmpdir):
+    """Tools registered with entry points can be selected with --check."""
+    site = tmpdir.join('site')
+    site.join('noop_linter.py').write(
+        'from ciocheck.linters import Linter\n\n\n'
+        'class NoopLinter(Linter):\n'
+        '    name = "noop"\n'
+        '    extensions = ("py", )\n\n'
+        '    def run(self, paths):\n'
+        '        print("noop ran")\n'
+        '        return []\n', ensure=True)
+    dist_info = site.join('ciocheck_noop-0.1.dist-info')
+    dist_info.join('METADATA').write(
+        'Metadata-Version: 2.1\nName: ciocheck-noop\nVersion: 0.1\n',
+        ensure=True)
+    dist_info.join('entry_points.txt').write(
+        '[ciocheck.linters]\nnoop = noop_linter:NoopLinter\n')
+
+    project = tmpdir.join('project')
+    project.join('pkg', 'mod.py').write('x = 1\n', ensure=True)
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([str(site), PACKAGE_ROOT])
+    command = [sys.executable, '-m', 'ciocheck.main', 'pkg', '--check',
+               'noop', '--file-mode', 'all', '--force-run']
+    output = subprocess.check_output(command, cwd=str(project), env=env)
+    assert 'noop ran' in output.decode()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test sharding and merging of results."""
+
+# Standard library imports
+import json
+import os
+
+# Third party imports
+import pytest
+
+# Local imports
+from ciocheck.findings import Finding
+from ciocheck.main import merge_main
+from ciocheck.shards import (decode_results, encode_results,
+                             merge_test_results, parse_shard, partition,
+                             total_coverage, write_shard_file)
+from ciocheck.utils import LazyDiff
+
+
+def test_parse_shard():
+    """Shards are given as K/N with K between 1 and N."""
+    assert parse_shard('2/8') == (2, 8)
+    for value in ('0/2', '3/2', '2', 'a/b'):
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+def test_partition_is_balanced_and_deterministic():
+    """Every item is in one part and parts have similar weights."""
+    sizes = dict(('f{0}'.format(i), (i * 37) % 100) for i in range(50))
+    parts = partition(list(sizes), 4, sizes.get)
+    assert sorted(sum(parts, [])) == sorted(sizes)
+    loads = [sum(sizes[item] for item in part) for part in parts]
+    assert max(loads) - min(loads) <= max(sizes.values())
+    assert partition(list(reversed(list(sizes))), 4, sizes.get) == parts
+
+
+def test_results_round_trip():
+    """Findings and lazy diffs survive json, with relative paths."""
+    root = os.path.abspath(os.sep + 'project')
+    path = os.path.join(root, 'pkg', 'm.py')
+    all_results = {
+        'flake8': {
+            'files': {path: ([1, 2], [])},
+            'results': [Finding(path, 2, 1, 'E225', 'missing whitespace')],
+        },
+        'yapf': {
+            'files': [path],
+            'results': [{'path': path, 'diff': LazyDiff('a=1\n', 'a = 1\n')}],
+        },
+    }
+    test_results = {'coverage': {path: [1]}, 'files': [path]}
+    results, tests = encode_results(all_results, test_results, root)
+    data = json.loads(json.dumps([results, tests]))
+    assert data[0]['flake8']['results'][0]['path'] == 'pkg/m.py'
+
+    other_root = os.path.abspath(os.sep + 'other')
+    decoded, tests = decode_results(data[0], data[1], other_root)
+    other_path = os.path.join(other_root, 'pkg', 'm.py')
+    finding = decoded['flake8']['results'][0]
+    assert finding == Finding(other_path, 2, 1, 'E225', 'missing whitespace')
+    assert decoded['flake8']['files'][other_path] == ([1, 2], [])
+    assert '+a = 1' in decoded['yapf']['results'][0]['diff']
+    assert tests['coverage'] == {other_path: [1]}
+
+
+def test_merge_test_results():
+    """Coverage is combined and test counts are added up."""
+    def results(covered, passed, failed):
+        report = {
+            'summary': {'passed': passed, 'failed': failed},
+            'tests': [{'name': 't'}] * failed,
+            'exitstatus': int(bool(failed)),
+        }
+        return {'coverage': {'m.py': covered}, 'pytest': {'report': report}}
+
+    merged = merge_test_results(results([1, 2], 2, 0), results([2, 5], 1, 1))
+    report = merged['pytest']['report']
+    assert merged['coverage'] == {'m.py': [1, 2, 5]}
+    assert report['summary'] == {'passed': 3, 'failed': 1}
+    assert report['exitstatus'] == 1
+
+
+def test_merge_checks_every_shard(tmpdir, capsys):
+    """Merging reports missing shards, even with a `merge` folder around."""
+    tmpdir.mkdir('merge')
+    path = str(tmpdir.join('shard-1-of-2.json'))
+    write_shard_file(path, (1, 2), {
+        'check': [],
+        'enforce': [],
+        'results': {},
+        'tests': {},
+        'failed_checks': [],
+        'coverage_fail': False,
+    })
+    with tmpdir.as_cwd():
+        with pytest.raises(SystemExit) as info:
+            merge_main([path])
+    assert info.value.code == 1
+    assert 'found: 1/2' in capsys.readouterr().out
+
+
+def test_merged_coverage_is_checked_once(tmpdir, capsys):
+    """The coverage `fail_under` applies to the coverage of every shard."""
+    tmpdir.join('.ciocheck').write(
+        '[ciocheck]\ncheck = pytest\n\n[coverage:report]\nfail_under = 75\n')
+    tmpdir.join('m.py').write('a = 1\nb = 2\nc = 3\nd = 4\n')
+    path = str(tmpdir.join('m.py'))
+    assert total_coverage({path: [1, 2]}) == 50.0
+
+    shard_files = []
+    for index, covered in ((1, [1, 2]), (2, [2, 3])):
+        shard_file = str(tmpdir.join('shard-{0}.json'.format(index)))
+        write_shard_file(shard_file, (index, 2), {
+            'check': ['pytest'],
+            'enforce': ['coverage'],
+            'results': {},
+            'tests': {'coverage': {'m.py': covered}, 'files': ['m.py']},
+            'failed_checks': [],
+            'coverage_fail': False,
+        })
+        shard_files.append(shard_file)
+
+    with tmpdir.as_cwd():
+        merge_main(shard_files)
+    assert 'Total coverage of every shard: 75.00%' in capsys.readouterr().out
+
+    tmpdir.join('.ciocheck').write(
+        '[ciocheck]\ncheck = pytest\n\n[coverage:report]\nfail_under = 80\n')
+    with tmpdir.as_cwd():
+        with pytest.raises(SystemExit):
+            merge_main(shard_files)
+    assert 'coverage' in capsys.readouterr().out.split('failures in:')[1]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test utilities."""
+
+# Standard library imports
+import os
+import stat
+
+# Third party imports
+import pytest
+
+# Local imports
+from ciocheck.utils import (atomic_replace, atomic_replace_many,
+                            cgroup_cpu_limit, cpu_count)
+
+
+def read(path):
+    """Return the content of `path`."""
+    with open(path, 'rb') as file_obj:
+        return file_obj.read().decode('utf-8')
+
+
+def test_atomic_replace_skips_unchanged_content(tmpdir):
+    """Unchanged content is not written again."""
+    path = str(tmpdir.join('module.py'))
+    assert atomic_replace(path, u'a = 1\n')
+    os.utime(path, (0, 0))
+
+    assert not atomic_replace(path, u'a = 1\n')
+    assert os.stat(path).st_mtime == 0
+
+    assert atomic_replace(path, u'a = 2\n')
+    assert read(path) == u'a = 2\n'
+    assert os.listdir(str(tmpdir)) == ['module.py']
+
+
+def test_atomic_replace_preserves_mode(tmpdir):
+    """The permissions of replaced files are kept."""
+    path = str(tmpdir.join('script.py'))
+    atomic_replace(path, u'# é\n')
+    os.chmod(path, 0o751)
+
+    atomic_replace(path, u'# è\n', fsync=True)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o751
+    assert read(path) == u'# è\n'
+
+
+def test_atomic_replace_many(tmpdir):
+    """Several files are replaced, only changed ones are reported."""
+    paths = [str(tmpdir.join('{0}.py'.format(i))) for i in range(10)]
+    written = atomic_replace_many(dict((p, u'x = 1\n') for p in paths))
+    assert written == sorted(paths)
+
+    contents = dict((p, u'x = 1\n') for p in paths)
+    contents[paths[3]] = u'x = 2\n'
+    assert atomic_replace_many(contents, fsync=True) == [paths[3]]
+    assert read(paths[3]) == u'x = 2\n'
+    assert len(os.listdir(str(tmpdir))) == 10
+
+
+def test_atomic_replace_many_cleans_up_on_error(tmpdir):
+    """Temporary files are removed when one of the writes fails."""
+    paths = [str(tmpdir.join('{0}.py'.format(i))) for i in range(10)]
+    contents = dict((p, u'x = 1\n') for p in paths)
+    contents[str(tmpdir.join('missing', 'm.py'))] = u'x = 1\n'
+    with pytest.raises(OSError):
+        atomic_replace_many(contents, workers=4)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_cgroup_cpu_limit(tmpdir):
+    """Cpu quotas of cgroup v2 and v1 are rounded up to whole cpus."""
+    cgroup_file = tmpdir.join('cgroup')
+    root = tmpdir.mkdir('sys')
+
+    cgroup_file.write('0::/ci/job\n')
+    root.mkdir('ci').mkdir('job').join('cpu.max').write('250000 100000\n')
+    assert cgroup_cpu_limit(str(cgroup_file), str(root)) == 3
+
+    root.join('ci', 'job', 'cpu.max').write('max 100000\n')
+    assert cgroup_cpu_limit(str(cgroup_file), str(root)) is None
+
+    cgroup_file.write('4:cpu,cpuacct:/docker/abc\n')
+    folder = root.mkdir('cpu,cpuacct').mkdir('docker').mkdir('abc')
+    folder.join('cpu.cfs_quota_us').write('400000\n')
+    folder.join('cpu.cfs_period_us').write('100000\n')
+    assert cgroup_cpu_limit(str(cgroup_file), str(root)) == 4
+
+    folder.join('cpu.cfs_quota_us').write('-1\n')
+    assert cgroup_cpu_limit(str(cgroup_file), str(root)) is None
+
+
+def test_cpu_count_environment(monkeypatch):
+    """The cpu budget can be set with an environment variable."""
+    monkeypatch.setenv('CIOCHECK_JOBS', '3')
+    assert cpu_count() == 3
+    monkeypatch.delenv('CIOCHECK_JOBS')
+    assert cpu_count() >= 1
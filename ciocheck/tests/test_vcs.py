@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test version control helpers."""
+
+# Standard library imports
+import os
+import subprocess
+
+# Local imports
+from ciocheck.files import Fingerprints
+from ciocheck.utils import file_hash
+from ciocheck import vcs
+from ciocheck.vcs import DiffTool, NoDiffTool
+
+GIT = ['git', '-c', 'user.name=ciocheck', '-c', 'user.email=ci@check',
+       '-c', 'protocol.file.allow=always']
+
+
+def git(cwd, *args):
+    """Run a git command quietly on `cwd`."""
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(GIT + list(args), cwd=cwd, stdout=devnull,
+                              stderr=devnull)
+
+
+def write(path, contents):
+    """Write `contents` to `path`, creating folders as needed."""
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path, 'w') as file_obj:
+        file_obj.write(contents)
+
+
+def make_repo(path, files):
+    """Create a git repo on `path` with `files` commited."""
+    for name, contents in files.items():
+        write(os.path.join(path, name), contents)
+    git(path, 'init', '-q')
+    git(path, 'add', '.')
+    git(path, 'commit', '-q', '-m', 'Initial commit')
+
+
+def test_diff_tool_roots_and_submodules(tmpdir):
+    """Only requested paths are reported, including their submodules."""
+    sub = str(tmpdir.join('sub'))
+    mono = str(tmpdir.join('mono'))
+    make_repo(sub, {'s.py': 'a = 1\n'})
+    make_repo(mono, {'pkg/m.py': 'b = 1\n', 'other/o.py': 'c = 1\n'})
+    git(mono, 'submodule', 'add', '-q', sub, 'pkg/sub')
+
+    for name in ('pkg/m.py', 'other/o.py', 'pkg/sub/s.py'):
+        with open(os.path.join(mono, name), 'a') as file_obj:
+            file_obj.write('d = 2\n')
+
+    diff_tool = DiffTool([os.path.join(mono, 'pkg')])
+    lines = diff_tool.unstaged_file_lines()
+    top_level = list(diff_tool.diff_tools)[0]
+    assert list(lines) == [
+        os.path.join(top_level, 'pkg', 'm.py'),
+        os.path.join(top_level, 'pkg', 'sub', 's.py'),
+    ]
+    assert lines[os.path.join(top_level, 'pkg', 'm.py')][0] == [2]
+    assert diff_tool.unstaged_files() == list(lines)
+
+
+def test_staged_contents_and_write_index(tmpdir):
+    """Staged blobs are read and written without touching the work tree."""
+    repo = str(tmpdir)
+    make_repo(repo, {'m.py': 'a = 1\n'})
+    path = os.path.join(repo, 'm.py')
+    write(path, 'a = 1\nb=2\n')
+    git(repo, 'add', 'm.py')
+    write(path, 'a = 1\nb=2\nc=3\n')
+
+    diff_tool = DiffTool([repo])
+    path = os.path.join(list(diff_tool.diff_tools)[0], 'm.py')
+    mode, contents = diff_tool.staged_contents([path])[path]
+    assert (mode, contents) == ('100644', b'a = 1\nb=2\n')
+
+    assert diff_tool.write_index(path, b'a = 1\nb = 2\n', mode=mode)
+    assert diff_tool.staged_contents([path])[path][1] == b'a = 1\nb = 2\n'
+    with open(path) as file_obj:
+        assert file_obj.read() == 'a = 1\nb=2\nc=3\n'
+
+
+def test_renamed_files_report_edited_lines(tmpdir):
+    """A file moved into the checked folder only reports its edited lines."""
+    repo = str(tmpdir)
+    contents = ''.join('v{0} = {0}\n'.format(i) for i in range(20))
+    make_repo(repo, {'old/m.py': contents})
+    git(repo, 'mv', 'old/m.py', 'old/n.py')
+    os.makedirs(os.path.join(repo, 'new'))
+    git(repo, 'mv', 'old/n.py', 'new/m.py')
+    write(os.path.join(repo, 'new', 'm.py'), contents + 'w = 1\n')
+    git(repo, 'add', '.')
+
+    diff_tool = DiffTool([os.path.join(repo, 'new')])
+    top_level = list(diff_tool.diff_tools)[0]
+    path = os.path.join(top_level, 'new', 'm.py')
+    lines = diff_tool.staged_file_lines()
+    assert list(lines) == [path]
+    assert lines[path][0] == [21]
+
+    diff_tool = DiffTool([os.path.join(repo, 'new')], rename_similarity=0)
+    assert len(diff_tool.staged_file_lines()[path][0]) == 21
+
+
+def test_no_vcs_folder_reports_changes_since_commit(tmpdir):
+    """Folders without version control report changes since the last run."""
+    folder = str(tmpdir.join('project'))
+    index_folder = str(tmpdir.join('index'))
+    contents = ''.join('v{0} = {0}\n'.format(i) for i in range(10))
+    write(os.path.join(folder, 'a.py'), contents)
+    write(os.path.join(folder, 'b.py'), contents)
+
+    diff_tool = NoDiffTool(folder, index_folder=index_folder)
+    lines = diff_tool.unstaged_file_lines()
+    assert sorted(lines) == [os.path.join(folder, n) for n in ('a.py', 'b.py')]
+    assert lines[os.path.join(folder, 'a.py')][0] == list(range(1, 11))
+    diff_tool.commit_index()
+
+    # Same content with a new modification time is not a change
+    write(os.path.join(folder, 'a.py'), contents)
+    write(os.path.join(folder, 'b.py'),
+          contents.replace('v3 = 3', 'v3 = 4') + 'w = 1\n')
+    write(os.path.join(folder, 'c.py'), 'c = 1\n')
+    diff_tool = NoDiffTool(folder, index_folder=index_folder)
+    lines = diff_tool.unstaged_file_lines()
+    assert lines == {
+        os.path.join(folder, 'b.py'): ([4, 11], [4]),
+        os.path.join(folder, 'c.py'): ([1], []),
+    }
+    assert diff_tool.staged_files() == sorted(lines)
+
+    diff_tool.commit_index()
+    assert NoDiffTool(folder, index_folder=index_folder).staged_files() == []
+    blobs = [n for _, _, names in os.walk(index_folder) for n in names]
+    assert len(blobs) == 3 + 1  # Blobs of the current files and the index
+
+
+def test_no_vcs_folder_skips_large_and_binary_blobs(tmpdir, monkeypatch):
+    """Only a hash of large and binary files is kept in the index."""
+    monkeypatch.setattr(vcs, 'MAX_INDEX_BLOB_SIZE', 100)
+    monkeypatch.setattr(vcs, 'MAX_DIFF_LINES', 5)
+    folder = str(tmpdir.join('project'))
+    index_folder = str(tmpdir.join('index'))
+    large = ''.join('v{0} = {0}\n'.format(i) for i in range(20))
+    write(os.path.join(folder, 'large.py'), large)
+    write(os.path.join(folder, 'small.py'), 'a = 1\n')
+    with open(os.path.join(folder, 'data.py'), 'wb') as file_obj:
+        file_obj.write(b'\0\1\n')
+
+    diff_tool = NoDiffTool(folder, index_folder=index_folder)
+    diff_tool.commit_index()
+    blobs = [n for _, _, names in os.walk(index_folder) for n in names]
+    assert len(blobs) == 1 + 1  # Only small.py and the index
+
+    write(os.path.join(folder, 'large.py'), large + 'w = 1\n')
+    write(os.path.join(folder, 'small.py'), ''.join(
+        'a = {0}\n'.format(i) for i in range(6)))
+    with open(os.path.join(folder, 'data.py'), 'wb') as file_obj:
+        file_obj.write(b'\0\2\n')
+    lines = NoDiffTool(folder, index_folder=index_folder).unstaged_file_lines()
+    assert lines == {
+        os.path.join(folder, 'data.py'): ([], []),
+        os.path.join(folder, 'large.py'): (list(range(1, 22)), []),
+        os.path.join(folder, 'small.py'): (list(range(1, 7)), [1]),
+    }
+
+
+def test_file_fingerprints_match_file_hash(tmpdir):
+    """Git blob ids of clean, dirty and untracked files match the content."""
+    repo = str(tmpdir)
+    make_repo(repo, {'clean.py': 'a = 1\n', 'dirty.py': 'b = 1\n'})
+    write(os.path.join(repo, 'dirty.py'), 'b = 2\n')
+    write(os.path.join(repo, 'new.py'), 'c = 1\n')
+
+    diff_tool = DiffTool([repo])
+    top_level = list(diff_tool.diff_tools)[0]
+    paths = [os.path.join(top_level, name)
+             for name in ('clean.py', 'dirty.py', 'new.py')]
+    fingerprints = diff_tool.file_fingerprints(paths)
+    assert fingerprints == dict((path, file_hash(path)) for path in paths)
+
+    cache = Fingerprints()
+    cache.prefetch(paths, diff_tool)
+    assert sorted(cache.hashes) == paths
+    write(paths[0], 'a = 2\n')
+    assert cache.get(paths[0]) == file_hash(paths[0])
+
+
+def test_base_commits(tmpdir):
+    """Base commits of a run are resolved, missing branches are None."""
+    repo = str(tmpdir)
+    make_repo(repo, {'m.py': 'a = 1\n'})
+    diff_tool = DiffTool([repo])
+    top_level = list(diff_tool.diff_tools)[0]
+    head = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo)
+    assert diff_tool.base_commits('origin/master') == {
+        top_level: (head.decode().strip(), None),
+    }
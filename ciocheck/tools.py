@@ -7,21 +7,63 @@
 # -----------------------------------------------------------------------------
 """Generic tools and custom test runner."""
 
+from __future__ import absolute_import, print_function
+
 # Standard library imports
-from collections import OrderedDict
-import ast
+from collections import OrderedDict, deque
 import json
 import os
+import re
+import sys
 
 # Third party imports
-from pytest_cov.plugin import CoverageError
 from six import PY2
 from six.moves import configparser
-import pytest
+from six.moves import cStringIO as StringIO
 
 # Local imports
-from ciocheck.config import COVERAGE_CONFIGURATION_FILE
-from ciocheck.utils import ShortOutput, cpu_count
+from ciocheck.config import (CACHE_FOLDER, COVERAGE_CONFIGURATION_FILE,
+                             TOOLS_CONFIG_FOLDER)
+from ciocheck.process import JOBS, Command, run_command
+from ciocheck.utils import file_hash, get_version, write_if_changed
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def get_pytest_env(cwd, _imports={}):
+    """
+    Return the environment of a pytest process able to load the plugin.
+
+    PACKAGE_ROOT is only added to PYTHONPATH when this ciocheck can not be
+    imported from `cwd` already. For an installed ciocheck it is the
+    site-packages folder, which would shadow the packages of the project.
+    """
+    env = os.environ.copy()
+    python_path = env.get('PYTHONPATH')
+    key = (cwd, python_path)
+    if key not in _imports:
+        code = ('import os, ciocheck; '
+                'print(os.path.realpath(ciocheck.__file__))')
+        try:
+            output, _ = run_command(
+                [sys.executable, '-c', code], cwd=cwd, jobs=0)
+            path = output.strip().splitlines()[-1]
+            root = os.path.dirname(os.path.dirname(path))
+        except Exception:
+            root = None
+        _imports[key] = root == PACKAGE_ROOT
+
+    if not _imports[key]:
+        env['PYTHONPATH'] = os.pathsep.join(
+            [PACKAGE_ROOT] + [p for p in [python_path] if p])
+    return env
+
+
+def get_command_timeout(config):
+    """Return the timeout of tool commands in seconds, None for no limit."""
+    if config is None:
+        return None
+    return float(config.get_value('command_timeout') or 0) or None
 
 
 class Tool(object):
@@ -32,24 +74,71 @@ class Tool(object):
     extensions = None
 
     command = None
+    distribution = None  # Python distribution providing the tool
 
     # Config
     config_file = None  # '.validconfigfilename'
     config_sections = None  # (('ciocheck:section', 'section'))
+    config = None  # ConfigSnapshot, set on the class inside format_task
+
+    # Options of the tool config file with paths relative to its folder
+    path_options = ()
 
     def __init__(self, cmd_root):
         """A Generic tool object."""
         self.cmd_root = cmd_root
         self.config = None
         self.config_options = None  # dict version of the config
+        self.store = None  # ResultStore shared between runs
+        self.fingerprints = None  # Fingerprints shared between tools
+        self.files_root = None  # Copy of cmd_root the tool runs on, if any
+        self._results = None
+
+    @classmethod
+    def get_cache_salt(cls, config):
+        """Return what identifies the tool version and options in caches."""
+        options = OrderedDict()
+        if config is not None and cls.config_sections:
+            for (cio_config_section, _) in cls.config_sections:
+                if config.has_section(cio_config_section):
+                    options[cio_config_section] = config.items(
+                        cio_config_section)
+        return [cls.name, get_version(cls.distribution), options]
+
+    @classmethod
+    def get_config_path(cls, cmd_root):
+        """Return the path of the private config file used by the tool."""
+        return os.path.join(cmd_root, TOOLS_CONFIG_FOLDER, cls.config_file)
+
+    def _absolute_paths(self, value):
+        """
+        Make the relative path patterns of a comma separated list absolute.
+
+        The private config file is not in the project folder, patterns with
+        a folder separator would be relative to the wrong folder.
+        """
+        patterns = []
+        for pattern in re.split(r'[,\s]+', value):
+            if '/' in pattern and not os.path.isabs(pattern):
+                pattern = os.path.normpath(
+                    os.path.join(os.path.abspath(self.cmd_root), pattern))
+            if pattern:
+                patterns.append(pattern)
+        return ','.join(patterns)
 
     def create_config(self, config):
-        """Create a config file for for a given config fname and sections."""
+        """
+        Create a config file for for a given config fname and sections.
+
+        Config files are kept in a private folder and only written when the
+        content changed, so repeated runs leave the working tree (and the
+        caches of tools watching it) untouched.
+        """
         self.config = config
 
         if self.config_file and self.config_sections:
             new_config = configparser.ConfigParser()
-            new_config_file = os.path.join(self.cmd_root, self.config_file)
+            new_config_file = self.get_config_path(self.cmd_root)
 
             for (cio_config_section, config_section) in self.config_sections:
                 if config.has_section(cio_config_section):
@@ -57,54 +146,53 @@ class Tool(object):
                     new_config.add_section(config_section)
 
                     for option, value in items:
+                        if option.replace('_', '-') in self.path_options:
+                            value = self._absolute_paths(value)
                         new_config.set(config_section, option, value)
 
-            with open(new_config_file, 'w') as file_obj:
-                new_config.write(file_obj)
+            string_obj = StringIO()
+            new_config.write(string_obj)
+            write_if_changed(new_config_file, string_obj.getvalue())
 
     @classmethod
     def make_config_dictionary(cls):
-        """Turn config into a dictionary for later usage."""
-        config_path = os.path.join(cls.cmd_root, cls.config_file)
+        """Return the tool options of the config snapshot as a dictionary."""
         config_options = {}
-
-        if os.path.exists(config_path):
-            config = configparser.ConfigParser()
-
-            with open(config_path, 'r') as file_obj:
-                config.readfp(file_obj)
-
-            for section in config.sections():
-                for key in config[section]:
-                    value = config[section][key]
-                    if ',' in value:
-                        value = [v for v in value.split(',') if v]
-                    elif value.lower() == 'false':
-                        value = False
-                    elif value.lower() == 'true':
-                        value = True
-                    else:
-                        try:
-                            value = ast.literal_eval(value)  # Numbers
-                        except Exception as err:
-                            print(err)
-
-                    config_options[key.replace('-', '_')] = value
-
+        if cls.config is not None and cls.config_sections:
+            for (cio_config_section, _) in cls.config_sections:
+                config_options.update(
+                    cls.config.get_options(cio_config_section))
         return config_options
 
     @classmethod
     def remove_config(cls, path):
-        """Remove config file."""
-        if cls.config_file and cls.config_sections:
-            remove_file = os.path.join(path, cls.config_file)
-            if os.path.isfile(remove_file):
-                os.remove(remove_file)
+        """Remove temporary files created by the tool on `path`."""
+        pass
+
+    def relative_path(self, path):
+        """Return `path` relative to the project, as used in cache keys."""
+        root = os.path.abspath(self.files_root or self.cmd_root)
+        return os.path.relpath(os.path.abspath(path), root).replace(os.sep,
+                                                                    '/')
+
+    def content_hash(self, path):
+        """Return the content hash of `path` used in cache keys."""
+        if self.fingerprints is not None:
+            return self.fingerprints.get(path)
+        return file_hash(path)
 
     def run(self, paths):
         """Run the tool."""
         raise NotImplementedError
 
+    def start(self, paths):
+        """Start the tool, tools running in the background override it."""
+        self._results = self.run(paths)
+
+    def wait(self):
+        """Wait for the tool started with `start` and return its results."""
+        return self._results
+
 
 class CoverageTool(Tool):
     """Coverage tool runner."""
@@ -112,6 +200,7 @@ class CoverageTool(Tool):
     name = 'coverage'
     language = 'python'
     extensions = ('py', )
+    distribution = 'coverage'
 
     # Config
     config_file = COVERAGE_CONFIGURATION_FILE
@@ -147,11 +236,6 @@ class CoverageTool(Tool):
         """Run the tool."""
         return []
 
-    @classmethod
-    def remove_config(cls, path):
-        """Remove config file."""
-        pass
-
 
 class PytestTool(Tool):
     """Pytest tool runner."""
@@ -159,17 +243,25 @@ class PytestTool(Tool):
     name = 'pytest'
     language = 'python'
     extensions = ('py', )
+    distribution = 'pytest'
 
     config_file = 'pytest.ini'
     config_sections = [('pytest', 'pytest')]
 
-    REPORT_FILE = '.pytestreport.json'
+    REPORT_FILE = os.path.join(CACHE_FOLDER, 'pytest-report.json')
+    LOG_FILE = os.path.join(CACHE_FOLDER, 'pytest.log')
+    OUTPUT_LINES = 1000  # Last lines of output kept in memory
 
     def __init__(self, cmd_root):
         """Pytest tool runner."""
         super(PytestTool, self).__init__(cmd_root)
         self.pytest_args = None
-        self.output = None
+        self.enable_xdist = False
+        self.shard = None  # (K, N) to only run a part of the tests
+        self.stream = None  # Where the output is streamed, standard output
+        self.command = None
+        self.output = None  # Last lines of output
+        self._log = None
         self.coverage_fail = False
 
     def setup_pytest_coverage_args(self, paths):
@@ -185,41 +277,90 @@ class PytestTool(Tool):
         else:
             coverage_args = []
 
-        coverage_config_file = os.path.join(self.cmd_root,
-                                            COVERAGE_CONFIGURATION_FILE)
+        coverage_config_file = CoverageTool.get_config_path(self.cmd_root)
+        if not os.path.isfile(coverage_config_file):
+            coverage_config_file = os.path.join(self.cmd_root,
+                                                COVERAGE_CONFIGURATION_FILE)
         if os.path.isfile(coverage_config_file):
             cov_config = ['--cov-config', coverage_config_file]
             coverage_args = cov_config + coverage_args
 
-        if PY2:
-            # xdist appears to lock up the test suite with python2, maybe due
-            # to an interaction with coverage
-            enable_xdist = []
-        else:
-            enable_xdist = ['-n', str(cpu_count())]
+        # xdist appears to lock up the test suite with python2, maybe due
+        # to an interaction with coverage. Workers are added in `start`.
+        self.enable_xdist = not PY2
 
-        self.pytest_args = ['--json={0}'.format(self.REPORT_FILE)]
-        self.pytest_args = self.pytest_args + enable_xdist
+        pytest_config_args = ['--rootdir', self.cmd_root]
+        pytest_config_file = self.get_config_path(self.cmd_root)
+        if os.path.isfile(pytest_config_file):
+            pytest_config_args += ['-c', pytest_config_file]
+
+        self.pytest_args = pytest_config_args
         self.pytest_args = self.pytest_args + coverage_args
 
-    def run(self, paths):
-        """Run pytest test suite."""
-        cmd = paths + self.pytest_args
-        print(cmd)
+    def _on_line(self, line):
+        """Stream a line of the pytest output."""
+        print(line, end='', file=self.stream or sys.stdout)
+        self.output.append(line)
+        if self._log is not None:
+            self._log.write(line)
+        if 'FAIL Required test coverage'.lower() in line.lower():
+            self.coverage_fail = True
+
+    def start(self, paths):
+        """Start the test suite in a subprocess, see `wait`."""
+        report_path = os.path.join(self.cmd_root, self.REPORT_FILE)
+        if os.path.isfile(report_path):
+            os.remove(report_path)
+
+        cmd = [
+            sys.executable, '-m', 'pytest', '-p', 'ciocheck.pytest_plugin',
+            '--ciocheck-report={0}'.format(report_path)
+        ]
+        cmd = cmd + paths + self.pytest_args
+        if self.shard is not None:
+            cmd.append('--ciocheck-shard={0}/{1}'.format(*self.shard))
+            # The coverage of a shard is partial, it is checked on merge
+            if any(arg.startswith('--cov') for arg in self.pytest_args):
+                cmd.append('--cov-fail-under=0')
+
+        # xdist workers take their tokens from the job server, leaving one
+        # for the linters running at the same time
+        if self.enable_xdist:
+            jobs = JOBS.acquire(max(1, JOBS.tokens - 1), minimum=1)
+            cmd = cmd + ['-n', str(jobs)]
+        else:
+            jobs = JOBS.acquire(1)
+        print(cmd, file=self.stream or sys.stdout)
 
+        env = get_pytest_env(self.cmd_root)
+
+        self.output = deque(maxlen=self.OUTPUT_LINES)
+        log_path = os.path.join(self.cmd_root, self.LOG_FILE)
         try:
-            with ShortOutput(self.cmd_root) as so:
-                errno = pytest.main(cmd)
-            output_lines = ''.join(so.output).lower()
+            self._log = open(log_path, 'w')
+        except (IOError, OSError):
+            self._log = None
 
-            if 'FAIL Required test coverage'.lower() in output_lines:
-                self.coverage_fail = True
+        self.command = Command(
+            cmd, cwd=self.cmd_root, env=env, on_line=self._on_line, jobs=0)
+        self.command.add_done_callback(lambda command: JOBS.release(jobs))
+        self.command.start()
 
-            if errno != 0:
-                print("pytest failed, code {errno}".format(errno=errno))
-        except CoverageError as e:
-            print("Test coverage failure: " + str(e))
-            self.coverage_fail = True
+    def wait(self):
+        """Wait for the test suite and return the results."""
+        try:
+            _, error = self.command.wait()
+        finally:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+        stream = self.stream or sys.stdout
+        if error:
+            print(error, file=stream)
+        if self.command.returncode != 0:
+            print("pytest failed, code {errno}".format(
+                errno=self.command.returncode), file=stream)
 
         covered_lines = self.parse_coverage()
         pytest_report = self.parse_pytest_report()
@@ -229,6 +370,11 @@ class PytestTool(Tool):
             results['pytest'] = pytest_report
         return results
 
+    def run(self, paths):
+        """Run pytest test suite."""
+        self.start(paths)
+        return self.wait()
+
     def parse_pytest_report(self):
         """Parse pytest json resport generated by pytest-json."""
         data = None
@@ -246,13 +392,22 @@ class PytestTool(Tool):
 
         covered_lines = {}
         if os.path.isfile(coverage_path):
-            with open(coverage_path, 'r') as file_obj:
+            with open(coverage_path, 'rb') as file_obj:
                 data = file_obj.read()
-                data = data.replace(coverage_string, '')
 
-            cov = json.loads(data)
+            if data.startswith(coverage_string.encode('utf-8')):
+                data = data.decode('utf-8').replace(coverage_string, '')
+                lines = json.loads(data)['lines']
+            else:
+                # Coverage 5 and later store the data in a sqlite database
+                from coverage import CoverageData
+
+                cov = CoverageData(basename=coverage_path)
+                cov.read()
+                lines = dict((path, sorted(cov.lines(path) or []))
+                             for path in cov.measured_files())
+
             covered_lines = OrderedDict()
-            lines = cov['lines']
             for path in sorted(lines):
                 covered_lines[path] = lines[path]
         return covered_lines
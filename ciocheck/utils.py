@@ -12,22 +12,30 @@ from __future__ import absolute_import, print_function
 # Standard library imports
 from collections import OrderedDict
 from copy import deepcopy
-import codecs
+from stat import S_IMODE
 import cProfile
 import difflib
 import errno
+import hashlib
+import math
 import os
 import pstats
-import subprocess
 import sys
+import tempfile
+import threading
 import uuid
 
 # Third party imports
 from six.moves import cStringIO as StringIO
+from six.moves import queue
+import six
 
 # Local imports
 from ciocheck.config import DEFAULT_IGNORE_EXTENSIONS, DEFAULT_IGNORE_FOLDERS
 
+JOBS_ENV = 'CIOCHECK_JOBS'
+DIFF_TRUNCATED = '... (diff truncated at {0} characters)\n'
+
 
 class Profiler(object):
     """Context manager profiler."""
@@ -87,21 +95,46 @@ class ShortOutput(object):
                 print(line)
 
 
-def run_command(args, cwd=None):
-    """Run command."""
-    process = subprocess.Popen(
-        args,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        cwd=cwd, )
-    output, error = process.communicate()
+def run_parallel(func, items, workers=None):
+    """
+    Run `func` on every item with a pool of threads and return the results.
+
+    Results keep the order of `items`. The first exception raised by `func`
+    is raised again once all the threads finished.
+    """
+    items = list(items)
+    workers = min(workers or cpu_count(), len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+    errors = []
+    tasks = queue.Queue()
+    for task in enumerate(items):
+        tasks.put(task)
 
-    if isinstance(output, bytes):
-        output = output.decode()
-    if isinstance(error, bytes):
-        error = error.decode()
+    def worker():
+        """Process tasks until the queue is empty."""
+        while True:
+            try:
+                index, item = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = func(item)
+            except Exception as err:
+                errors.append(err)
 
-    return output, error
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return results
 
 
 def get_files(paths,
@@ -165,7 +198,7 @@ def _rename_over_existing(src, dest):
     try:
         # On Windows, this will throw EEXIST, on Linux it won't.
         os.rename(src, dest)
-    except IOError as err:
+    except (IOError, OSError) as err:
         if err.errno == errno.EEXIST:
             # Clearly this song-and-dance is not in fact atomic,
             # but if something goes wrong putting the new file in
@@ -183,41 +216,396 @@ def _rename_over_existing(src, dest):
                     os.remove(backup)
                 except Exception as err:
                     pass
+        else:
+            raise
+
 
+def _replace(src, dest):
+    """Rename `src` over `dest`, atomically where the platform allows it."""
+    if hasattr(os, 'replace'):
+        os.replace(src, dest)
+    else:
+        _rename_over_existing(src, dest)
 
-def atomic_replace(path, contents, encoding):
-    """Try to do an atomic replace."""
-    tmp = "{0}tmp-{1}".format(path, str(uuid.uuid4()))
+
+def _fsync_folder(folder):
+    """Flush the entries of `folder` to disk, where supported."""
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except (IOError, OSError):
+        return
     try:
-        with codecs.open(tmp, 'w', encoding) as file_obj:
+        os.fsync(fd)
+    except (IOError, OSError):
+        pass
+    finally:
+        os.close(fd)
+
+
+def _get_umask(_umask=[]):
+    """Return the process umask, read only once since it is not atomic."""
+    if not _umask:
+        umask = os.umask(0)
+        os.umask(umask)
+        _umask.append(umask)
+    return _umask[0]
+
+
+def _write_temporary(path, contents, encoding, fsync=False):
+    """
+    Write `contents` next to `path` and return the temporary path.
+
+    Return None if `path` already has the same content. The temporary file
+    gets the permissions (and if possible the owner) of `path`.
+    """
+    if isinstance(contents, six.text_type):
+        contents = contents.encode(encoding)
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = None
+
+    if stat is not None and stat.st_size == len(contents):
+        with open(path, 'rb') as file_obj:
+            if file_obj.read() == contents:
+                return None
+
+    folder, name = os.path.split(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(
+        prefix='.{0}.'.format(name), suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(handle, 'wb') as file_obj:
             file_obj.write(contents)
-            file_obj.flush()
-            file_obj.close()
-        _rename_over_existing(tmp, path)
+            if fsync:
+                file_obj.flush()
+                os.fsync(file_obj.fileno())
+
+        if stat is not None:
+            os.chmod(tmp_path, S_IMODE(stat.st_mode))
+            if hasattr(os, 'chown'):
+                try:
+                    os.chown(tmp_path, stat.st_uid, stat.st_gid)
+                except OSError:
+                    # Not allowed to give the file away, keep our owner
+                    pass
+        else:
+            # mkstemp creates private files, use the usual default instead
+            os.chmod(tmp_path, 0o666 & ~_get_umask())
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def atomic_replace(path, contents, encoding='utf-8', fsync=False):
+    """
+    Atomically replace the content of `path`, if it changed.
+
+    The content is written to a temporary file on the same folder, which
+    keeps the permissions of the original file, and renamed over `path`.
+    Return True if the file was written.
+    """
+    tmp_path = _write_temporary(path, contents, encoding, fsync=fsync)
+    if tmp_path is None:
+        return False
+
+    try:
+        _replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if fsync:
+        _fsync_folder(os.path.dirname(os.path.abspath(path)))
+    return True
+
+
+def atomic_replace_many(contents, encoding='utf-8', fsync=False,
+                        workers=None):
+    """
+    Atomically replace the content of several files with a pool of threads.
+
+    `contents` is a `{path: contents}` dictionary. With `fsync`, every file
+    is synced before the renames, and every folder only once after them.
+    Return the sorted list of paths written.
+    """
+    paths = sorted(contents)
+    tmp_paths = {}  # {path: temporary path}
+    lock = threading.Lock()
+
+    def write(path):
+        """Write a temporary file for `path`."""
+        tmp_path = _write_temporary(
+            path, contents[path], encoding, fsync=fsync)
+        if tmp_path is not None:
+            with lock:
+                tmp_paths[path] = tmp_path
+
+    written = []
+    try:
+        # Temporary files of other paths are removed if a write fails
+        run_parallel(write, paths, workers=workers)
+        for path in paths:
+            if path in tmp_paths:
+                _replace(tmp_paths[path], path)
+                written.append(path)
     finally:
+        for tmp_path in tmp_paths.values():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    if fsync:
+        folders = set(os.path.dirname(os.path.abspath(p)) for p in written)
+        for folder in sorted(folders):
+            _fsync_folder(folder)
+    return written
+
+
+def write_if_changed(path, contents, encoding='utf-8'):
+    """Atomically write `contents` to `path` only if the content changed."""
+    if not os.path.isfile(path):
+        folder = os.path.dirname(path)
         try:
-            os.remove(tmp)
-        except (IOError, OSError):
-            pass
+            os.makedirs(folder)
+        except OSError:
+            # Created by a concurrent run
+            if not os.path.isdir(folder):
+                raise
 
+    return atomic_replace(path, contents, encoding)
 
-def diff(string_a, string_b):
-    """Return unified diff of strings."""
+
+def diff(string_a, string_b, max_size=None):
+    """
+    Return unified diff of strings.
+
+    If `max_size` is given, the diff is truncated to roughly `max_size`
+    characters, so huge rewrites do not flood the report.
+    """
     string_a = string_a.splitlines(1)
     string_b = string_b.splitlines(1)
     result = difflib.unified_diff(string_a, string_b)
-    return ''.join(result)
+    if not max_size:
+        return ''.join(result)
 
+    size, chunks = 0, []
+    for line in result:
+        size += len(line)
+        if size > max_size:
+            chunks.append(DIFF_TRUNCATED.format(max_size))
+            break
+        chunks.append(line)
+    return ''.join(chunks)
+
+
+class LazyDiff(object):
+    """Unified diff of two strings, only computed when it is displayed."""
+
+    def __init__(self, string_a, string_b, max_size=None):
+        """Unified diff of two strings, only computed when it is displayed."""
+        self.string_a = string_a
+        self.string_b = string_b
+        self.max_size = max_size
+        self._rendered = None
+
+    def __bool__(self):
+        """Return if the strings are different, without diffing them."""
+        return self.string_a != self.string_b
+
+    __nonzero__ = __bool__
+
+    def render(self):
+        """Compute (once) and return the diff."""
+        if self._rendered is None:
+            self._rendered = diff(self.string_a, self.string_b,
+                                  max_size=self.max_size)
+        return self._rendered
+
+
+class SpilledDiff(object):
+    """Diff written to a file by a formatter worker, read when displayed."""
+
+    def __init__(self, path):
+        """Diff written to a file by a formatter worker."""
+        self.path = path
+
+    def __bool__(self):
+        """Only non empty diffs are written to files."""
+        return True
+
+    __nonzero__ = __bool__
+
+    def render(self):
+        """Read and return the diff, empty if the file was removed."""
+        try:
+            with open(self.path, 'rb') as file_obj:
+                return file_obj.read().decode('utf-8')
+        except (IOError, OSError):
+            return ''
+
+
+def blob_hash(contents):
+    """Return the git blob object id of `contents` bytes."""
+    header = 'blob {0}\0'.format(len(contents)).encode('utf-8')
+    return hashlib.sha1(header + contents).hexdigest()
+
+
+def stat_key(stat):
+    """Return the `[size, mtime_ns, inode]` identity of a stat result."""
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(stat.st_mtime * 1e9)
+    return [stat.st_size, mtime_ns, stat.st_ino]
+
+
+def file_hash(path):
+    """Return the git blob object id of the content of `path`."""
+    with open(path, 'rb') as file_obj:
+        return blob_hash(file_obj.read())
+
+
+def _get_version(distribution):
+    """Look up the installed version of a python `distribution`."""
+    try:
+        from importlib import metadata
+        return metadata.version(distribution)
+    except ImportError:
+        pass
+    except Exception:
+        return ''
 
-def cpu_count():
-    """Return the cpu count."""
     try:
-        import multiprocessing
-        count = multiprocessing.cpu_count()
+        import pkg_resources
+        return pkg_resources.get_distribution(distribution).version
     except Exception:
-        print("Using fallback CPU count", file=sys.stderr)
-        count = 4
-    return count
+        return ''
+
+
+def get_version(distribution, _versions={}):
+    """Return the installed version of a python `distribution` or ''."""
+    if not distribution:
+        return ''
+    if distribution not in _versions:
+        _versions[distribution] = _get_version(distribution)
+    return _versions[distribution]
+
+
+def lines_to_ranges(lines):
+    """Turn line numbers into a sorted list of `(start, end)` ranges."""
+    ranges = []
+    for line in sorted(set(lines)):
+        if line < 1:
+            continue
+        if ranges and ranges[-1][1] == line - 1:
+            ranges[-1][1] = line
+        else:
+            ranges.append([line, line])
+    return [tuple(line_range) for line_range in ranges]
+
+
+def _read_first_line(path):
+    """Return the first line of a file, None if it can not be read."""
+    try:
+        with open(path, 'r') as file_obj:
+            return file_obj.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _cgroup_folders(cgroup_file='/proc/self/cgroup', root='/sys/fs/cgroup'):
+    """Return `(version, folder)` candidates of the cpu cgroup controller."""
+    folders = []
+    try:
+        with open(cgroup_file, 'r') as file_obj:
+            lines = file_obj.read().splitlines()
+    except (IOError, OSError):
+        lines = []
+
+    for line in lines:
+        parts = line.split(':', 2)
+        if len(parts) != 3:
+            continue
+        _, controllers, path = parts
+        path = path.lstrip('/')
+        if not controllers:
+            folders.append((2, os.path.join(root, path)))
+        elif 'cpu' in controllers.split(','):
+            for name in (controllers, 'cpu', 'cpu,cpuacct'):
+                folders.append((1, os.path.join(root, name, path)))
+
+    # Inside a container the cgroup is usually mounted as the root
+    folders += [(2, root), (1, os.path.join(root, 'cpu')),
+                (1, os.path.join(root, 'cpu,cpuacct'))]
+    return folders
+
+
+def cgroup_cpu_limit(cgroup_file='/proc/self/cgroup', root='/sys/fs/cgroup'):
+    """Return the number of cpus allowed by the cgroup cpu quota, or None."""
+    for version, folder in _cgroup_folders(cgroup_file, root):
+        if version == 2:
+            line = _read_first_line(os.path.join(folder, 'cpu.max'))
+            if line is None:
+                continue
+            parts = line.split()
+            if len(parts) != 2 or parts[0] == 'max':
+                return None
+            quota, period = parts
+        else:
+            quota = _read_first_line(os.path.join(folder,
+                                                  'cpu.cfs_quota_us'))
+            period = _read_first_line(os.path.join(folder,
+                                                   'cpu.cfs_period_us'))
+            if quota is None or period is None:
+                continue
+
+        try:
+            quota, period = int(quota), int(period)
+        except ValueError:
+            return None
+        if quota <= 0 or period <= 0:
+            return None
+        return max(1, int(math.ceil(float(quota) / period)))
+    return None
+
+
+def _detect_cpu_count(_count=[]):
+    """Return the cpus usable by this process, detected only once."""
+    if not _count:
+        try:
+            import multiprocessing
+            count = multiprocessing.cpu_count()
+        except Exception:
+            print("Using fallback CPU count", file=sys.stderr)
+            count = 4
+
+        if hasattr(os, 'sched_getaffinity'):
+            try:
+                count = min(count, len(os.sched_getaffinity(0)))
+            except OSError:
+                pass
+
+        limit = cgroup_cpu_limit()
+        if limit is not None:
+            count = min(count, limit)
+        _count.append(max(1, count))
+    return _count[0]
+
+
+def cpu_count():
+    """
+    Return the cpu count.
+
+    The count honors the cpu affinity and the cgroup cpu quota of the
+    process (containers), and can be set with `CIOCHECK_JOBS`.
+    """
+    jobs = os.environ.get(JOBS_ENV)
+    if jobs:
+        try:
+            return max(1, int(jobs))
+        except ValueError:
+            print('Ignoring invalid {0}={1}'.format(JOBS_ENV, jobs),
+                  file=sys.stderr)
+    return _detect_cpu_count()
 
 
 def make_sorted_dict(dic):
@@ -8,13 +8,30 @@
 """Version control helpers. Find staged, commited, modified files/lines."""
 
 # Standard library imports
+from collections import OrderedDict
+import difflib
+import hashlib
+import json
 import os
 import re
+import sys
 
 # Local imports
-from ciocheck.config import (COMMITED_MODE, DEFAULT_BRANCH, STAGED_MODE,
-                             UNSTAGED_MODE)
-from ciocheck.utils import get_files, make_sorted_dict, run_command
+from ciocheck.config import (COMMITED_MODE, DEFAULT_BRANCH,
+                             DEFAULT_RENAME_SIMILARITY, INDEX_FOLDER,
+                             STAGED_MODE, UNSTAGED_MODE)
+from ciocheck.process import run_command
+from ciocheck.utils import (atomic_replace, blob_hash, file_hash, get_files,
+                            make_sorted_dict, run_parallel, stat_key)
+
+MAX_INDEX_BLOB_SIZE = 512 * 1024  # Larger files are only hashed
+MAX_DIFF_LINES = 20000  # Larger files are reported as entirely changed
+
+
+def print_error(error):
+    """Write the error output of a git or hg command to stderr, if any."""
+    if error and error.strip():
+        sys.stderr.write(error.rstrip('\n') + '\n')
 
 
 class DiffToolBase(object):
@@ -106,11 +123,25 @@ class GitDiffTool(DiffToolBase):
     MERGE_CONFLICT_RE = re.compile(r'^diff --cc ([^ \n]*)')
     HUNK_LINE_RE = re.compile(r'\+([0-9]*)')
 
-    def __init__(self, path):
-        """Thin wrapper for a subset of the `git diff` command."""
+    # Submodule lines of `git submodule status`, uninitialized ones start
+    # with a "-" and are skipped
+    SUBMODULE_RE = re.compile(r'^[ +U][0-9a-f]+ (.+?)(?: \(.*\))?$')
+
+    def __init__(self, path, pathspecs=None, top_level=None,
+                 rename_similarity=None):
+        """
+        Thin wrapper for a subset of the `git diff` command.
+
+        `rename_similarity` is the minimum similarity percentage for a file
+        to be considered renamed (or copied), 0 disables rename detection.
+        """
         self.path = path
-        self._top_level = None
-        self._is_repo = None
+        self.pathspecs = pathspecs or []
+        self.rename_similarity = (DEFAULT_RENAME_SIMILARITY
+                                  if rename_similarity is None else
+                                  int(rename_similarity or 0))
+        self._top_level = top_level
+        self._is_repo = True if top_level else None
 
     def _git_run_helper(self,
                         branch=DEFAULT_BRANCH,
@@ -132,21 +163,41 @@ class GitDiffTool(DiffToolBase):
         command += [
             '--no-color',
             '--no-ext-diff',
-            '--diff-filter=AM',  # Means "added" and "modified"
+            '--ignore-submodules',  # Submodules are handled as other roots
         ]
 
+        # Renamed and copied files only contribute their changed lines
+        if self.rename_similarity:
+            command += [
+                '--find-renames={0}%'.format(self.rename_similarity),
+                '--find-copies={0}%'.format(self.rename_similarity),
+                '--diff-filter=AMRC',  # Added, modified, renamed and copied
+            ]
+        else:
+            command += [
+                '--no-renames',
+                '--diff-filter=AM',  # Means "added" and "modified"
+            ]
+
         if files_only:
             command += [
                 '--name-only',
                 '-z',  # Means nul-separated names
             ]
 
+        # Pathspecs also limit the sources of renames, so with rename
+        # detection the paths are filtered once the diff is parsed
+        if self.pathspecs and not self.rename_similarity:
+            command += ['--'] + list(self.pathspecs)
+
+        if files_only:
             output, error = run_command(command, cwd=self.path)
-            print(error)
+            print_error(error)
             result = set(output.split('\x00'))
             result.discard('')  # There's an empty line in git output
             result = [os.path.join(self.top_level, i) for i in sorted(result)]
             result = [i for i in result if i.startswith(self.path)]
+            result = [i for i in result if self._in_pathspecs(i)]
         else:
             result, error = run_command(command, cwd=self.path)
 
@@ -168,12 +219,25 @@ class GitDiffTool(DiffToolBase):
         sections_dict = self._parse_source_sections(diff_str)
         for (src_path, diff_lines) in sections_dict.items():
             full_src_path = os.path.join(self.top_level, src_path)
+            if not self._in_pathspecs(full_src_path):
+                continue
             # Parse the hunk information for the source file
             # to determine lines changed for the source file
             diff_dict[full_src_path] = self._parse_lines(diff_lines)
 
-        ordered_diff_dict = make_sorted_dict(diff_dict)
-        return ordered_diff_dict
+        # Sorting is done by `DiffTool` once all roots are merged
+        return diff_dict
+
+    def _in_pathspecs(self, path):
+        """Return if `path` is one of the pathspecs or inside one of them."""
+        if not self.pathspecs:
+            return True
+        for pathspec in self.pathspecs:
+            pathspec = os.path.normpath(
+                os.path.join(self.top_level, pathspec))
+            if path == pathspec or path.startswith(pathspec + os.sep):
+                return True
+        return False
 
     def _parse_source_sections(self, diff_str):
         """Parse source sections from git diff."""
@@ -379,15 +443,172 @@ class GitDiffTool(DiffToolBase):
     def is_repo(self):
         """Return if it is a git repo."""
         if self._is_repo is None:
-            args = ['git', 'rev-parse']
-            output, error = run_command(args, cwd=self.path)
+            # A single call tells both if this is a repo and its top level
+            output, error = run_command(
+                ['git', 'rev-parse', '--show-toplevel', '--encoding=utf-8'],
+                cwd=self.path, )
             if error:
-                print(error)
+                # Probing folders outside a repo is expected, stay quiet
                 return False
             else:
-                self._is_repo = (not bool(error) and not bool(output))
+                self._top_level = output.split('\n')[0]
+                self._is_repo = True
         return self._is_repo
 
+    def index_entries(self):
+        """Return `{path: (mode, blob id)}` of the files in the index."""
+        command = ['git', 'ls-files', '--stage', '-z']
+        if self.pathspecs:
+            command += ['--'] + list(self.pathspecs)
+        output, error = run_command(command, cwd=self.top_level)
+        if error:
+            print_error(error)
+
+        results = {}
+        for entry in output.split('\x00'):
+            if not entry:
+                continue
+            info, path = entry.split('\t', 1)
+            mode, blob_id, stage = info.split()
+            if stage == '0':  # Skip unmerged entries
+                path = os.path.join(self.top_level, path)
+                results[os.path.normpath(path)] = (mode, blob_id)
+        return results
+
+    def read_blobs(self, blob_ids):
+        """Read the contents of `blob_ids` with one `git cat-file` process."""
+        blob_ids = list(blob_ids)
+        if not blob_ids:
+            return {}
+
+        input_data = ('\n'.join(blob_ids) + '\n').encode('ascii')
+        output, error = run_command(
+            ['git', 'cat-file', '--batch'],
+            cwd=self.top_level,
+            input_data=input_data,
+            decode=False)
+        if error:
+            print_error(error)
+
+        # Output is a sequence of "<id> <type> <size>\n<contents>\n"
+        results = {}
+        position = 0
+        while position < len(output):
+            header_end = output.index(b'\n', position)
+            header = output[position:header_end].decode('ascii').split()
+            position = header_end + 1
+            if len(header) != 3:  # "<id> missing"
+                continue
+            size = int(header[2])
+            results[header[0]] = output[position:position + size]
+            position += size + 1
+        return results
+
+    def resolve_commit(self, rev):
+        """Return the commit id of `rev`, None if it does not exist."""
+        output, _ = run_command(
+            ['git', 'rev-parse', '--verify', '--quiet', rev + '^{commit}'],
+            cwd=self.top_level)
+        return output.strip() or None
+
+    def dirty_files(self):
+        """Return the tracked files whose working tree stat does not match."""
+        command = ['git', 'diff-files', '--name-only', '-z']
+        if self.pathspecs:
+            command += ['--'] + list(self.pathspecs)
+        output, error = run_command(command, cwd=self.top_level)
+        if error:
+            print_error(error)
+        return set(
+            os.path.normpath(os.path.join(self.top_level, path))
+            for path in output.split('\x00') if path)
+
+    def hash_objects(self, paths):
+        """Return `{path: blob id}` of files with one `git hash-object`."""
+        paths = [path for path in paths if '\n' not in path]
+        if not paths:
+            return {}
+
+        rel_paths = [os.path.relpath(path, self.top_level) for path in paths]
+        input_data = ('\n'.join(rel_paths) + '\n').encode('utf-8')
+        output, error = run_command(
+            ['git', 'hash-object', '--stdin-paths'],
+            cwd=self.top_level,
+            input_data=input_data)
+        if error:
+            print_error(error)
+            return {}
+        return dict(zip(paths, output.split()))
+
+    def file_fingerprints(self, paths=None):
+        """
+        Return `{path: blob id}` of `paths`, all tracked files by default.
+
+        Ids of clean tracked files come from the index, so only files git
+        finds dirty, untracked files and symlinks are hashed. Ids are git
+        blob ids, the same `file_hash` returns.
+        """
+        entries = self.index_entries()
+        dirty = self.dirty_files()
+        if paths is None:
+            paths = [path for path, (mode, _) in entries.items()
+                     if mode != '160000']  # Skip submodules
+
+        results, to_hash = {}, []
+        for path in paths:
+            path = os.path.normpath(path)
+            mode, blob_id = entries.get(path, (None, None))
+            if mode in ('100644', '100755') and path not in dirty:
+                results[path] = blob_id
+            elif os.path.islink(path):
+                # Git would hash the link target path, not the file
+                if os.path.isfile(path):
+                    results[path] = file_hash(path)
+            elif os.path.isfile(path):
+                to_hash.append(path)
+
+        results.update(self.hash_objects(to_hash))
+        for path in to_hash:
+            if path not in results:
+                results[path] = file_hash(path)
+        return results
+
+    def write_index(self, path, contents, mode='100644'):
+        """Store `contents` (bytes) as the staged version of `path`."""
+        rel_path = os.path.relpath(path, self.top_level).replace(os.sep, '/')
+        output, error = run_command(
+            ['git', 'hash-object', '-w', '--stdin', '--path', rel_path],
+            cwd=self.top_level,
+            input_data=contents)
+        if error:
+            print_error(error)
+            return False
+
+        blob_id = output.strip()
+        output, error = run_command(
+            ['git', 'update-index', '--add', '--cacheinfo', mode, blob_id,
+             rel_path],
+            cwd=self.top_level)
+        if error:
+            print_error(error)
+            return False
+        return True
+
+    def submodules(self):
+        """Return the top level of initialized submodules, recursively."""
+        output, error = run_command(
+            ['git', 'submodule', 'status', '--recursive'], cwd=self.top_level)
+        if error:
+            print_error(error)
+
+        results = []
+        for line in output.splitlines():
+            match = self.SUBMODULE_RE.match(line)
+            if match:
+                path = os.path.join(self.top_level, match.group(1))
+                results.append(os.path.normpath(path))
+        return results
+
     @property
     def top_level(self):
         """Return the top level for the git repo."""
@@ -396,7 +617,7 @@ class GitDiffTool(DiffToolBase):
                 ['git', 'rev-parse', '--show-toplevel', '--encoding=utf-8'],
                 cwd=self.path, )
             if error:
-                print(error)
+                print_error(error)
                 return None
             else:
                 self._top_level = output.split('\n')[0]
@@ -434,25 +655,195 @@ class GitDiffTool(DiffToolBase):
         return result
 
 
+class StatIndex(object):
+    """
+    Persistent stat index of a folder not under version control.
+
+    Every file is recorded with its size, modification time, inode and blob
+    id, and a copy of its content is kept by blob id, so changed lines can
+    be computed against the content of the last successful run.
+    """
+
+    VERSION = 1
+
+    def __init__(self, folder):
+        """Persistent stat index of a folder not under version control."""
+        self.folder = folder
+        self.index_path = os.path.join(folder, 'index.json')
+        self.blobs_path = os.path.join(folder, 'blobs')
+        self.time = 0
+        self.entries = {}  # {relative path: [size, mtime_ns, inode, blob_id]}
+        self.load()
+
+    def _blob_path(self, blob_id):
+        """Return the path of the copy of a blob."""
+        return os.path.join(self.blobs_path, blob_id[:2], blob_id[2:])
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    def load(self):
+        """Load the index, an unreadable index is considered empty."""
+        try:
+            with open(self.index_path, 'r') as file_obj:
+                data = json.load(file_obj)
+                stat = os.fstat(file_obj.fileno())
+        except (IOError, OSError, ValueError):
+            return
+
+        if data.get('version') == self.VERSION:
+            # The file system clock, so it compares with file mtimes
+            self.time = stat_key(stat)[1]
+            self.entries = data['entries']
+
+    def is_clean(self, relative_path, stat):
+        """
+        Return if the file is unchanged according to its stat.
+
+        Files modified after the index was written, or in the same clock
+        tick, could have changed without their stat changing, so they are
+        never considered clean.
+        """
+        entry = self.entries.get(relative_path)
+        if entry is None:
+            return False
+        key = stat_key(stat)
+        return entry[:3] == key and key[1] < self.time
+
+    def read_blob(self, blob_id):
+        """Return the stored content of a blob, None if not available."""
+        try:
+            with open(self._blob_path(blob_id), 'rb') as file_obj:
+                return file_obj.read()
+        except (IOError, OSError):
+            return None
+
+    def save(self, entries, blobs):
+        """
+        Replace the index with `entries`, storing the new `blobs`.
+
+        `blobs` is a `{blob_id: contents}` dict of the blobs not stored yet.
+        Blobs not referenced by the new entries are removed.
+        """
+        for blob_id, contents in blobs.items():
+            blob_path = self._blob_path(blob_id)
+            if not os.path.isfile(blob_path):
+                folder = os.path.dirname(blob_path)
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+                atomic_replace(blob_path, contents, encoding=None)
+
+        data = {'version': self.VERSION, 'entries': entries}
+        atomic_replace(self.index_path, json.dumps(data), 'utf-8')
+        self.entries = entries
+        self.time = stat_key(os.stat(self.index_path))[1]
+
+        used = set(entry[3] for entry in entries.values())
+        for folder, _, files in os.walk(self.blobs_path):
+            for name in files:
+                blob_id = os.path.basename(folder) + name
+                if blob_id not in used:
+                    try:
+                        os.remove(os.path.join(folder, name))
+                    except OSError:
+                        pass
+
+
 class NoDiffTool(DiffToolBase):
-    """Thin wrapper for a folder not under version control."""
+    """
+    Diff tool for a folder not under version control.
 
-    def __init__(self, path):
-        """Thin wrapper for a folder not under version control."""
+    Files and lines are reported as modified when they changed since the
+    last successful run, recorded in a `StatIndex` by `commit_index`. Without
+    an index every file is modified. The diff modes are all equivalent.
+    """
+
+    def __init__(self, path, index_folder=None):
+        """Diff tool for a folder not under version control."""
         self.path = path
+        if index_folder is None:
+            index_folder = os.path.join(path, INDEX_FOLDER)
+        self.index_folder = index_folder
+        self._index = None
+        self._changes = None
+
+    @property
+    def index(self):
+        """Return the stat index of the folder, loaded on first use."""
+        if self._index is None:
+            self._index = StatIndex(self.index_folder)
+        return self._index
+
+    def _relative_path(self, path):
+        """Return the index key of `path`."""
+        return os.path.relpath(path, self.path).replace(os.sep, '/')
+
+    @staticmethod
+    def _is_binary(contents):
+        """Return if `contents` look binary, like git does."""
+        return b'\0' in contents[:8000]
+
+    def _is_indexable(self, contents):
+        """Return if a copy of `contents` is kept to diff them later."""
+        return (len(contents) <= MAX_INDEX_BLOB_SIZE and
+                not self._is_binary(contents))
+
+    def _changed_lines(self, old_contents, contents):
+        """Return `(added, deleted)` line numbers between two contents."""
+        lines = contents.splitlines()
+        if old_contents is None:
+            return list(range(1, len(lines) + 1)), []
+
+        # The matcher is quadratic in the worst case
+        old_lines = old_contents.splitlines()
+        if max(len(old_lines), len(lines)) > MAX_DIFF_LINES:
+            return (list(range(1, len(lines) + 1)),
+                    list(range(1, len(old_lines) + 1)))
+
+        added, deleted = [], []
+        matcher = difflib.SequenceMatcher(
+            None, old_lines, lines, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag in ('replace', 'insert'):
+                added.extend(range(j1 + 1, j2 + 1))
+            if tag in ('replace', 'delete'):
+                deleted.extend(range(i1 + 1, i2 + 1))
+        return added, deleted
+
+    def _file_changes(self, path):
+        """Return `(added, deleted)` for a changed file, None if unchanged."""
+        relative_path = self._relative_path(path)
+        if self.index.is_clean(relative_path, os.stat(path)):
+            return None
+
+        with open(path, 'rb') as file_obj:
+            contents = file_obj.read()
+        entry = self.index.entries.get(relative_path)
+        if entry is not None and entry[3] == blob_hash(contents):
+            return None
+
+        if self._is_binary(contents):
+            return [], []
+
+        old_contents = None
+        if entry is not None:
+            old_contents = self.index.read_blob(entry[3])
+        return self._changed_lines(old_contents, contents)
+
+    def _get_changes(self):
+        """Return `{path: (added, deleted)}` of the files changed."""
+        if self._changes is None:
+            paths = get_files(paths=[self.path])
+            changes = run_parallel(self._file_changes, paths)
+            self._changes = make_sorted_dict(
+                dict((path, lines) for path, lines in zip(paths, changes)
+                     if lines is not None))
+        return self._changes
 
     def _get_files_helper(self, lines=False):
-        paths = get_files(paths=[self.path])
+        changes = self._get_changes()
         if lines:
-            paths_dic = {}
-            for path in paths:
-                paths_dic[path] = (
-                    [-1],
-                    range(100000), )
-            results = paths_dic
-        else:
-            results = paths
-        return results
+            return changes
+        return list(changes.keys())
 
     # --- Public API
     # -------------------------------------------------------------------------
@@ -465,6 +856,34 @@ class NoDiffTool(DiffToolBase):
         """Return always True as this handles folders not under VC."""
         return True
 
+    def commit_index(self):
+        """Record the current content of the files as the last good run."""
+        index = self.index
+        entries, blobs = {}, {}
+
+        def read_entry(path):
+            """Return the index entry of `path` and its contents if new."""
+            relative_path = self._relative_path(path)
+            stat = os.stat(path)
+            entry = index.entries.get(relative_path)
+            if index.is_clean(relative_path, stat):
+                return relative_path, entry, None
+            with open(path, 'rb') as file_obj:
+                contents = file_obj.read()
+            entry = stat_key(stat) + [blob_hash(contents)]
+            if not self._is_indexable(contents):
+                contents = None
+            return relative_path, entry, contents
+
+        for relative_path, entry, contents in run_parallel(
+                read_entry, get_files(paths=[self.path])):
+            entries[relative_path] = entry
+            if contents is not None:
+                blobs[entry[3]] = contents
+
+        index.save(entries, blobs)
+        self._changes = None
+
     def commited_files(self, branch=DEFAULT_BRANCH):
         """Return list of commited files."""
         return self._get_files_helper()
@@ -499,62 +918,193 @@ class DiffTool(object):
         NoDiffTool,
     ]
 
-    def __init__(self, paths):
-        """Generic diff tool for handling mercurial, git and no vcs folders."""
+    def __init__(self, paths, rename_similarity=None, index_folder=None):
+        """
+        Generic diff tool for handling mercurial, git and no vcs folders.
+
+        `index_folder` holds the stat indexes of the folders not under
+        version control, by default they are kept inside every folder.
+        """
         self.paths = paths
+        self.rename_similarity = rename_similarity
+        self.index_folder = index_folder
         self.diff_tools = {}
 
-        for path in self.paths:
-            for diff_tool in self.TOOLS:
-                tool = diff_tool(path)
-                if tool.is_repo():
-                    if tool.top_level not in self.diff_tools:
-                        self.diff_tools[tool.top_level] = tool
-                    break
+        # Find the root of every path, including the submodules they contain
+        roots = OrderedDict()
+        for path, tool in zip(self.paths, run_parallel(self._probe, paths)):
+            if tool is not None:
+                roots.setdefault(tool.top_level, (tool, []))[1].append(path)
+
+        for top_level, (tool, root_paths) in roots.items():
+            if isinstance(tool, GitDiffTool):
+                tool = GitDiffTool(
+                    top_level, pathspecs=root_paths, top_level=top_level,
+                    rename_similarity=rename_similarity)
+            elif isinstance(tool, NoDiffTool) and index_folder is not None:
+                tool = NoDiffTool(
+                    top_level, index_folder=self._index_folder(top_level))
+            self.diff_tools[top_level] = tool
+
+        git_tools = [t for t in self.diff_tools.values()
+                     if isinstance(t, GitDiffTool)]
+        for submodules in run_parallel(lambda t: t.submodules(), git_tools):
+            for submodule in submodules:
+                if submodule in self.diff_tools:
+                    continue
+                if any(self._contains(path, submodule) for path in paths):
+                    self.diff_tools[submodule] = GitDiffTool(
+                        submodule, pathspecs=[submodule], top_level=submodule,
+                        rename_similarity=rename_similarity)
+
+    def _probe(self, path):
+        """Return the diff tool handling `path`."""
+        for diff_tool in self.TOOLS:
+            tool = diff_tool(path)
+            if tool.is_repo():
+                return tool
+
+    def _index_folder(self, path):
+        """Return the stat index folder of a folder without version control."""
+        name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.index_folder, name[:16])
+
+    @staticmethod
+    def _contains(folder, path):
+        """Return if `path` is `folder` or is located inside it."""
+        folder = os.path.normpath(folder)
+        return path == folder or path.startswith(folder + os.sep)
+
+    def _gather_files(self, method, **kwargs):
+        """Call `method` on every root concurrently and merge the lists."""
+        tools = list(self.diff_tools.values())
+        all_results = run_parallel(
+            lambda tool: getattr(tool, method)(**kwargs), tools)
+        results = set()
+        for tool_results in all_results:
+            results.update(tool_results)
+        return list(sorted(results))
+
+    def _gather_file_lines(self, method, **kwargs):
+        """Call `method` on every root concurrently and merge the dicts."""
+        tools = list(self.diff_tools.values())
+        all_results = run_parallel(
+            lambda tool: getattr(tool, method)(**kwargs), tools)
+        results = {}
+        for tool_results in all_results:
+            results.update(tool_results)
+        return make_sorted_dict(results)
+
+    def _git_tool_for(self, path):
+        """Return the git diff tool of the innermost root containing path."""
+        tools = [(top_level, tool)
+                 for top_level, tool in self.diff_tools.items()
+                 if isinstance(tool, GitDiffTool) and
+                 self._contains(top_level, path)]
+        if tools:
+            return sorted(tools, key=lambda item: len(item[0]))[-1][1]
 
     # --- Public API
     # -------------------------------------------------------------------------
+    def staged_contents(self, paths):
+        """
+        Return `{path: (mode, contents)}` with the staged content of paths.
+
+        Contents are read in a single `git cat-file --batch` call per root.
+        Paths not in the index are skipped.
+        """
+        paths_by_tool = OrderedDict()
+        for path in paths:
+            tool = self._git_tool_for(path)
+            if tool is not None:
+                paths_by_tool.setdefault(tool, []).append(path)
+
+        def read_tool_contents(item):
+            """Read the staged contents of the paths of a single root."""
+            tool, tool_paths = item
+            entries = tool.index_entries()
+            entries = dict((os.path.normpath(p), entries[os.path.normpath(p)])
+                           for p in tool_paths
+                           if os.path.normpath(p) in entries)
+            blobs = tool.read_blobs(set(b for (_, b) in entries.values()))
+            return dict((path, (mode, blobs[blob_id]))
+                        for path, (mode, blob_id) in entries.items()
+                        if blob_id in blobs)
+
+        results = {}
+        for tool_results in run_parallel(read_tool_contents,
+                                         paths_by_tool.items()):
+            results.update(tool_results)
+        return results
+
+    def file_fingerprints(self, paths):
+        """
+        Return `{path: blob id}` of the content of the files in `paths`.
+
+        Files in git repositories get their ids from git, with one call per
+        root, other files are hashed.
+        """
+        paths_by_tool = OrderedDict()
+        results = {}
+        for path in paths:
+            tool = self._git_tool_for(path)
+            if tool is not None:
+                paths_by_tool.setdefault(tool, []).append(path)
+            elif os.path.isfile(path):
+                results[os.path.normpath(path)] = file_hash(path)
+
+        for tool_results in run_parallel(
+                lambda item: item[0].file_fingerprints(item[1]),
+                paths_by_tool.items()):
+            results.update(tool_results)
+        return results
+
+    def base_commits(self, branch=DEFAULT_BRANCH):
+        """Return `{top level: (HEAD, branch)}` commit ids of git roots."""
+        tools = [tool for tool in self.diff_tools.values()
+                 if isinstance(tool, GitDiffTool)]
+        commits = run_parallel(
+            lambda tool: (tool.resolve_commit('HEAD'),
+                          tool.resolve_commit(branch)), tools)
+        return dict((tool.top_level, tool_commits)
+                    for tool, tool_commits in zip(tools, commits))
+
+    def write_index(self, path, contents, mode='100644'):
+        """Store `contents` (bytes) as the staged version of `path`."""
+        tool = self._git_tool_for(path)
+        if tool is None:
+            return False
+        return tool.write_index(path, contents, mode=mode)
+
+    def commit_index(self):
+        """Record the files of the folders not under version control."""
+        tools = [tool for tool in self.diff_tools.values()
+                 if isinstance(tool, NoDiffTool)]
+        run_parallel(lambda tool: tool.commit_index(), tools)
+
     def commited_files(self, branch=DEFAULT_BRANCH):
         """Return list of commited files."""
-        results = []
-        for diff_tool in self.diff_tools.values():
-            results += diff_tool.commited_files(branch=branch)
-        return list(sorted(results))
+        return self._gather_files('commited_files', branch=branch)
 
     def staged_files(self):
         """Return list of staged files."""
-        results = []
-        for diff_tool in self.diff_tools.values():
-            results += diff_tool.staged_files()
-        return list(sorted(results))
+        return self._gather_files('staged_files')
 
     def unstaged_files(self):
         """Return list of unstaged files."""
-        results = []
-        for diff_tool in self.diff_tools.values():
-            results += diff_tool.unstaged_files()
-        return list(sorted(results))
+        return self._gather_files('unstaged_files')
 
     def commited_file_lines(self, branch=DEFAULT_BRANCH):
         """Return commited files and lines modified."""
-        results = {}
-        for diff_tool in self.diff_tools.values():
-            results.update(diff_tool.commited_file_lines(branch=branch))
-        return make_sorted_dict(results)
+        return self._gather_file_lines('commited_file_lines', branch=branch)
 
     def staged_file_lines(self):
         """Return unstaged files and lines modified."""
-        results = {}
-        for diff_tool in self.diff_tools.values():
-            results.update(diff_tool.staged_file_lines())
-        return make_sorted_dict(results)
+        return self._gather_file_lines('staged_file_lines')
 
     def unstaged_file_lines(self):
         """Return staged files and lines modified."""
-        results = {}
-        for diff_tool in self.diff_tools.values():
-            results.update(diff_tool.unstaged_file_lines())
-        return make_sorted_dict(results)
+        return self._gather_file_lines('unstaged_file_lines')
 
 
 def test():
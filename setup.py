@@ -60,7 +60,9 @@ setup(
     ],
     entry_points={
         'gui_scripts': [
-            'ciocheck = ciocheck.main:main'
+            'ciocheck = ciocheck.main:main',
+            'ciocheck-cache = ciocheck.main:cache_main',
+            'ciocheck-merge = ciocheck.main:merge_main',
         ]
     },
     include_package_data=True, )